@@ -1,19 +1,51 @@
-from asyncio import run, sleep
-from copy import deepcopy
+from analytics import ANALYTICS
+from asyncio import create_task, gather, get_running_loop, run
+from clock import CLOCK_SAMPLES, ExchangeClock
 from datetime import datetime, timedelta
 from logger import logger
-from misc import Liquidation, LiquidationSet
+from loop_monitor import get_percentiles, get_rss_mb, LoopMonitor
+from misc import (
+    BASE_TIME_FRAME,
+    is_time_frame_close,
+    Liquidation,
+    LiquidationSet,
+    TIME_FRAMES,
+)
+from order_book import USE_ORDER_BOOK
+from order_registry import ORDER_REGISTRY
+from pipeline import PIPELINE_MODE, Pipeline
+from recorder import CLOCK, RECORDER, REPLAY_SESSION, ReplaySession
+from settings import SETTINGS
+from state_api import USE_STATE_API, StateServer
+import signal
 import threading
+from time import perf_counter
 from typing import List
+from venues import Venue
 
+from admin import USE_ADMIN_SOCKET, AdminServer
 from coinalyze_scanner import CoinalyzeScanner, COINALYZE_LIQUIDATION_URL
-from discord_client import USE_DISCORD, get_discord_table
-from exchange import Exchange, TICKER, LEVERAGE
+from discord_client import (
+    NOTIFICATION_TELEMETRY_MINUTES,
+    USE_DISCORD,
+    get_static_discord_table,
+)
+from exchange import (
+    Exchange,
+    LEVERAGE,
+    KEEP_ALIVE_INTERVAL,
+    SUB_ACCOUNTS,
+    USE_EXIT_MANAGER,
+)
 
 
 if USE_DISCORD:
     from coinalyze_scanner import INTERVAL, N_MINUTES_TIMEDELTA
-    from discord_client import post_to_discord, DISCORD_CHANNEL_HEARTBEAT_ID
+    from discord_client import (
+        get_discord_table,
+        post_to_discord,
+        DISCORD_CHANNEL_HEARTBEAT_ID,
+    )
     from exchange import (
         POSITION_PERCENTAGE,
         USE_LIVE_STRATEGY,
@@ -46,6 +78,7 @@ if USE_DISCORD:
         minimal_nr_of_liquidations=MINIMAL_NR_OF_LIQUIDATIONS,
         minimal_liquidation=MINIMAL_LIQUIDATION,
         interval=INTERVAL,
+        time_frames=TIME_FRAMES,
     )
     if USE_LIVE_STRATEGY:
         DISCORD_SETTINGS["live_sl_percentage"] = LIVE_SL_PERCENTAGE
@@ -75,107 +108,380 @@ LIQUIDATIONS: List[Liquidation] = []
 LIQUIDATION_SET: LiquidationSet = LiquidationSet(liquidations=LIQUIDATIONS)
 
 
-async def main() -> None:
-    first_run = True
-
-    # enable scanner
-    scanner = CoinalyzeScanner(datetime.now(), LIQUIDATION_SET)
-    await scanner.set_symbols()
+def create_exchange(scanner: CoinalyzeScanner) -> Exchange:
+    """Create the exchange of the main account, sub-accounts follow its signals"""
 
-    # enable exchange
-    exchange = Exchange(LIQUIDATION_SET, scanner)
+    exchange = Exchange(scanner.liquidation_set, scanner)
+    exchange.followers = [
+        Exchange(
+            scanner.liquidation_set,
+            scanner,
+            account=account,
+            discord_message_queue=exchange.discord_message_queue,
+        )
+        for account in SUB_ACCOUNTS
+    ]
     scanner.exchange = exchange
+    return exchange
 
-    for direction in ["long", "short"]:
-        await exchange.set_leverage(
-            symbol=TICKER,
-            leverage=LEVERAGE,
-            direction=direction,
-        )
 
-    # start the bot
-    info = "Starting / Restarting the bot"
-    logger.info(info + "...")
-    logger.info(
-        "BTC markets that will be scanned: %s", ", ".join(scanner.symbols.split(","))
-    )
+async def reload_settings(exchange: Exchange) -> None:
+    """Swap in the changed settings and re-derive what depends on them, the leverage,
+    position sizes and order templates of every account"""
+
+    try:
+        changes = SETTINGS.reload()
+    except Exception as e:
+        if USE_DISCORD:
+            exchange.discord_message_queue.append(
+                (
+                    DISCORD_CHANNEL_HEARTBEAT_ID,
+                    ["Invalid settings, keeping the current settings:", str(e)],
+                    False,
+                )
+            )
+        return
+    if not changes:
+        return
+
+    settings = SETTINGS.current
+    for account in exchange.accounts:
+        if "LEVERAGE" in changes:
+            account.risk.leverage = settings.leverage
+            for direction in ["long", "short"]:
+                await account.set_leverage(
+                    leverage=settings.leverage, direction=direction
+                )
+        await account.set_position_sizes()
+        account.build_order_templates()
+
     if USE_DISCORD:
-        DISCORD_SETTINGS["symbols"] = scanner.symbols.split(",")
         exchange.discord_message_queue.append(
             (
                 DISCORD_CHANNEL_HEARTBEAT_ID,
-                [f"{info} with settings:\n{get_discord_table(DISCORD_SETTINGS)}"],
+                [
+                    f"Settings reloaded (version {settings.version}):",
+                    get_discord_table(
+                        {
+                            name: f"{old} -> {new}"
+                            for name, (old, new) in changes.items()
+                        }
+                    ),
+                ],
                 False,
             )
         )
 
-    while True:
-        now = datetime.now()
 
-        if (now.minute % 5 == 0 and now.second == 0) or first_run:
+async def run_cycle(
+    now: datetime,
+    first_run: bool,
+    exchange: Exchange,
+    scanner: CoinalyzeScanner,
+    loop_monitor: LoopMonitor,
+    pipeline: Pipeline | None = None,
+) -> None:
+    """Run the work that is scheduled at exchange time now"""
 
-            # disable first_run if needed
-            if first_run:
-                first_run = False
+    if is_time_frame_close(now, BASE_TIME_FRAME) or first_run:
 
-            # update scanner time
-            scanner.now = now
+        # update scanner time
+        scanner.now = now
 
-            # run strategy for the exchange on LIQUIDATIONS list
-            await exchange.run_loop()
+        # run strategy for the exchange on the liquidations of every time frame
+        await exchange.run_loop(now.timestamp())
 
-            # check for fresh liquidations and add to LIQUIDATIONS list
-            await scanner.handle_liquidation_set(
-                await exchange.get_last_candle(),
-                await scanner.handle_coinalyze_url(COINALYZE_LIQUIDATION_URL),
+        # check for fresh liquidations of every time frame that closed
+        if pipeline is None:
+            # fetch the candle, liquidations and market data at the same time
+            candle, buckets, _ = await gather(
+                exchange.get_last_candle(now.timestamp()),
+                scanner.handle_coinalyze_url(COINALYZE_LIQUIDATION_URL),
+                scanner.handle_market_feeds(),
             )
+            await scanner.handle_time_frames(candle, buckets)
+        else:
+            pipeline.check_processes()
 
-            # log liquidations if any
-            if LIQUIDATIONS:
-                logger.info(f"{LIQUIDATIONS=}")
+        # log liquidations if any
+        for time_frame, liquidation_set in scanner.liquidation_sets.items():
+            if liquidation_set.liquidations:
+                logger.info(
+                    f"{time_frame} liquidations: {liquidation_set.liquidations}"
+                )
 
-            await sleep(0.99)
+        # log the event loop lag
+        logger.info(f"Loop lag (ms): {loop_monitor.stats()}")
 
-        if now.minute % 5 == 3 and now.second == 0:
+    if now.minute % 5 == 3 and now.second == 0:
 
-            # fetch open positions and orders from the exchange
-            await exchange.get_open_positions()
+        # fetch open positions and orders from the exchange
+        await gather(*(account.get_open_positions() for account in exchange.accounts))
 
-            await sleep(0.99)
+    # remove old liquidations a minute before the close of their time frame
+    for time_frame, liquidation_set in scanner.liquidation_sets.items():
+        if is_time_frame_close(now + timedelta(minutes=1), time_frame):
+            liquidation_set.remove_old_liquidations(now + timedelta(minutes=1))
 
-        if now.minute % 5 == 4 and now.second == 0:
+    if now.minute % 5 == 4 and now.second == 0:
 
-            # remove old liquidations from the LIQUIDATIONS list
-            exchange.liquidation_set.remove_old_liquidations(now + timedelta(minutes=1))
+        # recalculate position sizes based on current balance
+        await gather(*(account.set_position_sizes() for account in exchange.accounts))
 
-            # recalculate position sizes based on current balance
-            await exchange.set_position_sizes()
+    if USE_DISCORD and (now.hour % 12 == 8 and now.minute == 1 and now.second == 0):
 
-            await sleep(0.99)
+        # send heartbeat message to discord
+        exchange.discord_message_queue.append(
+            (
+                DISCORD_CHANNEL_HEARTBEAT_ID,
+                [f". loop lag (ms): {loop_monitor.stats()}"],
+                False,
+            )
+        )
 
-        if USE_DISCORD and (now.hour % 12 == 8 and now.minute == 1 and now.second == 0):
+    if (
+        NOTIFICATION_TELEMETRY_MINUTES > 0
+        and (now.hour * 60 + now.minute) % NOTIFICATION_TELEMETRY_MINUTES == 0
+        and now.second == 0
+    ):
 
-            # send heartbeat message to discord
+        # report the notification queue and the memory of the process
+        telemetry = dict(
+            **exchange.discord_message_queue.stats(), rss=f"{round(get_rss_mb(), 1)} MB"
+        )
+        logger.info(f"{telemetry=}")
+        if USE_DISCORD:
             exchange.discord_message_queue.append(
-                (DISCORD_CHANNEL_HEARTBEAT_ID, ["."], False)
+                (
+                    DISCORD_CHANNEL_HEARTBEAT_ID,
+                    [f"Telemetry:\n{get_discord_table(telemetry)}"],
+                    False,
+                )
             )
 
-            await sleep(0.99)
+    if (
+        USE_DISCORD
+        and ANALYTICS is not None
+        and (now.hour == 0 and now.minute == 0 and now.second == 0)
+    ):
+
+        # send the results per strategy of the day before to discord
+        day = (now - timedelta(days=1)).date()
+        exchange.discord_message_queue.append(
+            (
+                DISCORD_CHANNEL_HEARTBEAT_ID,
+                [
+                    f"Results of {day}:",
+                    get_discord_table(ANALYTICS.get_summary(day)),
+                ],
+                False,
+            )
+        )
 
-        if USE_DISCORD and exchange.discord_message_queue:
 
-            # post messages to discord from the queue
-            message_queue = deepcopy(exchange.discord_message_queue)
-            exchange.discord_message_queue.clear()
-            threading.Thread(
-                target=post_to_discord,
-                kwargs=dict(message_queue=message_queue),
-            ).start()
+async def main(pipeline: Pipeline | None = None) -> None:
+    first_run = True
+
+    # keep the background tasks, the event loop only keeps a weak reference to them
+    background_tasks = []
 
-            await sleep(0.99)
+    # measure the event loop lag and optionally open the admin socket
+    loop_monitor = LoopMonitor()
+    background_tasks.append(create_task(loop_monitor.run()))
+    loop_monitor.start_watchdog()
+    if USE_ADMIN_SOCKET:
+        await AdminServer(loop_monitor).start()
+
+    # enable scanner, in pipeline mode the scanner process does the scanning
+    scanner = CoinalyzeScanner(datetime.now(), LIQUIDATION_SET)
+    if RECORDER is not None:
+        RECORDER.record_scanner(scanner)
+    if pipeline is None:
+        await scanner.set_symbols()
+
+    # enable exchange, sub-accounts follow the signals of the main account
+    exchange = create_exchange(scanner)
+    for account in exchange.accounts:
+        if pipeline is not None:
+            account.journal_queue = []
+        if RECORDER is not None:
+            for venue in account.venues:
+                RECORDER.record_venue(venue, account.account)
+
+    # serve the in-memory state to dashboards on localhost
+    state_server = None
+    if USE_STATE_API:
+        state_server = StateServer(exchange, loop_monitor)
+        await state_server.start()
+
+    # schedule against the exchange clock instead of the local clock, the clock has
+    # its own venue so its samples are not recorded
+    clock = ExchangeClock(Venue.from_config(exchange.venue.name))
+    await clock.sync(nr_of_samples=CLOCK_SAMPLES)
+    background_tasks.append(create_task(clock.run()))
+    scanner.now = clock.now()
+
+    # reload the settings on SIGHUP next to changes of the settings file
+    if hasattr(signal, "SIGHUP"):
+        get_running_loop().add_signal_handler(signal.SIGHUP, SETTINGS.request_reload)
+
+    for account in exchange.accounts:
+        for direction in ["long", "short"]:
+            await account.set_leverage(leverage=LEVERAGE, direction=direction)
+
+        # warm up the order path
+        await account.warm_up()
+        await account.set_position_sizes()
+        if KEEP_ALIVE_INTERVAL > 0:
+            background_tasks.append(create_task(account.keep_alive()))
+        if len(account.venues) > 1 or USE_EXIT_MANAGER:
+            background_tasks.append(create_task(account.stream_prices()))
+        if USE_EXIT_MANAGER:
+            background_tasks.append(create_task(account.manage_exits()))
+        if USE_ORDER_BOOK:
+            background_tasks.append(create_task(account.stream_order_books()))
 
-        await sleep(0.01)
+    # start the bot
+    info = "Starting / Restarting the bot"
+    logger.info(info + "...")
+    if pipeline is None:
+        logger.info(
+            "BTC markets that will be scanned: %s",
+            ", ".join(scanner.symbols.split(",")),
+        )
+    if USE_DISCORD:
+        if pipeline is None:
+            DISCORD_SETTINGS["symbols"] = scanner.symbols.split(",")
+        settings_table = get_static_discord_table("settings", DISCORD_SETTINGS)
+        exchange.discord_message_queue.append(
+            (
+                DISCORD_CHANNEL_HEARTBEAT_ID,
+                [f"{info} with settings:\n{settings_table}"],
+                False,
+            )
+        )
+
+    try:
+        while True:
+            timestamp = clock.timestamp()
+            now = datetime.fromtimestamp(timestamp)
+            if RECORDER is not None:
+                RECORDER.write(CLOCK, "now", timestamp)
+
+            # add the liquidations of the scanner process
+            if pipeline is not None:
+                pipeline.receive_liquidations(scanner.liquidation_sets)
+
+            # swap in changed settings between cycles
+            if SETTINGS.should_reload():
+                await reload_settings(exchange)
+
+            cycle_started = perf_counter()
+            await run_cycle(now, first_run, exchange, scanner, loop_monitor, pipeline)
+            first_run = False
+            if state_server is not None:
+                state_server.record_cycle(timestamp, perf_counter() - cycle_started)
+
+            if ANALYTICS is not None:
+
+                # record the new signals and write the queued rows in one transaction
+                for liquidation_set in scanner.liquidation_sets.values():
+                    ANALYTICS.record_signals(liquidation_set.liquidations)
+                ANALYTICS.flush()
+
+            if RECORDER is not None and now.second == 0:
+
+                # append the recorded inputs of the last minute to the session log
+                RECORDER.flush()
+
+            if pipeline is not None:
+
+                # hand the messages and positions to journal over to the notifier process
+                pipeline.send_notifications(exchange.discord_message_queue)
+                for account in exchange.accounts:
+                    pipeline.send_journals(account.journal_queue)
+
+            elif USE_DISCORD:
+
+                # post the due messages to discord, the most important channels first
+                message_queue = exchange.discord_message_queue.drain()
+                if message_queue:
+                    threading.Thread(
+                        target=post_to_discord,
+                        kwargs=dict(message_queue=message_queue),
+                    ).start()
+
+            # wake up right after the next second of the exchange clock
+            await clock.sleep_until_next()
+    finally:
+        for task in background_tasks:
+            task.cancel()
+
+
+async def replay(path: str) -> None:
+    """Run a recorded session through the cycles of main as fast as possible, the
+    venue and coinalyze calls are answered from the session and nothing is posted,
+    journaled or persisted"""
+
+    session = ReplaySession(path)
+    ORDER_REGISTRY.path = ""
+    ORDER_REGISTRY.clear()
+    loop_monitor = LoopMonitor()
+
+    # a fresh liquidation set, so every replay of a session starts the same
+    scanner = CoinalyzeScanner(datetime.now(), LiquidationSet(liquidations=[]))
+    session.replay_scanner(scanner)
+    await scanner.set_symbols()
+    exchange = create_exchange(scanner)
+    for account in exchange.accounts:
+        account.journal_queue = []
+        for venue in account.venues:
+            session.replay_venue(venue, account.account)
+
+    # the calls main makes before the first cycle
+    for account in exchange.accounts:
+        for direction in ["long", "short"]:
+            await account.set_leverage(leverage=LEVERAGE, direction=direction)
+        await account.set_position_sizes()
+
+    cycle_times = []
+    started = perf_counter()
+    for index, timestamp in enumerate(session.timestamps):
+        cycle_started = perf_counter()
+        await run_cycle(
+            datetime.fromtimestamp(timestamp),
+            index == 0,
+            exchange,
+            scanner,
+            loop_monitor,
+        )
+        cycle_times.append(perf_counter() - cycle_started)
+        exchange.discord_message_queue.clear()
+        for account in exchange.accounts:
+            account.journal_queue.clear()
+
+    if len(cycle_times) > 1:
+        cycle_times_ms = [cycle_time * 1000 for cycle_time in cycle_times]
+        percentiles = get_percentiles(cycle_times_ms)
+        logger.info(
+            f"Replayed {len(cycle_times)} cycles in "
+            f"{round(perf_counter() - started, 3)} s, cycle time (ms) "
+            f"p50={percentiles['p50']} p99={percentiles['p99']} "
+            f"max={percentiles['max']}"
+        )
+    logger.info(
+        f"Replay diverged {session.misses} times, "
+        f"{session.remaining} recorded responses were not replayed"
+    )
 
 
 if __name__ == "__main__":
-    run(main())
+    if REPLAY_SESSION:
+        run(replay(REPLAY_SESSION))
+    else:
+        pipeline = None
+        if PIPELINE_MODE:
+            # fork the scanner and notifier before the event loop and clients exist
+            pipeline = Pipeline()
+            pipeline.start()
+        run(main(pipeline))
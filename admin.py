@@ -0,0 +1,194 @@
+from analytics import ANALYTICS
+from asyncio import (
+    all_tasks,
+    get_running_loop,
+    start_server,
+    to_thread,
+    Server,
+    StreamReader,
+    StreamWriter,
+    Task,
+)
+from collections import Counter
+from datetime import date, datetime
+from decouple import config
+from logger import logger
+from loop_monitor import describe_frame, LoopMonitor
+import os
+import signal
+import sys
+import threading
+from time import perf_counter, sleep
+from typing import List
+
+
+USE_ADMIN_SOCKET = config("USE_ADMIN_SOCKET", cast=bool, default=False)
+logger.info(f"{USE_ADMIN_SOCKET=}")
+if USE_ADMIN_SOCKET:
+    ADMIN_PORT = config("ADMIN_PORT", cast=int, default="8765")
+    logger.info(f"{ADMIN_PORT=}")
+    PROFILE_DIRECTORY = config("PROFILE_DIRECTORY", default=".")
+    logger.info(f"{PROFILE_DIRECTORY=}")
+    PROFILE_SAMPLE_INTERVAL = config(
+        "PROFILE_SAMPLE_INTERVAL", cast=float, default="0.005"
+    )
+    logger.info(f"{PROFILE_SAMPLE_INTERVAL=}")
+
+ADMIN_HELP = """Commands:
+  tasks            list the running asyncio tasks with their await points
+  lag              report the event loop lag and the slowest recent callbacks
+  profile <sec>    sample the stacks for <sec> seconds into a flamegraph file
+  stats <strategy> [<since>]
+                   results of a strategy since a day (YYYY-MM-DD), with analytics
+  help             show this message
+"""
+
+
+def get_await_chain(coro) -> List[str]:
+    """Return the chain of await points of a coroutine, outermost first"""
+
+    chain = []
+    while coro is not None:
+        frame = getattr(coro, "cr_frame", None) or getattr(coro, "gi_frame", None)
+        if frame is None:
+            chain.append(type(coro).__name__)
+            break
+        chain.append(describe_frame(frame))
+        coro = getattr(coro, "cr_await", None) or getattr(coro, "gi_yieldfrom", None)
+    return chain
+
+
+def describe_task(task: Task) -> str:
+    """Describe a task with its current await points"""
+
+    state = "done" if task.done() else "pending"
+    return f"{task.get_name()} [{state}]: " + " -> ".join(
+        get_await_chain(task.get_coro())
+    )
+
+
+def list_tasks() -> List[str]:
+    """Describe all running asyncio tasks"""
+
+    return [describe_task(task) for task in all_tasks()]
+
+
+def get_folded_stack(frame) -> str:
+    """Fold a stack into a single flamegraph line, outermost frame first"""
+
+    stack = []
+    while frame is not None:
+        stack.append(describe_frame(frame))
+        frame = frame.f_back
+    return ";".join(reversed(stack))
+
+
+def sample_stacks(thread_id: int, seconds: float, interval: float) -> Counter:
+    """Sample the stack of a thread for a number of seconds"""
+
+    samples: Counter = Counter()
+    end = perf_counter() + seconds
+    while perf_counter() < end:
+        frame = sys._current_frames().get(thread_id)
+        if frame is not None:
+            samples[get_folded_stack(frame)] += 1
+        sleep(interval)
+    return samples
+
+
+def profile(thread_id: int, seconds: float) -> str:
+    """Profile a thread and dump the samples as a flamegraph compatible folded stack
+    file, returns the path of the file"""
+
+    samples = sample_stacks(thread_id, seconds, PROFILE_SAMPLE_INTERVAL)
+    path = os.path.join(
+        PROFILE_DIRECTORY, f"profile-{datetime.now().strftime('%Y%m%d-%H%M%S')}.folded"
+    )
+    with open(path, "w") as profile_file:
+        for stack, count in samples.most_common():
+            profile_file.write(f"{stack} {count}\n")
+    logger.info(f"Profile of {seconds}s with {sum(samples.values())} samples: {path}")
+    return path
+
+
+def get_lag_report(loop_monitor: LoopMonitor) -> str:
+    """Return the event loop lag and the slowest recent callbacks as text"""
+
+    lines = [f"loop lag (ms): {loop_monitor.stats()}"]
+    for duration, timestamp, culprit in loop_monitor.blocking_events:
+        lines.append(
+            f"blocked {round(duration * 1000, 1)} ms at "
+            f"{datetime.fromtimestamp(timestamp).strftime('%H:%M:%S')}: {culprit}"
+        )
+    if not loop_monitor.instrumented:
+        lines.append("callback timing is not enabled")
+    for duration, timestamp, callback in loop_monitor.slowest_callbacks():
+        lines.append(
+            f"{round(duration * 1000, 1)} ms at "
+            f"{datetime.fromtimestamp(timestamp).strftime('%H:%M:%S')}: {callback}"
+        )
+    return "\n".join(lines)
+
+
+class AdminServer:
+    """Localhost only admin socket to inspect the running bot without a restart"""
+
+    def __init__(self, loop_monitor: LoopMonitor) -> None:
+        self.loop_monitor = loop_monitor
+        self.loop_thread_id = threading.get_ident()
+        self.server: Server | None = None
+
+    async def start(self) -> None:
+        """Start listening on localhost and enable the callback timing"""
+
+        self.loop_thread_id = threading.get_ident()
+        self.loop_monitor.instrument_callbacks()
+        self.server = await start_server(self.handle_client, "127.0.0.1", ADMIN_PORT)
+        logger.info(f"Admin socket listening on 127.0.0.1:{ADMIN_PORT}")
+
+        # dump the tasks and lag to the log on SIGUSR1
+        try:
+            get_running_loop().add_signal_handler(signal.SIGUSR1, self.log_state)
+        except (NotImplementedError, AttributeError, RuntimeError):
+            pass
+
+    def log_state(self) -> None:
+        """Log the running tasks and the event loop lag"""
+
+        logger.info("Tasks:\n" + "\n".join(list_tasks()))
+        logger.info(get_lag_report(self.loop_monitor))
+
+    async def run_command(self, command: str) -> str:
+        """Run a single admin command and return its output"""
+
+        name, *args = command.split() or ["help"]
+        if name == "tasks":
+            return "\n".join(list_tasks())
+        if name == "lag":
+            return get_lag_report(self.loop_monitor)
+        if name == "stats" and args and ANALYTICS is not None:
+            since = date.fromisoformat(args[1]) if len(args) > 1 else None
+            stats = ANALYTICS.get_stats(args[0], since=since)
+            return "\n".join(
+                f"{key}: {value}" for key, value in stats.to_dict().items()
+            )
+        if name == "profile":
+            seconds = float(args[0]) if args else 10.0
+            return await to_thread(profile, self.loop_thread_id, seconds)
+        return ADMIN_HELP
+
+    async def handle_client(self, reader: StreamReader, writer: StreamWriter) -> None:
+        """Answer the commands of an admin client, one per line"""
+
+        try:
+            while line := await reader.readline():
+                try:
+                    output = await self.run_command(line.decode().strip())
+                except Exception as e:
+                    output = f"Error: {e}"
+                writer.write(f"{output}\n".encode())
+                await writer.drain()
+        except Exception as e:
+            logger.warning(f"Admin socket error: {e}")
+        finally:
+            writer.close()
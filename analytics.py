@@ -0,0 +1,351 @@
+from dataclasses import asdict, dataclass, fields
+from datetime import date
+from decouple import config
+from logger import logger
+from misc import Liquidation
+from risk import OpenEntry
+import sqlite3
+from time import time
+from typing import Dict, List, Tuple
+
+
+USE_ANALYTICS = config("USE_ANALYTICS", cast=bool, default=False)
+logger.info(f"{USE_ANALYTICS=}")
+ANALYTICS_DATABASE = config("ANALYTICS_DATABASE", default="analytics.db")
+logger.info(f"{ANALYTICS_DATABASE=}")
+ANALYTICS_BATCH_SIZE = config("ANALYTICS_BATCH_SIZE", cast=int, default="50")
+logger.info(f"{ANALYTICS_BATCH_SIZE=}")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS signals (
+    signal_id TEXT PRIMARY KEY,
+    time INTEGER,
+    direction TEXT,
+    amount REAL,
+    nr_of_liquidations INTEGER,
+    z_score REAL,
+    funding_rate REAL
+);
+CREATE TABLE IF NOT EXISTS orders (
+    client_order_id TEXT PRIMARY KEY,
+    signal_id TEXT,
+    strategy_type TEXT,
+    account TEXT,
+    direction TEXT,
+    amount REAL,
+    price REAL,
+    fill_price REAL,
+    stoploss REAL,
+    takeprofit REAL,
+    time REAL
+);
+CREATE TABLE IF NOT EXISTS exits (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    client_order_id TEXT,
+    strategy_type TEXT,
+    account TEXT,
+    direction TEXT,
+    amount REAL,
+    entry_price REAL,
+    exit_price REAL,
+    pnl REAL,
+    reason TEXT,
+    time REAL
+);
+CREATE TABLE IF NOT EXISTS daily_stats (
+    strategy_type TEXT,
+    day TEXT,
+    trades INTEGER,
+    wins INTEGER,
+    pnl REAL,
+    gross_profit REAL,
+    gross_loss REAL,
+    max_prefix REAL,
+    min_prefix REAL,
+    max_drawdown REAL,
+    PRIMARY KEY (strategy_type, day)
+);
+"""
+
+
+@dataclass
+class Stats:
+    """Stats class to hold the aggregated results of a series of trades. The prefix
+    extremes of the equity curve make two consecutive series combine exactly,
+    including the max drawdown"""
+
+    trades: int = 0
+    wins: int = 0
+    pnl: float = 0.0
+    gross_profit: float = 0.0
+    gross_loss: float = 0.0
+    max_prefix: float = 0.0
+    min_prefix: float = 0.0
+    max_drawdown: float = 0.0
+
+    def add(self, pnl: float) -> None:
+        """Add the result of a single trade"""
+
+        self.combine(
+            Stats(
+                trades=1,
+                wins=1 if pnl > 0 else 0,
+                pnl=pnl,
+                gross_profit=max(pnl, 0.0),
+                gross_loss=min(pnl, 0.0),
+                max_prefix=max(pnl, 0.0),
+                min_prefix=min(pnl, 0.0),
+                max_drawdown=max(-pnl, 0.0),
+            )
+        )
+
+    def combine(self, other: "Stats") -> "Stats":
+        """Append the trades of a later series"""
+
+        self.max_drawdown = max(
+            self.max_drawdown,
+            other.max_drawdown,
+            self.max_prefix - (self.pnl + other.min_prefix),
+        )
+        self.max_prefix = max(self.max_prefix, self.pnl + other.max_prefix)
+        self.min_prefix = min(self.min_prefix, self.pnl + other.min_prefix)
+        self.trades += other.trades
+        self.wins += other.wins
+        self.pnl += other.pnl
+        self.gross_profit += other.gross_profit
+        self.gross_loss += other.gross_loss
+        return self
+
+    @property
+    def win_rate(self) -> float:
+        """Return the percentage of winning trades"""
+
+        return self.wins / self.trades * 100 if self.trades else 0.0
+
+    @property
+    def expectancy(self) -> float:
+        """Return the average result per trade"""
+
+        return self.pnl / self.trades if self.trades else 0.0
+
+    def to_dict(self) -> dict:
+        """Convert the Stats instance to a json dumpable dictionary."""
+
+        return dict(
+            trades=self.trades,
+            win_rate=f"{round(self.win_rate, 1)}%",
+            pnl=f"$ {round(self.pnl, 2):,}",
+            expectancy=f"$ {round(self.expectancy, 2):,}",
+            max_drawdown=f"$ {round(self.max_drawdown, 2):,}",
+        )
+
+
+STATS_COLUMNS = [stats_field.name for stats_field in fields(Stats)]
+
+
+class AnalyticsStore:
+    """Local SQLite store of every signal, order, fill and exit, with per strategy
+    daily aggregates that are updated on every exit so queries never scan the
+    history"""
+
+    def __init__(self, path: str = ANALYTICS_DATABASE) -> None:
+        self.path = path
+        self.connection: sqlite3.Connection | None = None
+        self.pending: List[Tuple[str, tuple]] = []
+        self.daily_stats: Dict[Tuple[str, str], Stats] = {}
+        self.signal_ids: set = set()
+
+    def connect(self) -> sqlite3.Connection:
+        """Open the database in WAL mode and load the aggregates, on first use"""
+
+        if self.connection is None:
+            self.connection = sqlite3.connect(self.path)
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("PRAGMA synchronous=NORMAL")
+            self.connection.executescript(SCHEMA)
+            for strategy_type, day, *values in self.connection.execute(
+                f"SELECT strategy_type, day, {', '.join(STATS_COLUMNS)} "
+                "FROM daily_stats"
+            ):
+                self.daily_stats[(strategy_type, day)] = Stats(*values)
+        return self.connection
+
+    def write(self, sql: str, parameters: tuple) -> None:
+        """Queue a write, the queue is flushed in a single transaction"""
+
+        self.pending.append((sql, parameters))
+        if len(self.pending) >= ANALYTICS_BATCH_SIZE:
+            self.flush()
+
+    def flush(self) -> None:
+        """Write the queued rows in a single transaction"""
+
+        if not self.pending:
+            return
+        connection = self.connect()
+        pending, self.pending = self.pending, []
+        try:
+            with connection:
+                for sql, parameters in pending:
+                    connection.execute(sql, parameters)
+        except Exception as e:
+            logger.error(f"Error writing {len(pending)} analytics rows: {e}")
+
+    def record_signal(self, liquidation: Liquidation) -> None:
+        """Record a liquidation signal once"""
+
+        if liquidation.signal_id in self.signal_ids:
+            return
+        self.signal_ids.add(liquidation.signal_id)
+        self.write(
+            "INSERT OR IGNORE INTO signals VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (
+                liquidation.signal_id,
+                liquidation.time,
+                liquidation.direction,
+                liquidation.amount,
+                liquidation.nr_of_liquidations,
+                liquidation.z_score,
+                liquidation.funding_rate,
+            ),
+        )
+
+    def record_signals(self, liquidations: List[Liquidation]) -> None:
+        """Record the liquidation signals that were not recorded before"""
+
+        for liquidation in liquidations:
+            self.record_signal(liquidation)
+
+    def record_order(
+        self,
+        client_order_id: str,
+        signal_id: str,
+        strategy_type: str,
+        account: str,
+        direction: str,
+        amount: float,
+        price: float,
+        fill_price: float | None,
+        stoploss_price: float,
+        takeprofit_price: float,
+    ) -> None:
+        """Record an acknowledged order with its fill price when known"""
+
+        self.write(
+            "INSERT OR REPLACE INTO orders VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                client_order_id,
+                signal_id,
+                strategy_type,
+                account,
+                direction,
+                amount,
+                price,
+                fill_price,
+                stoploss_price,
+                takeprofit_price,
+                time(),
+            ),
+        )
+
+    def record_exit(
+        self,
+        entry: OpenEntry,
+        exit_price: float,
+        account: str,
+        contract_size: float = 0.001,
+        exit_time: float | None = None,
+    ) -> float:
+        """Record the stop loss or take profit exit of an entry and update the daily
+        aggregates of its strategy, returns the pnl"""
+
+        exit_time = exit_time if exit_time is not None else time()
+        sign = 1 if entry.direction == "long" else -1
+        pnl = sign * (exit_price - entry.price) * entry.amount * contract_size
+        self.write(
+            "INSERT INTO exits (client_order_id, strategy_type, account, direction, "
+            "amount, entry_price, exit_price, pnl, reason, time) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                entry.client_order_id,
+                entry.strategy_type,
+                account,
+                entry.direction,
+                entry.amount,
+                entry.price,
+                exit_price,
+                pnl,
+                "takeprofit" if pnl > 0 else "stoploss",
+                exit_time,
+            ),
+        )
+
+        self.connect()
+        day = date.fromtimestamp(exit_time).isoformat()
+        stats = self.daily_stats.setdefault((entry.strategy_type, day), Stats())
+        stats.add(pnl)
+        self.write(
+            f"INSERT OR REPLACE INTO daily_stats VALUES ({', '.join('?' * 10)})",
+            (entry.strategy_type, day, *asdict(stats).values()),
+        )
+        return pnl
+
+    def get_stats(
+        self, strategy_type: str, since: date | None = None, until: date | None = None
+    ) -> Stats:
+        """Return the aggregated results of a strategy between two days, from the
+        daily aggregates"""
+
+        self.connect()
+        first = since.isoformat() if since else ""
+        last = until.isoformat() if until else "9999"
+        stats = Stats()
+        for (day_strategy_type, day), day_stats in sorted(self.daily_stats.items()):
+            if day_strategy_type == strategy_type and first <= day <= last:
+                stats.combine(day_stats)
+        return stats
+
+    def get_summary(self, day: date) -> Dict[str, dict]:
+        """Return the results of every strategy on a day and in total"""
+
+        self.connect()
+        strategy_types = sorted(
+            {strategy_type for strategy_type, _ in self.daily_stats}
+        )
+        return {
+            strategy_type: dict(
+                day=self.get_stats(strategy_type, since=day, until=day).to_dict(),
+                total=self.get_stats(strategy_type).to_dict(),
+            )
+            for strategy_type in strategy_types
+        }
+
+    def close(self) -> None:
+        """Flush the queued rows and close the database"""
+
+        self.flush()
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+
+def get_exit_price(trades: List[dict], entry: OpenEntry) -> float | None:
+    """Return the average price of the closing trades after an entry"""
+
+    closing_side = "sell" if entry.direction == "long" else "buy"
+    closing_trades = [
+        trade
+        for trade in trades
+        if trade.get("side") == closing_side
+        and (trade.get("timestamp") or 0) / 1000 >= entry.time
+    ]
+    amount = sum(trade.get("amount") or 0 for trade in closing_trades)
+    if not amount:
+        return None
+    return (
+        sum((trade.get("amount") or 0) * trade["price"] for trade in closing_trades)
+        / amount
+    )
+
+
+ANALYTICS = AnalyticsStore() if USE_ANALYTICS else None
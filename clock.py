@@ -0,0 +1,82 @@
+from asyncio import sleep
+from collections import deque
+from datetime import datetime
+from decouple import config
+from logger import logger
+from time import time
+from typing import Deque, Tuple
+from venues import Venue
+
+
+CLOCK_SYNC_INTERVAL = config("CLOCK_SYNC_INTERVAL", cast=int, default="60")
+logger.info(f"{CLOCK_SYNC_INTERVAL=}")
+CLOCK_SAMPLES = config("CLOCK_SAMPLES", cast=int, default="8")
+logger.info(f"{CLOCK_SAMPLES=}")
+
+
+class ExchangeClock:
+    """Estimates the offset of the local clock versus the exchange clock NTP style,
+    the server timestamp is compared with the middle of the round trip and the sample
+    with the shortest round trip of the recent samples is trusted most"""
+
+    def __init__(self, venue: Venue, nr_of_samples: int = CLOCK_SAMPLES) -> None:
+        self.venue = venue
+        self.samples: Deque[Tuple[float, float]] = deque(maxlen=nr_of_samples)
+        self.offset = 0.0
+
+    async def sample(self) -> Tuple[float, float] | None:
+        """Take a single (round trip, offset) sample from the exchange ticker"""
+
+        sent = time()
+        ticker = await self.venue.fetch_ticker()
+        received = time()
+        if not ticker.get("timestamp"):
+            return None
+        round_trip = received - sent
+        offset = ticker["timestamp"] / 1000 - (sent + received) / 2
+        self.samples.append((round_trip, offset))
+        return round_trip, offset
+
+    async def sync(self, nr_of_samples: int = 1) -> None:
+        """Sample the exchange clock and update the offset from the sample with the
+        shortest round trip, its error is at most half of that round trip"""
+
+        for _ in range(nr_of_samples):
+            try:
+                await self.sample()
+            except Exception as e:
+                logger.warning(f"Error syncing the exchange clock: {e}")
+        if self.samples:
+            round_trip, self.offset = min(self.samples)
+            logger.info(
+                f"Exchange clock offset {round(self.offset * 1000, 1)} ms "
+                f"(round trip {round(round_trip * 1000, 1)} ms)"
+            )
+
+    async def run(self) -> None:
+        """Keep the offset up to date"""
+
+        while True:
+            await sleep(CLOCK_SYNC_INTERVAL)
+            await self.sync()
+
+    def timestamp(self) -> float:
+        """Return the current exchange time as a unix timestamp"""
+
+        return time() + self.offset
+
+    def now(self) -> datetime:
+        """Return the current exchange time as a local datetime"""
+
+        return datetime.fromtimestamp(self.timestamp())
+
+    def seconds_until_next(self, interval: float = 1.0) -> float:
+        """Return the seconds until the next multiple of interval in exchange time"""
+
+        return interval - self.timestamp() % interval
+
+    async def sleep_until_next(self, interval: float = 1.0) -> None:
+        """Sleep until just past the next multiple of interval in exchange time"""
+
+        # a millisecond margin so the timer never wakes up just before the boundary
+        await sleep(self.seconds_until_next(interval) + 0.001)
@@ -1,3 +1,4 @@
+from asyncio import gather
 from datetime import datetime, timedelta
 from decouple import config
 from functools import cached_property
@@ -10,23 +11,156 @@ if USE_DISCORD:
         DISCORD_CHANNEL_LIQUIDATIONS_ID,
         DISCORD_CHANNEL_HEARTBEAT_ID,
     )
+from liquidation_aggregator import LiquidationAggregator
 from logger import logger
-from misc import Candle, Liquidation, LiquidationSet
+from misc import (
+    aggregate_candles,
+    BASE_TIME_FRAME,
+    Candle,
+    Liquidation,
+    LiquidationSet,
+    MarketSnapshot,
+    TIME_FRAME_SECONDS,
+    TIME_FRAMES,
+)
+from offload import run_blocking
 import requests
-from typing import List
+from typing import Dict, List
 
 
 COINALYZE_SECRET_API_KEY = config("COINALYZE_SECRET_API_KEY")
 COINALYZE_LIQUIDATION_URL = "https://api.coinalyze.net/v1/liquidation-history"
 FUTURE_MARKETS_URL = "https://api.coinalyze.net/v1/future-markets"
+COINALYZE_OPEN_INTEREST_URL = "https://api.coinalyze.net/v1/open-interest-history"
+COINALYZE_FUNDING_RATE_URL = "https://api.coinalyze.net/v1/funding-rate-history"
+COINALYZE_LONG_SHORT_RATIO_URL = "https://api.coinalyze.net/v1/long-short-ratio-history"
+COINALYZE_FEED_URLS = [
+    COINALYZE_OPEN_INTEREST_URL,
+    COINALYZE_FUNDING_RATE_URL,
+    COINALYZE_LONG_SHORT_RATIO_URL,
+]
+
+# coinalyze accepts at most 20 symbols per request
+COINALYZE_BATCH_SIZE = 20
 
 
 N_MINUTES_TIMEDELTA = config("N_MINUTES_TIMEDELTA", default=5, cast=int)
 logger.info(f"{N_MINUTES_TIMEDELTA=}")
 
-INTERVAL = config("INTERVAL", default="5min")
+# coinalyze interval of the base time frame
+TIME_FRAME_INTERVALS = {
+    "1m": "1min",
+    "5m": "5min",
+    "15m": "15min",
+    "30m": "30min",
+    "1h": "1hour",
+    "4h": "4hour",
+}
+
+INTERVAL = config("INTERVAL", default=TIME_FRAME_INTERVALS[BASE_TIME_FRAME])
 logger.info(f"{INTERVAL=}")
 
+BUCKET_CACHE_SIZE = config("BUCKET_CACHE_SIZE", default=288, cast=int)
+logger.info(f"{BUCKET_CACHE_SIZE=}")
+
+USE_COINALYZE_FEEDS = config("USE_COINALYZE_FEEDS", default=False, cast=bool)
+logger.info(f"{USE_COINALYZE_FEEDS=}")
+
+INTERVAL_SECONDS = {
+    "1min": 60,
+    "5min": 300,
+    "15min": 900,
+    "30min": 1800,
+    "1hour": 3600,
+    "2hour": 7200,
+    "4hour": 14400,
+    "6hour": 21600,
+    "12hour": 43200,
+    "daily": 86400,
+}
+if INTERVAL_SECONDS[INTERVAL] != TIME_FRAME_SECONDS[BASE_TIME_FRAME]:
+    logger.warning(
+        f"INTERVAL {INTERVAL} does not match the base time frame {BASE_TIME_FRAME}"
+    )
+
+# the longest time frame is aggregated from the cached buckets of the base one
+if BUCKET_CACHE_SIZE * INTERVAL_SECONDS[INTERVAL] < max(
+    TIME_FRAME_SECONDS[time_frame] for time_frame in TIME_FRAMES
+):
+    logger.warning("BUCKET_CACHE_SIZE is too small for the longest time frame")
+
+
+class BucketCache:
+    """Keeps a cursor on the last fully closed bucket per symbol and caches the closed
+    buckets by their timestamp, so every bucket is fetched and counted only once"""
+
+    def __init__(self, interval: str = INTERVAL, size: int = BUCKET_CACHE_SIZE) -> None:
+        self.interval_seconds = INTERVAL_SECONDS[interval]
+        self.size = size
+        self.cursors: Dict[str, int] = {}
+        self.buckets: Dict[str, Dict[int, dict]] = {}
+
+    def last_closed_bucket(self, now: datetime) -> int:
+        """Return the timestamp of the last bucket that is no longer forming"""
+
+        timestamp = int(datetime.timestamp(now))
+        return timestamp - timestamp % self.interval_seconds - self.interval_seconds
+
+    def is_up_to_date(self, symbols: List[str], now: datetime) -> bool:
+        """Check if all closed buckets for the symbols have been fetched already"""
+
+        last_closed_bucket = self.last_closed_bucket(now)
+        return all(
+            self.cursors.get(symbol, 0) >= last_closed_bucket for symbol in symbols
+        )
+
+    def start(self, symbols: List[str], default: int) -> int:
+        """Return the timestamp of the first bucket that still has to be fetched"""
+
+        if not symbols or any(symbol not in self.cursors for symbol in symbols):
+            return default
+        return min(self.cursors[symbol] for symbol in symbols) + self.interval_seconds
+
+    def update(self, symbol: str, history: List[dict], now: datetime) -> List[dict]:
+        """Add the closed buckets of a response to the cache and return the ones that
+        have not been seen before, oldest first"""
+
+        last_closed_bucket = self.last_closed_bucket(now)
+        cursor = self.cursors.get(symbol, 0)
+        cache = self.buckets.setdefault(symbol, {})
+        new_buckets = []
+        newest_bucket = cursor
+        for bucket in sorted(history, key=lambda bucket: bucket.get("t", 0)):
+            bucket_time = bucket.get("t")
+            if bucket_time is None or bucket_time > last_closed_bucket:
+                continue
+            newest_bucket = max(newest_bucket, bucket_time)
+            if bucket_time <= cursor or bucket_time in cache:
+                continue
+            cache[bucket_time] = bucket
+            new_buckets.append(bucket)
+
+        # coinalyze may publish the last closed bucket a few seconds late, so the
+        # cursor only passes the buckets that were received and the last closed
+        # bucket is fetched again until it is
+        self.cursors[symbol] = max(
+            newest_bucket, last_closed_bucket - self.interval_seconds
+        )
+
+        # buckets are added in time order so the oldest ones are first in the dict
+        while len(cache) > self.size:
+            del cache[next(iter(cache))]
+        return new_buckets
+
+    def get(self, symbol: str, start: int, end: int) -> List[dict]:
+        """Return the cached closed buckets of a symbol between start and end"""
+
+        return [
+            bucket
+            for bucket_time, bucket in self.buckets.get(symbol, {}).items()
+            if start <= bucket_time <= end
+        ]
+
 
 class CoinalyzeScanner:
     """Scans coinalyze to notify for changes in open interest and liquidations through
@@ -35,19 +169,56 @@ class CoinalyzeScanner:
     def __init__(self, now: datetime, liquidation_set: LiquidationSet) -> None:
         self.now = now
         self.liquidation_set = liquidation_set
+        self.liquidation_sets: Dict[str, LiquidationSet] = {
+            time_frame: (
+                liquidation_set
+                if time_frame == BASE_TIME_FRAME
+                else LiquidationSet(liquidations=[], time_frame=time_frame)
+            )
+            for time_frame in TIME_FRAMES
+        }
+        self.candles: Dict[int, Candle] = {}
         self.exchange = None
+        self.bucket_caches: Dict[str, BucketCache] = {}
+        self.aggregator = LiquidationAggregator(INTERVAL_SECONDS[INTERVAL])
+        self.snapshot: MarketSnapshot | None = None
 
-    @property
-    def params(self) -> dict:
-        """Returns the parameters for the request to the API"""
-        return {
+    def get_bucket_cache(self, url: str) -> BucketCache:
+        """Returns the bucket cache for the url"""
+
+        if url not in self.bucket_caches:
+            self.bucket_caches[url] = BucketCache()
+        return self.bucket_caches[url]
+
+    def get_params(self, url: str) -> dict:
+        """Returns the parameters for the request to the API, starting right after
+        the last closed bucket that was fetched before"""
+
+        params = {
             "symbols": self.symbols,
-            "from": int(
-                datetime.timestamp(self.now - timedelta(minutes=N_MINUTES_TIMEDELTA))
+            "from": self.get_bucket_cache(url).start(
+                self.symbols.split(","),
+                default=int(
+                    datetime.timestamp(
+                        self.now - timedelta(minutes=N_MINUTES_TIMEDELTA)
+                    )
+                ),
             ),
             "to": int(datetime.timestamp(self.now)),
             "interval": INTERVAL,
         }
+        if url == COINALYZE_OPEN_INTEREST_URL:
+            params["convert_to_usd"] = "true"
+        return params
+
+    def get_symbol_batches(self) -> List[str]:
+        """Returns the symbols in batches of at most COINALYZE_BATCH_SIZE symbols"""
+
+        symbols = self.symbols.split(",")
+        return [
+            ",".join(symbols[index : index + COINALYZE_BATCH_SIZE])
+            for index in range(0, len(symbols), COINALYZE_BATCH_SIZE)
+        ]
 
     @cached_property
     def symbols(self) -> str:
@@ -64,8 +235,128 @@ class CoinalyzeScanner:
                 symbols.append(symbol)
         self._symbols = ",".join(symbols)
 
-    async def handle_liquidation_set(self, candle: Candle, symbols: list) -> None:
-        """Handle the liquidation set and check for liquidations
+    def get_z_score(
+        self, direction: str, l_time: int, time_frame: str = BASE_TIME_FRAME
+    ) -> float | None:
+        """Returns the z-score of the liquidation candle of the time frame versus the
+        trailing baseline and logs the rolling window totals"""
+
+        # the last bucket of the interval in the candle
+        end = l_time + TIME_FRAME_SECONDS[time_frame] - INTERVAL_SECONDS[INTERVAL]
+        summary = self.aggregator.summary(direction, end)
+        logger.info(f"{direction} liquidation windows: {summary}")
+        z_score = self.aggregator.z_score(
+            direction, end, TIME_FRAME_SECONDS[time_frame] // 60
+        )
+        return round(z_score, 2) if z_score is not None else None
+
+    def get_time_frame_buckets(self, start: int, end: int) -> List[dict]:
+        """Returns the cached liquidation buckets between start and end summed per
+        symbol, as a single bucket at start"""
+
+        bucket_cache = self.get_bucket_cache(COINALYZE_LIQUIDATION_URL)
+        buckets = []
+        for symbol in self.symbols.split(","):
+            symbol_buckets = bucket_cache.get(symbol, start, end)
+            if symbol_buckets:
+                buckets.append(
+                    dict(
+                        symbol=symbol,
+                        t=start,
+                        l=sum(bucket.get("l") or 0 for bucket in symbol_buckets),
+                        s=sum(bucket.get("s") or 0 for bucket in symbol_buckets),
+                    )
+                )
+        return buckets
+
+    async def handle_time_frames(
+        self, candle: Candle | None, symbols: list
+    ) -> List[Liquidation]:
+        """Handle the closed candle and liquidation buckets of the base time frame for
+        every time frame that closes with it. The candles and buckets of the longer
+        time frames are aggregated from the base ones instead of fetched, returns the
+        new liquidations
+
+        Args:
+            candle (Candle): last closed candle of the base time frame
+            symbols (list): new closed liquidation buckets per symbol, oldest first
+        """
+
+        # keep the candles of the longest time frame and the one before for a late
+        # bucket
+        base_seconds = TIME_FRAME_SECONDS[BASE_TIME_FRAME]
+        if candle is not None:
+            self.candles[candle.timestamp] = candle
+            while len(self.candles) > 1 + max(
+                TIME_FRAME_SECONDS[time_frame] // base_seconds
+                for time_frame in TIME_FRAMES
+            ):
+                del self.candles[min(self.candles)]
+
+        # every new bucket counts in the baseline, also the ones coinalyze published
+        # late, the longer time frames sum the same buckets from the bucket cache
+        for history in symbols:
+            self.aggregator.add_bucket(history.get("symbol", ""), history)
+
+        # a bucket that was published a cycle late is handled again with all cached
+        # buckets and the candle of its time, older buckets, e.g. the history of the
+        # first fetch, are only counted
+        timestamp = int(datetime.timestamp(self.now))
+        close = timestamp - timestamp % base_seconds
+        liquidations = []
+        for bucket_time in sorted({history.get("t") for history in symbols}):
+            if bucket_time != close - base_seconds and (
+                bucket_time != close - 2 * base_seconds
+                or bucket_time * 1000 not in self.candles
+            ):
+                continue
+            liquidations += await self.handle_liquidation_set(
+                (
+                    candle
+                    if bucket_time == close - base_seconds
+                    else self.candles[bucket_time * 1000]
+                ),
+                self.get_time_frame_buckets(bucket_time, bucket_time),
+            )
+        for time_frame in TIME_FRAMES:
+            seconds = TIME_FRAME_SECONDS[time_frame]
+            if time_frame == BASE_TIME_FRAME or close % seconds:
+                continue
+
+            # a candle is only complete with all its base candles, e.g. after a start
+            start = close - seconds
+            candles = [
+                self.candles[candle_time]
+                for candle_time in sorted(self.candles)
+                if start * 1000 <= candle_time < close * 1000
+            ]
+            if len(candles) < seconds // base_seconds:
+                logger.info(
+                    f"{len(candles)} of {seconds // base_seconds} {BASE_TIME_FRAME} "
+                    f"candles of the {time_frame} candle, skipping it"
+                )
+                continue
+            liquidations += await self.handle_liquidation_set(
+                aggregate_candles(candles, time_frame),
+                self.get_time_frame_buckets(start, close - base_seconds),
+                time_frame,
+            )
+        return liquidations
+
+    def is_known(self, liquidation: Liquidation) -> bool:
+        """Check if the signal of a liquidation is already in its liquidation set,
+        e.g. a bucket that is handled again after a late bucket of another symbol"""
+
+        return any(
+            known.signal_id == liquidation.signal_id
+            for known in self.liquidation_sets[liquidation.time_frame].liquidations
+        )
+
+    async def handle_liquidation_set(
+        self, candle: Candle, symbols: list, time_frame: str = BASE_TIME_FRAME
+    ) -> List[Liquidation]:
+        """Handle the liquidation set of a time frame and check for liquidations,
+        returns the new liquidations
 
         Args:
             history (dict): history of the liquidation
@@ -74,6 +365,7 @@ class CoinalyzeScanner:
         total_long, total_short = 0, 0
         l_time = symbols[0].get("t") if len(symbols) else 0
         nr_of_liquidations = 0
+        liquidation_set = self.liquidation_sets[time_frame]
         for history in symbols:
             long = history.get("l")
             total_long += long
@@ -84,7 +376,7 @@ class CoinalyzeScanner:
             if short > 100:
                 nr_of_liquidations += 1
 
-        discord_liquidations: List[Liquidation] = []
+        new_liquidations: List[Liquidation] = []
         if total_long > 1000:
             long_liquidation = Liquidation(
                 amount=total_long,
@@ -92,10 +384,13 @@ class CoinalyzeScanner:
                 time=l_time,
                 nr_of_liquidations=nr_of_liquidations,
                 candle=candle,
+                time_frame=time_frame,
+                z_score=self.get_z_score("long", l_time, time_frame),
             )
-            if long_liquidation.is_valid:
-                self.liquidation_set.liquidations.insert(0, long_liquidation)
-                discord_liquidations.append(long_liquidation)
+            long_liquidation.set_market_snapshot(self.snapshot)
+            if long_liquidation.is_valid and not self.is_known(long_liquidation):
+                liquidation_set.add(long_liquidation)
+                new_liquidations.append(long_liquidation)
         if total_short > 1000:
             short_liquidation = Liquidation(
                 amount=total_short,
@@ -103,21 +398,145 @@ class CoinalyzeScanner:
                 time=l_time,
                 nr_of_liquidations=nr_of_liquidations,
                 candle=candle,
+                time_frame=time_frame,
+                z_score=self.get_z_score("short", l_time, time_frame),
             )
-            if short_liquidation.is_valid:
-                self.liquidation_set.liquidations.insert(0, short_liquidation)
-                discord_liquidations.append(short_liquidation)
-        if USE_DISCORD and discord_liquidations:
+            short_liquidation.set_market_snapshot(self.snapshot)
+            if short_liquidation.is_valid and not self.is_known(short_liquidation):
+                liquidation_set.add(short_liquidation)
+                new_liquidations.append(short_liquidation)
+        if USE_DISCORD and new_liquidations:
             self.exchange.discord_message_queue.append(
                 (
                     DISCORD_CHANNEL_LIQUIDATIONS_ID,
                     [
                         get_discord_table(liquidation.to_dict())
-                        for liquidation in discord_liquidations
+                        for liquidation in new_liquidations
                     ],
                     False,
                 )
             )
+        return new_liquidations
+
+    async def fetch_coinalyze(self, url: str, params: dict) -> List[dict]:
+        """Fetch a coinalyze endpoint in the thread pool"""
+
+        response = await run_blocking(
+            requests.get,
+            url,
+            headers={"api_key": COINALYZE_SECRET_API_KEY},
+            params=params,
+        )
+        response.raise_for_status()
+        return response.json()
+
+    async def fetch_batches(self, url: str) -> List[dict]:
+        """Fetch the symbols of a history endpoint in batches at the same time, so the
+        latency is that of the slowest request"""
+
+        params = self.get_params(url)
+        responses = await gather(
+            *(
+                self.fetch_coinalyze(url, dict(params, symbols=batch))
+                for batch in self.get_symbol_batches()
+            )
+        )
+        return [symbol for response in responses for symbol in response]
+
+    async def handle_market_feed(self, url: str) -> None:
+        """Fetch and cache the closed buckets of a market data endpoint"""
+
+        bucket_cache = self.get_bucket_cache(url)
+        if bucket_cache.is_up_to_date(self.symbols.split(","), self.now):
+            return
+
+        try:
+            response_json = await self.fetch_batches(url)
+        except Exception as e:
+            logger.error(f"Error fetching {url}: {e}")
+            if USE_DISCORD:
+                self.exchange.discord_message_queue.append(
+                    (
+                        DISCORD_CHANNEL_HEARTBEAT_ID,
+                        [
+                            "Error fetching market data from Coinalyze:",
+                            str(e),
+                        ],
+                        False,
+                    )
+                )
+            return
+
+        histories = {
+            symbol.get("symbol", ""): symbol.get("history") or []
+            for symbol in response_json
+        }
+        for symbol in self.symbols.split(","):
+            bucket_cache.update(symbol, histories.get(symbol, []), self.now)
+
+    async def handle_market_feeds(self) -> MarketSnapshot | None:
+        """Fetch the open interest, funding rate and long/short ratio at the same time
+        and update the market snapshot of the last closed bucket"""
+
+        if not USE_COINALYZE_FEEDS:
+            return None
+
+        await gather(*(self.handle_market_feed(url) for url in COINALYZE_FEED_URLS))
+        self.snapshot = self.get_market_snapshot()
+        logger.info(f"{self.snapshot=}")
+        return self.snapshot
+
+    def get_feed_values(self, url: str, key: str, bucket_time: int) -> Dict[str, float]:
+        """Returns the value of a key in the cached bucket of every symbol"""
+
+        bucket_cache = self.get_bucket_cache(url)
+        values = {}
+        for symbol in self.symbols.split(","):
+            bucket = bucket_cache.buckets.get(symbol, {}).get(bucket_time)
+            if bucket is not None and bucket.get(key) is not None:
+                values[symbol] = bucket[key]
+        return values
+
+    def get_market_snapshot(self) -> MarketSnapshot:
+        """Returns the market snapshot of the last closed bucket from the cache"""
+
+        bucket_cache = self.get_bucket_cache(COINALYZE_OPEN_INTEREST_URL)
+        bucket_time = bucket_cache.last_closed_bucket(self.now)
+        snapshot = MarketSnapshot(time=bucket_time)
+
+        open_interest = self.get_feed_values(
+            COINALYZE_OPEN_INTEREST_URL, "c", bucket_time
+        )
+        previous_open_interest = self.get_feed_values(
+            COINALYZE_OPEN_INTEREST_URL,
+            "c",
+            bucket_time - bucket_cache.interval_seconds,
+        )
+        if open_interest:
+            snapshot.open_interest = round(sum(open_interest.values()), 2)
+
+        # only compare the symbols that are in both buckets
+        symbols = open_interest.keys() & previous_open_interest.keys()
+        previous = sum(previous_open_interest[symbol] for symbol in symbols)
+        if previous:
+            current = sum(open_interest[symbol] for symbol in symbols)
+            snapshot.open_interest_change = round(
+                (current - previous) / previous * 100, 4
+            )
+
+        if funding_rates := self.get_feed_values(
+            COINALYZE_FUNDING_RATE_URL, "c", bucket_time
+        ):
+            snapshot.funding_rate = round(
+                sum(funding_rates.values()) / len(funding_rates), 6
+            )
+        if long_short_ratios := self.get_feed_values(
+            COINALYZE_LONG_SHORT_RATIO_URL, "r", bucket_time
+        ):
+            snapshot.long_short_ratio = round(
+                sum(long_short_ratios.values()) / len(long_short_ratios), 4
+            )
+        return snapshot
 
     async def handle_coinalyze_url(
         self, url: str, include_params: bool = True, symbols: bool = False
@@ -127,14 +546,17 @@ class CoinalyzeScanner:
         Args:
             url (str): url to check for liquidations
         """
+        if include_params and self.get_bucket_cache(url).is_up_to_date(
+            self.symbols.split(","), self.now
+        ):
+            logger.info("COINALYZE: no new closed buckets to fetch")
+            return []
+
         try:
-            response = requests.get(
-                url,
-                headers={"api_key": COINALYZE_SECRET_API_KEY},
-                params=self.params if include_params else {},
-            )
-            response.raise_for_status()
-            response_json = response.json()
+            if include_params:
+                response_json = await self.fetch_batches(url)
+            else:
+                response_json = await self.fetch_coinalyze(url, {})
             if response_json and not symbols:
                 logger.info(f"COINALYZE: {response_json}")
         except Exception as e:
@@ -152,14 +574,26 @@ class CoinalyzeScanner:
                 )
             return []
 
-        if not len(response_json):
-            return []
-
         if symbols:
             return response_json
 
-        return [
-            symbol.get("history")[0]
+        # hand out every closed bucket that was not seen before, a bucket coinalyze
+        # published after the fetch of the previous cycle is handled a cycle late
+        bucket_cache = self.get_bucket_cache(url)
+        last_closed_bucket = bucket_cache.last_closed_bucket(self.now)
+        histories = {
+            symbol.get("symbol", ""): symbol.get("history") or []
             for symbol in response_json
-            if symbol.get("history")
-        ]
+        }
+        buckets = []
+        for symbol in self.symbols.split(","):
+            for bucket in bucket_cache.update(
+                symbol, histories.get(symbol, []), self.now
+            ):
+                if (
+                    bucket.get("t")
+                    == last_closed_bucket - bucket_cache.interval_seconds
+                ):
+                    logger.info(f"COINALYZE: late bucket {bucket}")
+                buckets.append(dict(bucket, symbol=symbol))
+        return sorted(buckets, key=lambda bucket: bucket.get("t", 0))
@@ -1,8 +1,10 @@
-from typing import List, Tuple
+from collections import OrderedDict
+from copy import deepcopy
+from typing import Dict, List, Tuple
 from decouple import config
 import discord
 from logger import logger
-import yaml
+from time import time
 
 
 USE_DISCORD = config("USE_DISCORD", cast=bool, default=False)
@@ -17,11 +19,241 @@ if USE_DISCORD:
     DISCORD_PRIVATE_KEY = config("DISCORD_PRIVATE_KEY")
     USE_AT_EVERYONE = config("USE_AT_EVERYONE", cast=bool, default=False)
 
+NOTIFICATION_QUEUE_SIZE = config("NOTIFICATION_QUEUE_SIZE", cast=int, default="500")
+logger.info(f"{NOTIFICATION_QUEUE_SIZE=}")
+NOTIFICATION_COLLAPSE_SECONDS = config(
+    "NOTIFICATION_COLLAPSE_SECONDS", cast=float, default="900"
+)
+logger.info(f"{NOTIFICATION_COLLAPSE_SECONDS=}")
+NOTIFICATION_TELEMETRY_MINUTES = config(
+    "NOTIFICATION_TELEMETRY_MINUTES", cast=int, default="60"
+)
+logger.info(f"{NOTIFICATION_TELEMETRY_MINUTES=}")
+
+# channels by priority, trades first and heartbeat errors last
+CHANNEL_PRIORITIES = (
+    [
+        DISCORD_CHANNEL_TRADES_ID,
+        DISCORD_CHANNEL_LIQUIDATIONS_ID,
+        DISCORD_CHANNEL_POSITIONS_ID,
+        DISCORD_CHANNEL_HEARTBEAT_ID,
+    ]
+    if USE_DISCORD
+    else []
+)
+
+# only the messages of the heartbeat channel, the errors, are rate collapsed
+COLLAPSE_PRIORITY = len(CHANNEL_PRIORITIES) - 1
+
+DISCORD_MESSAGE_LIMIT = 2000
+CODE_FENCE = "```"
+STATIC_DISCORD_TABLES: Dict[str, Tuple[dict, str]] = {}
+
+
+def format_value(value) -> str:
+    """Format a single value the way a yaml dump would show it"""
+
+    if value is None:
+        return "null"
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    return str(value)
+
+
+def format_table(obj: dict, indent: int = 0) -> str:
+    """Format a dictionary as a yaml like block with sorted keys"""
+
+    padding = " " * indent
+    lines = []
+    for key in sorted(obj, key=str):
+        value = obj[key]
+        if isinstance(value, dict) and value:
+            lines.append(f"{padding}{key}:")
+            lines.append(format_table(value, indent + 2))
+        elif isinstance(value, (list, tuple)) and value:
+            lines.append(f"{padding}{key}:")
+            lines.extend(f"{padding}- {format_value(item)}" for item in value)
+        elif isinstance(value, (dict, list, tuple)):
+            lines.append(f"{padding}{key}: {'{}' if isinstance(value, dict) else '[]'}")
+        else:
+            lines.append(f"{padding}{key}: {format_value(value)}")
+    return "\n".join(lines)
+
 
 def get_discord_table(obj: dict) -> str:
     """Convert a dictionary to a discord friendly table"""
 
-    return f"```{yaml.dump(obj, default_flow_style=False)}```"
+    return f"{CODE_FENCE}{format_table(obj)}\n{CODE_FENCE}"
+
+
+def get_static_discord_table(name: str, obj: dict) -> str:
+    """Convert a dictionary that rarely changes to a discord friendly table, only
+    rendering it again when the dictionary changed"""
+
+    cached = STATIC_DISCORD_TABLES.get(name)
+    if cached is None or cached[0] != obj:
+        cached = (deepcopy(obj), get_discord_table(obj))
+        STATIC_DISCORD_TABLES[name] = cached
+    return cached[1]
+
+
+def split_message(message: str) -> List[str]:
+    """Split a message that is too long for discord into parts, on newlines where
+    possible. A code block that is split is closed at the end of the part and opened
+    again in the next part"""
+
+    # keep room to close a code block at the end of the part
+    limit = DISCORD_MESSAGE_LIMIT - len(CODE_FENCE) - 1
+    parts = []
+    while len(message) > DISCORD_MESSAGE_LIMIT:
+        cut = message.rfind("\n", 0, limit)
+        if cut <= 0:
+            cut = limit
+        part, message = message[:cut], message[cut:].lstrip("\n")
+        if part.count(CODE_FENCE) % 2:
+            part += f"\n{CODE_FENCE}"
+            message = f"{CODE_FENCE}\n{message}"
+        parts.append(part)
+    parts.append(message)
+    return parts
+
+
+def coalesce_message_queue(
+    message_queue: List[Tuple[int, List[str], bool]],
+) -> List[Tuple[int, List[str]]]:
+    """Merge consecutive messages for the same channel into as few messages as
+    possible within the discord message limit"""
+
+    coalesced: List[Tuple[int, List[str]]] = []
+    for channel_id, messages, at_everyone in message_queue:
+
+        # start a new group for another channel or to keep a mention on top
+        if not coalesced or coalesced[-1][0] != channel_id or at_everyone:
+            coalesced.append((channel_id, []))
+        chunks = coalesced[-1][1]
+
+        for message in (["@everyone"] if at_everyone else []) + list(messages):
+            for part in split_message(f"{message}"):
+                if chunks and len(chunks[-1]) + len(part) + 1 <= DISCORD_MESSAGE_LIMIT:
+                    chunks[-1] += f"\n{part}"
+                else:
+                    chunks.append(part)
+    return coalesced
+
+
+def get_priority(channel_id: int) -> int:
+    """Return the priority of a channel, lower is more important"""
+
+    try:
+        return CHANNEL_PRIORITIES.index(channel_id)
+    except ValueError:
+        return len(CHANNEL_PRIORITIES)
+
+
+class NotificationQueue:
+    """Bounded queue of discord messages that drains the most important channels
+    first. A message that is queued again before it is drained is counted instead,
+    and an error that was drained in the last NOTIFICATION_COLLAPSE_SECONDS is held
+    and drained once as e.g. "Error fetching ohlcv ×37" when the window passes. When
+    the queue is full the oldest message of the least important channel is dropped"""
+
+    def __init__(
+        self,
+        size: int = NOTIFICATION_QUEUE_SIZE,
+        collapse_seconds: float = NOTIFICATION_COLLAPSE_SECONDS,
+    ) -> None:
+        self.size = size
+        self.collapse_seconds = collapse_seconds
+        self.queues: List[OrderedDict] = [
+            OrderedDict() for _ in range(len(CHANNEL_PRIORITIES) + 1)
+        ]
+        self.held: OrderedDict = OrderedDict()
+        self.drained_at: Dict[tuple, float] = {}
+        self.nr_of_dropped = 0
+        self.nr_of_collapsed = 0
+
+    def __len__(self) -> int:
+        return sum(len(queue) for queue in self.queues) + len(self.held)
+
+    def append(self, notification: Tuple[int, List[str], bool]) -> None:
+        """Queue a message, or count it when the same message is queued or held"""
+
+        channel_id, messages, at_everyone = notification
+        key = (channel_id, tuple(messages), at_everyone)
+        queue = self.queues[get_priority(channel_id)]
+        if key in queue:
+            queue[key][1] += 1
+            self.nr_of_collapsed += 1
+        elif key in self.held:
+            self.held[key][1] += 1
+            self.nr_of_collapsed += 1
+        elif key in self.drained_at:
+            self.held[key] = [notification, 1]
+        else:
+            queue[key] = [notification, 1]
+        if len(self) > self.size:
+            self.drop()
+
+    def drop(self) -> None:
+        """Drop the oldest held message, or else the oldest message of the least
+        important channel"""
+
+        self.nr_of_dropped += 1
+        if self.held:
+            self.held.popitem(last=False)
+            return
+        for queue in reversed(self.queues):
+            if queue:
+                queue.popitem(last=False)
+                return
+
+    def drain(self, now: float | None = None) -> List[Tuple[int, List[str], bool]]:
+        """Return the queued messages most important first together with the held
+        messages of which the window passed, and empty the queue"""
+
+        now = now if now is not None else time()
+        self.drained_at = {
+            key: drained_at
+            for key, drained_at in self.drained_at.items()
+            if now - drained_at < self.collapse_seconds
+        }
+        entries = [entry for queue in self.queues for entry in queue.items()]
+        entries += [
+            (key, entry)
+            for key, entry in self.held.items()
+            if key not in self.drained_at
+        ]
+        entries.sort(key=lambda entry: get_priority(entry[0][0]))
+        for queue in self.queues:
+            queue.clear()
+        for key, _ in entries:
+            self.held.pop(key, None)
+            if get_priority(key[0]) >= COLLAPSE_PRIORITY:
+                self.drained_at[key] = now
+
+        notifications = []
+        for _, ((channel_id, messages, at_everyone), count) in entries:
+            if count > 1 and messages:
+                messages = [f"{messages[0]} ×{count}"] + list(messages[1:])
+            notifications.append((channel_id, messages, at_everyone))
+        return notifications
+
+    def clear(self) -> None:
+        """Drop every queued and held message"""
+
+        for queue in self.queues:
+            queue.clear()
+        self.held.clear()
+
+    def stats(self) -> dict:
+        """Return the queue telemetry"""
+
+        return dict(
+            queued=len(self) - len(self.held),
+            held=len(self.held),
+            collapsed=self.nr_of_collapsed,
+            dropped=self.nr_of_dropped,
+        )
 
 
 def get_formatted_unordered_list(obj: dict, nested: bool = False) -> str:
@@ -48,12 +280,10 @@ def post_to_discord(message_queue: List[Tuple[int, List[str], bool]]) -> None:
     @client.event
     async def on_ready():
         try:
-            for channel_id, messages, at_everyone in message_queue:
+            for channel_id, messages in coalesce_message_queue(message_queue):
                 channel = client.get_channel(channel_id)
-                if at_everyone:
-                    await channel.send(f"@everyone\n")
                 for message in messages:
-                    await channel.send(f"{message}")
+                    await channel.send(message)
         except Exception as e:
             logger.error(f"Failed to post to Discord: {e}")
         finally:
@@ -1,20 +1,43 @@
-import ccxt.pro as ccxt
+from analytics import ANALYTICS, get_exit_price
+from asyncio import gather, sleep
+from ccxt import NetworkError
 from coinalyze_scanner import CoinalyzeScanner
 from copy import deepcopy
 from decouple import config, Csv
+from exit_manager import (
+    AMENDMENT_INTERVAL,
+    USE_EXIT_MANAGER,
+    ExitManager,
+    ManagedExit,
+)
 from logger import logger
-from misc import Candle, Liquidation, LiquidationSet
+from misc import (
+    get_client_order_id,
+    Candle,
+    Liquidation,
+    LiquidationSet,
+    OrderTemplate,
+    ARMED,
+    BASE_TIME_FRAME,
+    FILLED,
+    TIME_FRAME_SECONDS,
+    TRIGGERED,
+)
+from offload import run_blocking
+from order_book import USE_ORDER_BOOK, MAX_SLIPPAGE_PERCENTAGE
+from order_registry import ORDER_REGISTRY
+from risk import OpenEntry, RiskEngine
+from settings import GREY, JOURNALING, LIVE, REVERSED, SETTINGS
 import requests
-from typing import List, Tuple
-
-from discord_client import USE_DISCORD
+from time import perf_counter, time
+from typing import Dict, List, Tuple
+from venues import MAIN_ACCOUNT, TICKER, VENUES, Venue, VenueRouter
 
+from discord_client import get_discord_table, NotificationQueue, USE_DISCORD
 
-TICKER: str = "BTC/USDT:USDT"
 
 if USE_DISCORD:
     from discord_client import (
-        get_discord_table,
         USE_AT_EVERYONE,
         DISCORD_CHANNEL_TRADES_ID,
         DISCORD_CHANNEL_POSITIONS_ID,
@@ -29,112 +52,195 @@ if USE_AUTO_JOURNALING:
     )
     JOURNALING_API_KEY = config("JOURNALING_API_KEY")
 
-# blofin
-BLOFIN_SECRET_KEY = config("BLOFIN_SECRET_KEY")
-BLOFIN_API_KEY = config("BLOFIN_API_KEY")
-BLOFIN_PASSPHRASE = config("BLOFIN_PASSPHRASE")
+# sub-accounts that trade the same signals next to the main account, every sub-account
+# needs BLOFIN_API_KEY_<NAME>, BLOFIN_SECRET_KEY_<NAME> and BLOFIN_PASSPHRASE_<NAME>
+SUB_ACCOUNTS = config("SUB_ACCOUNTS", cast=Csv(), default="")
+logger.info(f"{SUB_ACCOUNTS=}")
 
-# trade settings
-LEVERAGE = config("LEVERAGE", cast=int, default="20")
-logger.info(f"{LEVERAGE=}")
-POSITION_PERCENTAGE = config("POSITION_PERCENTAGE", cast=float, default="1")
-logger.info(f"{POSITION_PERCENTAGE=}")
+# trade and strategy settings at start, the loop uses SETTINGS.current so changes to
+# SETTINGS_FILE are picked up without a restart
+LEVERAGE = SETTINGS.current.leverage
+POSITION_PERCENTAGE = SETTINGS.current.position_percentage
+
+# order fast path settings
+KEEP_ALIVE_INTERVAL = config("KEEP_ALIVE_INTERVAL", cast=int, default="30")
+logger.info(f"{KEEP_ALIVE_INTERVAL=}")
+USE_WEBSOCKET_ORDERS = config("USE_WEBSOCKET_ORDERS", cast=bool, default=False)
+logger.info(f"{USE_WEBSOCKET_ORDERS=}")
+ORDER_RETRIES = config("ORDER_RETRIES", cast=int, default="2")
+logger.info(f"{ORDER_RETRIES=}")
 
 # live strategy
-USE_LIVE_STRATEGY = config("USE_LIVE_STRATEGY", cast=bool, default=True)
-logger.info(f"{USE_LIVE_STRATEGY=}")
-LIVE_SL_PERCENTAGE = config("LIVE_SL_PERCENTAGE", cast=float, default="0.5")
-logger.info(f"{LIVE_SL_PERCENTAGE=}")
-LIVE_TP_PERCENTAGE = config("LIVE_TP_PERCENTAGE", cast=float, default="5.0")
-logger.info(f"{LIVE_TP_PERCENTAGE=}")
-LIVE_TRADING_DAYS = config("LIVE_TRADING_DAYS", cast=Csv(int), default="0,1,3,4,5,6")
-logger.info(f"{LIVE_TRADING_DAYS=}")
-LIVE_TRADING_HOURS = config("LIVE_TRADING_HOURS", cast=Csv(int), default="2,3,4")
-logger.info(f"{LIVE_TRADING_HOURS=}")
+USE_LIVE_STRATEGY = SETTINGS.current.strategies[LIVE].enabled
+LIVE_SL_PERCENTAGE = SETTINGS.current.strategies[LIVE].sl_percentage
+LIVE_TP_PERCENTAGE = SETTINGS.current.strategies[LIVE].tp_percentage
+LIVE_TRADING_DAYS = list(SETTINGS.current.strategies[LIVE].trading_days)
+LIVE_TRADING_HOURS = list(SETTINGS.current.strategies[LIVE].trading_hours)
 
 # reversed strategy
-USE_REVERSED_STRATEGY = config("USE_REVERSED_STRATEGY", cast=bool, default=True)
-logger.info(f"{USE_REVERSED_STRATEGY=}")
-REVERSED_SL_PERCENTAGE = config("REVERSED_SL_PERCENTAGE", cast=float, default="0.40")
-logger.info(f"{REVERSED_SL_PERCENTAGE=}")
-REVERSED_TP_PERCENTAGE = config("REVERSED_TP_PERCENTAGE", cast=float, default="4.0")
-logger.info(f"{REVERSED_TP_PERCENTAGE=}")
-REVERSED_TRADING_DAYS = config(
-    "REVERSED_TRADING_DAYS", cast=Csv(int), default="0,1,3,4,5,6"
-)
-logger.info(f"{REVERSED_TRADING_DAYS=}")
-REVERSED_TRADING_HOURS = config(
-    "REVERSED_TRADING_HOURS", cast=Csv(int), default="14,15,16"
-)
-logger.info(f"{REVERSED_TRADING_HOURS=}")
-
-USE_GREY_STRATEGY = config("USE_GREY_STRATEGY", cast=bool, default=True)
-logger.info(f"{USE_GREY_STRATEGY=}")
-GREY_SL_PERCENTAGE = config("GREY_SL_PERCENTAGE", cast=float, default="0.8")
-logger.info(f"{GREY_SL_PERCENTAGE=}")
-GREY_TP_PERCENTAGE = config("GREY_TP_PERCENTAGE", cast=float, default="4.0")
-logger.info(f"{GREY_TP_PERCENTAGE=}")
-GREY_TRADING_DAYS = config("GREY_TRADING_DAYS", cast=Csv(int), default="0,1,3,4,5,6")
-logger.info(f"{GREY_TRADING_DAYS=}")
-GREY_TRADING_HOURS = config(
-    "GREY_TRADING_HOURS", cast=Csv(int), default="0,1,17,18,19,20,21,22,23"
-)
-logger.info(f"{GREY_TRADING_HOURS=}")
+USE_REVERSED_STRATEGY = SETTINGS.current.strategies[REVERSED].enabled
+REVERSED_SL_PERCENTAGE = SETTINGS.current.strategies[REVERSED].sl_percentage
+REVERSED_TP_PERCENTAGE = SETTINGS.current.strategies[REVERSED].tp_percentage
+REVERSED_TRADING_DAYS = list(SETTINGS.current.strategies[REVERSED].trading_days)
+REVERSED_TRADING_HOURS = list(SETTINGS.current.strategies[REVERSED].trading_hours)
+
+USE_GREY_STRATEGY = SETTINGS.current.strategies[GREY].enabled
+GREY_SL_PERCENTAGE = SETTINGS.current.strategies[GREY].sl_percentage
+GREY_TP_PERCENTAGE = SETTINGS.current.strategies[GREY].tp_percentage
+GREY_TRADING_DAYS = list(SETTINGS.current.strategies[GREY].trading_days)
+GREY_TRADING_HOURS = list(SETTINGS.current.strategies[GREY].trading_hours)
 
 # journaling strategy
-USE_JOURNALING_STRATEGY = config("USE_JOURNALING_STRATEGY", cast=bool, default=True)
-logger.info(f"{USE_JOURNALING_STRATEGY=}")
-JOURNALING_SL_PERCENTAGE = config("JOURNALING_SL_PERCENTAGE", cast=float, default="0.8")
-logger.info(f"{JOURNALING_SL_PERCENTAGE=}")
-JOURNALING_TP_PERCENTAGE = config("JOURNALING_TP_PERCENTAGE", cast=float, default="4")
-logger.info(f"{JOURNALING_TP_PERCENTAGE=}")
-JOURNALING_TRADING_DAYS = config(
-    "JOURNALING_TRADING_DAYS", cast=Csv(int), default="0,1,2,3,4,5,6"
-)
-logger.info(f"{JOURNALING_TRADING_DAYS=}")
-JOURNALING_TRADING_HOURS = config(
-    "JOURNALING_TRADING_HOURS",
-    cast=Csv(int),
-    default="0,1,2,3,4,5,6,7,8,9,10,11,12,13,14,15,16,17,18,19,20,21,22,23",
-)
-logger.info(f"{JOURNALING_TRADING_HOURS=}")
-
-# Strategy types
-LIVE = "live"
-REVERSED = "reversed"
-JOURNALING = "journaling"
+USE_JOURNALING_STRATEGY = SETTINGS.current.strategies[JOURNALING].enabled
+JOURNALING_SL_PERCENTAGE = SETTINGS.current.strategies[JOURNALING].sl_percentage
+JOURNALING_TP_PERCENTAGE = SETTINGS.current.strategies[JOURNALING].tp_percentage
+JOURNALING_TRADING_DAYS = list(SETTINGS.current.strategies[JOURNALING].trading_days)
+JOURNALING_TRADING_HOURS = list(SETTINGS.current.strategies[JOURNALING].trading_hours)
 
 # Order Directions
 LONG = "long"
 SHORT = "short"
 
 
+def journal_position(data: dict) -> None:
+    """Post a position to the journal"""
+
+    response = None
+    try:
+        response = requests.post(
+            f"{JOURNAL_HOST_AND_PORT}/api/positions/",
+            headers={"Authorization": f"Api-Key {JOURNALING_API_KEY}"},
+            data=data,
+        )
+        response.raise_for_status()
+        logger.info(f"Position journaled: {response.json()}")
+    except Exception as e:
+        logger.error(
+            f"Error journaling position 1/2: {response.content if response else 'No response'}"
+        )
+        logger.error(f"Error journaling position 2/2: {e}")
+        raise
+
+
 class Exchange:
     """Exchange class to handle the exchange"""
 
     def __init__(
-        self, liquidation_set: LiquidationSet, scanner: CoinalyzeScanner
+        self,
+        liquidation_set: LiquidationSet,
+        scanner: CoinalyzeScanner,
+        account: str = MAIN_ACCOUNT,
+        discord_message_queue: NotificationQueue | None = None,
     ) -> None:
-        self.exchange = ccxt.blofin(
-            config={
-                "apiKey": BLOFIN_API_KEY,
-                "secret": BLOFIN_SECRET_KEY,
-                "password": BLOFIN_PASSPHRASE,
-            }
-        )
+        self.account = account
+        self.venues: List[Venue] = [Venue.from_config(name, account) for name in VENUES]
+        self.router = VenueRouter(self.venues)
         self.liquidation_set: LiquidationSet = liquidation_set
         self.positions: List[dict] = []
         self.market_tpsl_orders: List[dict] = []
         self.limit_orders: List[dict] = []
         self.scanner: CoinalyzeScanner = scanner
-        self.discord_message_queue: List[Tuple[int, List[str], bool]] = []
+        self.discord_message_queue: NotificationQueue = (
+            discord_message_queue
+            if discord_message_queue is not None
+            else NotificationQueue()
+        )
+        self.order_templates: Dict[Tuple[str, str], OrderTemplate] = {}
+        self.signal_time: float | None = None
+        self.cycle_time: float | None = None
+        self.followers: List["Exchange"] = []
+        self.risk = RiskEngine(SETTINGS.current.leverage)
+        self.journal_queue: List[dict] | None = None
+        self.exit_manager = ExitManager(self.label) if USE_EXIT_MANAGER else None
+
+    @property
+    def accounts(self) -> List["Exchange"]:
+        """Get the main account followed by the sub-accounts"""
+
+        return [self] + self.followers
+
+    @property
+    def label(self) -> str:
+        """Get the account label for messages when trading multiple accounts"""
+
+        return f"[{self.account}] " if SUB_ACCOUNTS else ""
+
+    @property
+    def venue(self) -> Venue:
+        """Get the primary venue used for candles, tickers and balance"""
+
+        return self.router.primary
+
+    async def warm_up(self) -> None:
+        """Load the markets up front so the first order does not have to"""
+
+        for venue in self.venues:
+            try:
+                await venue.load_markets()
+            except Exception as e:
+                logger.warning(f"Error loading {venue.name} markets: {e}")
+            if USE_WEBSOCKET_ORDERS and not venue.has.get("createOrderWs"):
+                logger.warning(
+                    f"Websocket orders not supported on {venue.name}, using https"
+                )
+
+    async def stream_prices(self) -> None:
+        """Stream the top of book of every venue to route orders to the best one"""
+
+        await gather(*(venue.stream_top_of_book() for venue in self.venues))
+
+    async def stream_order_books(self) -> None:
+        """Maintain a local order book of every venue for slippage aware entries"""
+
+        await gather(*(venue.stream_order_book() for venue in self.venues))
+
+    async def manage_exits(self) -> None:
+        """Evaluate the exit rules on every streamed price of the venues and amend
+        the stop loss orders every AMENDMENT_INTERVAL"""
+
+        for venue in self.venues:
+            venue.tick_listeners.append(self.exit_manager.on_tick)
+        while True:
+            await sleep(AMENDMENT_INTERVAL)
+            await self.exit_manager.flush(self.venues)
+
+    async def keep_alive(self) -> None:
+        """Keep the https and websocket connections to the exchange warm with
+        lightweight requests, so an order after hours of idleness does not pay for a
+        cold connection"""
+
+        while True:
+            for venue in self.venues:
+                try:
+                    await venue.ping()
+                except Exception as e:
+                    logger.warning(f"Error keeping {venue.name} connection alive: {e}")
+            await sleep(KEEP_ALIVE_INTERVAL)
+
+    def build_order_templates(self) -> None:
+        """Pre-resolve the orders of every strategy and direction for the current
+        position sizes"""
+
+        for strategy_type, strategy in SETTINGS.current.strategies.items():
+            for direction in (LONG, SHORT):
+                self.order_templates[(strategy_type, direction)] = OrderTemplate.build(
+                    strategy_type=strategy_type,
+                    direction=direction,
+                    amount=self.get_position_size(strategy_type),
+                    stoploss_percentage=strategy.sl_percentage,
+                    takeprofit_percentage=strategy.tp_percentage,
+                )
 
     async def get_open_positions(self) -> List[dict]:
         """Get open positions from the exchange"""
 
         # get open positions info
         try:
-            positions = await self.exchange.fetch_positions(symbols=[TICKER])
+            positions = [
+                position
+                for venue in self.venues
+                for position in await venue.fetch_positions()
+            ]
             open_positions = [
                 {
                     "amount": f"{position.get("info", {}).get("positions")} contract(s)",
@@ -144,6 +250,20 @@ class Exchange:
                 }
                 for position in positions
             ]
+
+            # close the local exposure of every side that is flat on the exchange
+            closed_entries = self.risk.sync_positions(
+                {
+                    position.get("info", {}).get("positionSide", "")
+                    for position in positions
+                    if float(position.get("info", {}).get("positions") or 0)
+                }
+            )
+            if ANALYTICS is not None and closed_entries:
+                await self.record_exits(closed_entries)
+            if self.exit_manager is not None:
+                for entry in closed_entries:
+                    self.exit_manager.remove(entry.client_order_id)
         except Exception as e:
             logger.error(f"Error fetching positions: {e}")
             open_positions = []
@@ -161,7 +281,12 @@ class Exchange:
 
         # get open market tpsl orders
         try:
-            open_orders = await self.exchange.fetch_open_orders(params={"tpsl": True})
+            open_orders = []
+            for venue in self.venues:
+                venue_orders = await venue.fetch_open_orders(params={"tpsl": True})
+                if self.exit_manager is not None:
+                    self.exit_manager.sync_orders(venue.name, venue_orders)
+                open_orders += venue_orders
             market_tpsl_orders_info = [
                 {
                     "amount": f"{order.get("info", {}).get("size")} contract(s)",
@@ -196,7 +321,11 @@ class Exchange:
 
         # get open limit orders
         try:
-            open_orders = await self.exchange.fetch_open_orders()
+            open_orders = [
+                order
+                for venue in self.venues
+                for order in await venue.fetch_open_orders()
+            ]
             limit_orders_info = [
                 {
                     "amount": f"{order.get("amount", 0.0)} contract(s)",
@@ -231,10 +360,12 @@ class Exchange:
             self.limit_orders = limit_orders_info
             self.positions = open_positions
             if not any(self.market_tpsl_orders or self.limit_orders or self.positions):
-                open_positions_and_orders = ["No open positions / orders."]
+                open_positions_and_orders = [
+                    f"{self.label}No open positions / orders."
+                ]
             else:
                 open_positions_and_orders = (
-                    ["Position(s):"]
+                    [f"{self.label}Position(s):"]
                     + [get_discord_table(position) for position in self.positions]
                     + ["Market TP/SL order(s):"]
                     + [get_discord_table(order) for order in self.market_tpsl_orders]
@@ -247,32 +378,55 @@ class Exchange:
                     (DISCORD_CHANNEL_POSITIONS_ID, open_positions_and_orders, False)
                 )
 
-    async def set_leverage(self, symbol: str, leverage: int, direction: str) -> None:
-        """Set the leverage for the exchange"""
+    async def record_exits(self, closed_entries: List[OpenEntry]) -> None:
+        """Record the stop loss and take profit exits of the closed entries with the
+        price of the closing trades"""
 
         try:
-            logger.info(
-                await self.exchange.set_leverage(
-                    symbol=symbol,
-                    leverage=leverage,
-                    params={"marginMode": "isolated", "positionSide": direction},
-                )
+            trades = await self.venue.fetch_my_trades(
+                since=min(entry.time for entry in closed_entries)
             )
         except Exception as e:
-            logger.warning(f"Error settings leverage: {e}")
+            logger.error(f"{self.label}Error fetching trades: {e}")
+            return
+        for entry in closed_entries:
+            exit_price = get_exit_price(trades, entry)
+            if exit_price is None:
+                logger.warning(f"{self.label}No closing trades found for {entry}")
+                continue
+            pnl = ANALYTICS.record_exit(entry, exit_price, self.account)
+            logger.info(
+                f"{self.label}{entry.strategy_type} {entry.direction} closed at "
+                f"{round(exit_price, 1)} with $ {round(pnl, 2)}"
+            )
+
+    async def set_leverage(self, leverage: int, direction: str) -> None:
+        """Set the leverage for the exchange on every venue"""
 
-    async def get_last_candle(self) -> Candle | None:
-        """Get the last candle for the exchange"""
+        for venue in self.venues:
+            try:
+                logger.info(await venue.set_leverage(leverage, direction))
+            except Exception as e:
+                logger.warning(f"Error settings leverage on {venue.name}: {e}")
+
+    async def get_last_candle(
+        self, now: float | None = None, time_frame: str = BASE_TIME_FRAME
+    ) -> Candle | None:
+        """Get the last closed candle of the time frame at exchange timestamp now for
+        the exchange"""
 
         try:
 
-            last_candles = await self.exchange.fetch_ohlcv(
-                symbol=TICKER,
-                timeframe="5m",
-                since=None,
-                limit=2,
-            )
-            last_candle: Candle = Candle(*last_candles[-1])
+            last_candles = await self.venue.fetch_ohlcv(timeframe=time_frame, limit=2)
+
+            # right after the close the exchange may already return the new candle
+            if now is not None:
+                last_candles = [
+                    candle
+                    for candle in last_candles
+                    if candle[0] + TIME_FRAME_SECONDS[time_frame] * 1000 <= now * 1000
+                ] or last_candles
+            last_candle: Candle = Candle(*last_candles[-1], time_frame=time_frame)
             logger.info(f"{last_candle=}")
             return last_candle
         except Exception as e:
@@ -293,30 +447,34 @@ class Exchange:
     async def set_position_sizes(self) -> None:
         """Set the position size for the exchange"""
 
+        settings = SETTINGS.current
+        leverage = settings.leverage
+        position_percentage = settings.position_percentage
         try:
             # fetch balance and bid/ask
-            balance: dict = await self.exchange.fetch_balance()
+            balance: dict = await self.venue.fetch_balance()
             total_balance: float = balance.get("USDT", {}).get("total", 1)
+            self.risk.balance = total_balance
             _, ask = await self.get_bid_ask()
 
             # calculate live position size
             live_usdt_size: float = (
-                total_balance / (LIVE_SL_PERCENTAGE * LEVERAGE)
-            ) * POSITION_PERCENTAGE
-            live_position_size: float = round(live_usdt_size / ask * LEVERAGE * 1000, 1)
+                total_balance / (settings.strategies[LIVE].sl_percentage * leverage)
+            ) * position_percentage
+            live_position_size: float = round(live_usdt_size / ask * leverage * 1000, 1)
 
             # calculate grey position size
             grey_usdt_size: float = (
-                total_balance / (GREY_SL_PERCENTAGE * LEVERAGE)
-            ) * POSITION_PERCENTAGE
-            grey_position_size: float = round(grey_usdt_size / ask * LEVERAGE * 1000, 1)
+                total_balance / (settings.strategies[GREY].sl_percentage * leverage)
+            ) * position_percentage
+            grey_position_size: float = round(grey_usdt_size / ask * leverage * 1000, 1)
 
             # calculate reversed position size
             reversed_usdt_size: float = (
-                total_balance / (REVERSED_SL_PERCENTAGE * LEVERAGE)
-            ) * POSITION_PERCENTAGE
+                total_balance / (settings.strategies[REVERSED].sl_percentage * leverage)
+            ) * position_percentage
             reversed_position_size: float = round(
-                reversed_usdt_size / ask * LEVERAGE * 1000, 1
+                reversed_usdt_size / ask * leverage * 1000, 1
             )
 
             # journaling position size is a fixed small size for now
@@ -352,11 +510,12 @@ class Exchange:
             self._journaling_position_size = journaling_position_size
             self._grey_position_size = grey_position_size
             logger.info(
-                f"Initial {self._live_position_size=} - "
+                f"{self.label}Initial {self._live_position_size=} - "
                 + f"{self._reversed_position_size=} - "
                 + f"{self._journaling_position_size=} - "
                 + f"{self._grey_position_size=}"
             )
+            self.build_order_templates()
             return
 
         # set the position sizes if they have changed
@@ -367,7 +526,7 @@ class Exchange:
             or grey_position_size != self._grey_position_size
         ):
             logger.info(
-                f"{live_position_size=} - "
+                f"{self.label}{live_position_size=} - "
                 + f"{reversed_position_size=} - "
                 + f"{journaling_position_size=} - "
                 + f"{grey_position_size=}"
@@ -376,6 +535,7 @@ class Exchange:
             self._reversed_position_size = reversed_position_size
             self._journaling_position_size = journaling_position_size
             self._grey_position_size = grey_position_size
+            self.build_order_templates()
 
     @property
     def live_position_size(self) -> int:
@@ -401,84 +561,93 @@ class Exchange:
 
         return self._grey_position_size
 
-    async def run_loop(self) -> None:
-        """Run the loop for the exchange"""
+    def get_position_size(self, strategy_type: str) -> float:
+        """Get the position size of a strategy for the exchange"""
+
+        return {
+            LIVE: self.live_position_size,
+            GREY: self.grey_position_size,
+            REVERSED: self.reversed_position_size,
+            JOURNALING: self.journaling_position_size,
+        }[strategy_type]
+
+    async def run_loop(self, now: float | None = None) -> None:
+        """Run the loop for the exchange at exchange timestamp now of the cycle"""
+
+        # the risk engine keeps its order window on the time of the cycle
+        self.cycle_time = now if now is not None else time()
 
         # get last bid & ask from ticker
         bid, ask = await self.get_bid_ask()
 
-        # loop over detected liquidations
-        for liquidation in self.liquidation_set.liquidations:
+        strategies = SETTINGS.current.strategies
+
+        # loop over the armed liquidations of every time frame the price reacted
+        # strongly to, i.e. crossed the candle high for a long or the candle low for a
+        # short liquidation
+        crossed_liquidations = [
+            (liquidation_set, liquidation)
+            for liquidation_set in self.scanner.liquidation_sets.values()
+            for liquidation in liquidation_set.crossed_liquidations(TICKER, bid, ask)
+        ]
+        for liquidation_set, liquidation in crossed_liquidations:
 
             bid_or_ask = bid if liquidation.direction == SHORT else ask
 
-            # if reaction to liquidation is not strong, skip it
-            if not await self.reaction_to_liquidation_is_strong(
-                liquidation, bid_or_ask
-            ):
-                continue
+            # start measuring signal to acknowledgement time
+            self.signal_time = perf_counter()
+            liquidation.transition(TRIGGERED)
 
             trade = False
 
-            # if order is created exit loop
-            if USE_LIVE_STRATEGY and await self.apply_live_strategy(
+            # apply the enabled strategies, journaling only if no other strategy traded
+            if strategies[LIVE].enabled and await self.apply_live_strategy(
                 liquidation, bid_or_ask
             ):
                 trade = True
 
-            if USE_GREY_STRATEGY and await self.apply_grey_strategy(
+            if strategies[GREY].enabled and await self.apply_grey_strategy(
                 liquidation, bid_or_ask
             ):
                 trade = True
 
-            if USE_REVERSED_STRATEGY and await self.apply_reversed_strategy(
+            if strategies[REVERSED].enabled and await self.apply_reversed_strategy(
                 liquidation, bid_or_ask
             ):
                 trade = True
 
-            if trade:
-                break
+            if not trade and strategies[JOURNALING].enabled:
+                trade = await self.journaling_strategy(liquidation, bid_or_ask)
 
-            if USE_JOURNALING_STRATEGY and await self.journaling_strategy(
-                liquidation, bid_or_ask
-            ):
+            # if an order is acknowledged exit loop, a signal outside of the trading
+            # hours or of which the order was rejected or failed is armed again for
+            # the next cycle
+            if ORDER_REGISTRY.is_acknowledged(liquidation.signal_id):
+                liquidation.transition(FILLED)
+                liquidation_set.trigger_index.remove(liquidation)
                 break
-
-    async def reaction_to_liquidation_is_strong(
-        self, liquidation: Liquidation, bid_or_ask: float
-    ) -> bool:
-        """Check if the reaction to the liquidation is strong enough to place an
-        order"""
-
-        if (liquidation.direction == LONG and bid_or_ask > liquidation.candle.high) or (
-            liquidation.direction == SHORT and bid_or_ask < liquidation.candle.low
-        ):
-            return True
-        return False
+            liquidation.transition(ARMED)
 
     async def apply_strategy(
         self,
         liquidation: Liquidation,
         bid_or_ask: float,
-        days: List[int],
-        hours: List[int],
         amount: float,
         strategy_type: str,
-        stoploss_percentage: float,
-        takeprofit_percentage: float,
     ) -> bool:
         """Apply the strategy during trading hours and days"""
 
         # check if we are in trading hours and days
-        if self.scanner.now.weekday() not in days or self.scanner.now.hour not in hours:
+        strategy = SETTINGS.current.strategies[strategy_type]
+        if not strategy.is_trading(self.scanner.now):
             return False
 
         await self.market_order_placement(
             amount=amount,
             liquidation=liquidation,
             bid_or_ask=bid_or_ask,
-            stoploss_percentage=stoploss_percentage,
-            takeprofit_percentage=takeprofit_percentage,
+            stoploss_percentage=strategy.sl_percentage,
+            takeprofit_percentage=strategy.tp_percentage,
             strategy_type=strategy_type,
         )
         return True
@@ -492,12 +661,8 @@ class Exchange:
         return await self.apply_strategy(
             liquidation=liquidation,
             bid_or_ask=bid_or_ask,
-            days=JOURNALING_TRADING_DAYS,
-            hours=JOURNALING_TRADING_HOURS,
             amount=self.journaling_position_size,
             strategy_type=JOURNALING,
-            stoploss_percentage=JOURNALING_SL_PERCENTAGE,
-            takeprofit_percentage=JOURNALING_TP_PERCENTAGE,
         )
 
     async def apply_reversed_strategy(
@@ -514,12 +679,8 @@ class Exchange:
         return await self.apply_strategy(
             liquidation=reversed_liquidation,
             bid_or_ask=bid_or_ask,
-            days=REVERSED_TRADING_DAYS,
-            hours=REVERSED_TRADING_HOURS,
             amount=self.reversed_position_size,
             strategy_type=REVERSED,
-            stoploss_percentage=REVERSED_SL_PERCENTAGE,
-            takeprofit_percentage=REVERSED_TP_PERCENTAGE,
         )
 
     async def apply_live_strategy(
@@ -530,12 +691,8 @@ class Exchange:
         return await self.apply_strategy(
             liquidation=liquidation,
             bid_or_ask=bid_or_ask,
-            days=LIVE_TRADING_DAYS,
-            hours=LIVE_TRADING_HOURS,
             amount=self.live_position_size,
             strategy_type=LIVE,
-            stoploss_percentage=LIVE_SL_PERCENTAGE,
-            takeprofit_percentage=LIVE_TP_PERCENTAGE,
         )
 
     async def apply_grey_strategy(
@@ -546,44 +703,69 @@ class Exchange:
         return await self.apply_strategy(
             liquidation=liquidation,
             bid_or_ask=bid_or_ask,
-            days=GREY_TRADING_DAYS,
-            hours=GREY_TRADING_HOURS,
             amount=self.grey_position_size,
-            strategy_type="grey",
-            stoploss_percentage=GREY_SL_PERCENTAGE,
-            takeprofit_percentage=GREY_TP_PERCENTAGE,
+            strategy_type=GREY,
         )
 
-    async def get_sl_and_tp_price(
+    async def get_bid_ask(self) -> tuple[float, float]:
+        """Get the current bid and ask prices from the exchange ticker"""
+
+        ticker_data = await self.venue.fetch_ticker()
+        bid, ask = ticker_data["bid"], ticker_data["ask"]
+        return bid, ask
+
+    async def market_order_placement(
         self,
+        amount: float,
         liquidation: Liquidation,
         bid_or_ask: float,
         stoploss_percentage: float,
         takeprofit_percentage: float,
-    ) -> tuple[float, float]:
-        """Calculate stop loss and take profit prices based on the liquidation
-        direction"""
-
-        stoploss_price = (
-            round(bid_or_ask * (1 - (stoploss_percentage / 100)), 1)
-            if liquidation.direction == LONG
-            else round(bid_or_ask * (1 + (stoploss_percentage / 100)), 1)
-        )
-        takeprofit_price = (
-            round(bid_or_ask * (1 + (takeprofit_percentage / 100)), 1)
-            if liquidation.direction == LONG
-            else round(bid_or_ask * (1 - (takeprofit_percentage / 100)), 1)
-        )
-        return stoploss_price, takeprofit_price
+        strategy_type: str,
+    ) -> None:
+        """Process the order placement for the strategy on all accounts at once, every
+        account with its own position size and error handling"""
 
-    async def get_bid_ask(self) -> tuple[float, float]:
-        """Get the current bid and ask prices from the exchange ticker"""
+        if not self.followers:
+            return await self.place_market_order(
+                amount,
+                liquidation,
+                bid_or_ask,
+                stoploss_percentage,
+                takeprofit_percentage,
+                strategy_type,
+            )
 
-        ticker_data = await self.exchange.fetch_ticker(symbol=TICKER)
-        bid, ask = ticker_data["bid"], ticker_data["ask"]
-        return bid, ask
+        for follower in self.followers:
+            follower.signal_time = self.signal_time
+            follower.cycle_time = self.cycle_time
+        results = await gather(
+            self.place_market_order(
+                amount,
+                liquidation,
+                bid_or_ask,
+                stoploss_percentage,
+                takeprofit_percentage,
+                strategy_type,
+            ),
+            *(
+                follower.place_market_order(
+                    follower.get_position_size(strategy_type),
+                    liquidation,
+                    bid_or_ask,
+                    stoploss_percentage,
+                    takeprofit_percentage,
+                    strategy_type,
+                )
+                for follower in self.followers
+            ),
+            return_exceptions=True,
+        )
+        for account, result in zip(self.accounts, results):
+            if isinstance(result, Exception):
+                logger.error(f"{account.label}Error placing order: {result}")
 
-    async def market_order_placement(
+    async def place_market_order(
         self,
         amount: float,
         liquidation: Liquidation,
@@ -594,22 +776,143 @@ class Exchange:
     ) -> None:
         """Process the order placement for the strategy using a market order"""
 
-        logger.info(f"Placing {liquidation.direction} order")
+        # the orders of a signal are placed one after another, so measure every
+        # order on its own next to the time since the signal
+        order_time = perf_counter()
+        logger.info(f"{self.label}Placing {liquidation.direction} order")
         try:
-            stoploss_price, takeprofit_price = await self.get_sl_and_tp_price(
-                liquidation, bid_or_ask, stoploss_percentage, takeprofit_percentage
+            template = self.order_templates.get((strategy_type, liquidation.direction))
+            if template is None or template.amount != amount:
+                template = OrderTemplate.build(
+                    strategy_type=strategy_type,
+                    direction=liquidation.direction,
+                    amount=amount,
+                    stoploss_percentage=stoploss_percentage,
+                    takeprofit_percentage=takeprofit_percentage,
+                )
+
+            # route to the venue with the best streamed price
+            venue = self.router.best_venue(template.side, self.cycle_time)
+            if venue is not self.venue:
+                bid_or_ask = venue.top_of_book(template.side, self.cycle_time)
+                logger.info(
+                    f"{self.label}Routing order to {venue.name} at {bid_or_ask}"
+                )
+
+            # base the entry on the expected fill and cap the slippage if needed
+            order_type, limit_price = "market", None
+            if USE_ORDER_BOOK and (
+                fill := venue.get_expected_fill(
+                    template.side,
+                    venue.to_venue_amount(template.amount),
+                    self.cycle_time,
+                )
+            ):
+                bid_or_ask = fill.average_price
+                if (
+                    fill.slippage_percentage > MAX_SLIPPAGE_PERCENTAGE
+                    or not fill.is_complete
+                ):
+                    sign = 1 if template.side == "buy" else -1
+                    order_type = "limit"
+                    limit_price = round(
+                        fill.top_price * (1 + sign * MAX_SLIPPAGE_PERCENTAGE / 100), 1
+                    )
+                    bid_or_ask = (
+                        min(bid_or_ask, limit_price)
+                        if template.side == "buy"
+                        else max(bid_or_ask, limit_price)
+                    )
+                logger.info(
+                    f"{self.label}Expected fill {round(fill.average_price, 1)} "
+                    f"with {round(fill.slippage_percentage, 4)}% slippage, "
+                    f"{order_type} order"
+                )
+
+            # pre-trade risk checks against the locally cached exposure
+            allowed, reason = self.risk.check(
+                strategy_type,
+                template.amount,
+                bid_or_ask,
+                self.cycle_time,
+                signal_id=liquidation.signal_id,
+            )
+            if not allowed:
+                logger.warning(f"{self.label}Order rejected by risk engine: {reason}")
+                return
+
+            # the same strategy on the same signal always gets the same client order id
+            client_order_id = get_client_order_id(
+                liquidation.signal_id, strategy_type, template.direction, self.account
             )
-            order = await self.exchange.create_order(
-                symbol=TICKER,
-                type="market",
-                side="buy" if liquidation.direction == LONG else "sell",
-                amount=amount,
-                params=dict(
-                    marginMode="isolated",
-                    positionSide=liquidation.direction,
-                    stopLoss=dict(reduceOnly=True, triggerPrice=stoploss_price),
-                    takeProfit=dict(reduceOnly=True, triggerPrice=takeprofit_price),
-                ),
+            if client_order_id in ORDER_REGISTRY:
+                logger.warning(
+                    f"{self.label}Order {client_order_id} was already submitted, "
+                    "skipping"
+                )
+                return
+
+            stoploss_price, takeprofit_price = template.get_sl_and_tp_price(bid_or_ask)
+            ORDER_REGISTRY.register(
+                client_order_id, liquidation.signal_id, strategy_type, self.account
+            )
+            try:
+                order = await self.submit_order(
+                    venue,
+                    template,
+                    stoploss_price,
+                    takeprofit_price,
+                    order_type,
+                    limit_price,
+                    client_order_id,
+                )
+            except NetworkError:
+                # the order may still have reached the exchange, keep it registered
+                raise
+            except Exception:
+                ORDER_REGISTRY.remove(client_order_id)
+                raise
+            ORDER_REGISTRY.acknowledge(client_order_id)
+            self.risk.record_order(
+                strategy_type,
+                template.direction,
+                template.amount,
+                bid_or_ask,
+                self.cycle_time,
+                client_order_id=client_order_id,
+                signal_id=liquidation.signal_id,
+            )
+            if self.exit_manager is not None:
+                self.exit_manager.track(
+                    ManagedExit(
+                        client_order_id=client_order_id,
+                        strategy_type=strategy_type,
+                        direction=template.direction,
+                        venue_name=venue.name,
+                        amount=venue.to_venue_amount(template.amount),
+                        entry_price=(order or {}).get("average") or bid_or_ask,
+                        stoploss_price=stoploss_price,
+                        takeprofit_price=takeprofit_price,
+                    )
+                )
+            if ANALYTICS is not None:
+                ANALYTICS.record_order(
+                    client_order_id,
+                    liquidation.signal_id,
+                    strategy_type,
+                    self.account,
+                    template.direction,
+                    template.amount,
+                    bid_or_ask,
+                    (order or {}).get("average"),
+                    stoploss_price,
+                    takeprofit_price,
+                )
+            ack_time = perf_counter()
+            signal_to_ack_ms = (
+                (ack_time - self.signal_time) * 1000
+                if self.signal_time is not None
+                else None
             )
             await self.do_order_logging(
                 liquidation,
@@ -618,21 +921,68 @@ class Exchange:
                 takeprofit_price,
                 amount,
                 strategy_type,
+                signal_to_ack_ms,
+                venue.name,
+                (ack_time - order_time) * 1000,
             )
         except Exception as e:
-            logger.error(f"Error placing order: {e}")
+            logger.error(f"{self.label}Error placing order: {e}")
             if USE_DISCORD:
                 self.discord_message_queue.append(
                     (
                         DISCORD_CHANNEL_HEARTBEAT_ID,
                         [
-                            "Error placing order:",
+                            f"{self.label}Error placing order:",
                             str(e),
                         ],
                         False,
                     )
                 )
 
+    async def submit_order(
+        self,
+        venue: Venue,
+        template: OrderTemplate,
+        stoploss_price: float,
+        takeprofit_price: float,
+        order_type: str = "market",
+        limit_price: float | None = None,
+        client_order_id: str | None = None,
+    ) -> dict:
+        """Submit the order over the websocket trading channel if enabled and supported
+        by the venue, otherwise over https. Limit orders are immediate or cancel so
+        they act as a market order with a price cap. After a network error the order
+        is only sent again when the exchange does not know its client order id"""
+
+        params = venue.order_params(
+            template.direction, stoploss_price, takeprofit_price
+        )
+        if order_type == "limit":
+            params["timeInForce"] = "IOC"
+        if client_order_id is not None:
+            params["clientOrderId"] = client_order_id
+
+        for attempt in range(ORDER_RETRIES + 1):
+            try:
+                return await venue.create_order(
+                    type=order_type,
+                    side=template.side,
+                    amount=venue.to_venue_amount(template.amount),
+                    price=limit_price,
+                    params=params,
+                    websocket=USE_WEBSOCKET_ORDERS,
+                )
+            except NetworkError as e:
+                if client_order_id is None or attempt == ORDER_RETRIES:
+                    raise
+                logger.warning(
+                    f"{self.label}Network error submitting order {client_order_id}: "
+                    f"{e}, checking the exchange before retrying"
+                )
+                order = await venue.fetch_order_by_client_id(client_order_id)
+                if order is not None:
+                    return order
+
     async def do_order_logging(
         self,
         liquidation: Liquidation,
@@ -641,6 +991,9 @@ class Exchange:
         takeprofit_price: float,
         amount: float,
         strategy_type: str,
+        signal_to_ack_ms: float | None = None,
+        venue_name: str | None = None,
+        order_to_ack_ms: float | None = None,
     ) -> None:
         """Log the order details"""
 
@@ -661,6 +1014,14 @@ class Exchange:
                 takeprofit=f"$ {round(takeprofit_price, 2):,}",
                 reaction_to_liquidation=reaction_liquidation.to_dict(),
             )
+            if SUB_ACCOUNTS:
+                order_log_info["account"] = self.account
+            if len(self.venues) > 1 and venue_name:
+                order_log_info["venue"] = venue_name
+            if signal_to_ack_ms is not None:
+                order_log_info["signal_to_ack"] = f"{round(signal_to_ack_ms, 1)} ms"
+            if order_to_ack_ms is not None:
+                order_log_info["order_to_ack"] = f"{round(order_to_ack_ms, 1)} ms"
             logger.info(f"{order_log_info=}")
             if USE_DISCORD and strategy_type != JOURNALING:
                 self.discord_message_queue.append(
@@ -675,7 +1036,6 @@ class Exchange:
                 )
 
             if USE_AUTO_JOURNALING:
-                response = None
                 try:
                     data = dict(
                         start=f"{self.scanner.now}",
@@ -686,25 +1046,22 @@ class Exchange:
                         take_profit_price=takeprofit_price,
                         stop_loss_price=stoploss_price,
                         liquidation_amount=int(
-                            self.liquidation_set.total_amount(
+                            self.scanner.liquidation_sets.get(
+                                reaction_liquidation.time_frame, self.liquidation_set
+                            ).total_amount(
                                 reaction_liquidation.direction
                             )
                         ),
                         strategy_type=strategy_type,
                         nr_of_liquidations=liquidation.nr_of_liquidations,
                     )
-                    response = requests.post(
-                        f"{JOURNAL_HOST_AND_PORT}/api/positions/",
-                        headers={"Authorization": f"Api-Key {JOURNALING_API_KEY}"},
-                        data=data,
-                    )
-                    response.raise_for_status()
-                    logger.info(f"Position journaled: {response.json()}")
+
+                    # in pipeline mode the notifier process posts to the journal
+                    if self.journal_queue is not None:
+                        self.journal_queue.append(data)
+                    else:
+                        await run_blocking(journal_position, data)
                 except Exception as e:
-                    logger.error(
-                        f"Error journaling position 1/2: {response.content if response else 'No response'}"
-                    )
-                    logger.error(f"Error journaling position 2/2: {e}")
                     if USE_DISCORD:
                         self.discord_message_queue.append(
                             (
@@ -0,0 +1,254 @@
+from dataclasses import dataclass
+from decouple import config
+from logger import logger
+from time import time
+from typing import Dict, List
+from venues import Venue
+
+
+USE_EXIT_MANAGER = config("USE_EXIT_MANAGER", cast=bool, default=False)
+logger.info(f"{USE_EXIT_MANAGER=}")
+BREAKEVEN_TRIGGER_PERCENTAGE = config(
+    "BREAKEVEN_TRIGGER_PERCENTAGE", cast=float, default="0.5"
+)
+logger.info(f"{BREAKEVEN_TRIGGER_PERCENTAGE=}")
+BREAKEVEN_OFFSET_PERCENTAGE = config(
+    "BREAKEVEN_OFFSET_PERCENTAGE", cast=float, default="0.05"
+)
+logger.info(f"{BREAKEVEN_OFFSET_PERCENTAGE=}")
+TRAILING_TRIGGER_PERCENTAGE = config(
+    "TRAILING_TRIGGER_PERCENTAGE", cast=float, default="1.0"
+)
+logger.info(f"{TRAILING_TRIGGER_PERCENTAGE=}")
+TRAILING_DISTANCE_PERCENTAGE = config(
+    "TRAILING_DISTANCE_PERCENTAGE", cast=float, default="0.5"
+)
+logger.info(f"{TRAILING_DISTANCE_PERCENTAGE=}")
+AMENDMENT_INTERVAL = config("AMENDMENT_INTERVAL", cast=float, default="5")
+logger.info(f"{AMENDMENT_INTERVAL=}")
+
+
+@dataclass
+class ManagedExit:
+    """ManagedExit class to hold a position entry with its stop loss and take profit
+    order, the stop loss only moves in the direction of the trade"""
+
+    client_order_id: str
+    strategy_type: str
+    direction: str
+    venue_name: str
+    amount: float
+    entry_price: float
+    stoploss_price: float
+    takeprofit_price: float
+    tpsl_id: str | None = None
+    best_price: float = 0.0
+    pending_stoploss: float | None = None
+    amended_at: float = 0.0
+
+    def __post_init__(self) -> None:
+        self.best_price = self.best_price or self.entry_price
+
+    @property
+    def sign(self) -> int:
+        """Return 1 for a long and -1 for a short"""
+
+        return 1 if self.direction == "long" else -1
+
+    @property
+    def target_stoploss(self) -> float:
+        """Return the stop loss the exchange should have, pending or current"""
+
+        if self.pending_stoploss is not None:
+            return self.pending_stoploss
+        return self.stoploss_price
+
+    def get_stoploss(self) -> float | None:
+        """Return the stop loss of the breakeven and trailing rules at the best price,
+        or None when no rule applies"""
+
+        move_percentage = (
+            self.sign * (self.best_price - self.entry_price) / self.entry_price * 100
+        )
+        stoploss = None
+        if BREAKEVEN_TRIGGER_PERCENTAGE and move_percentage >= (
+            BREAKEVEN_TRIGGER_PERCENTAGE
+        ):
+            stoploss = self.entry_price * (
+                1 + self.sign * BREAKEVEN_OFFSET_PERCENTAGE / 100
+            )
+        if TRAILING_TRIGGER_PERCENTAGE and move_percentage >= (
+            TRAILING_TRIGGER_PERCENTAGE
+        ):
+            trailing_stoploss = self.best_price * (
+                1 - self.sign * TRAILING_DISTANCE_PERCENTAGE / 100
+            )
+            if stoploss is None or self.sign * (trailing_stoploss - stoploss) > 0:
+                stoploss = trailing_stoploss
+        return round(stoploss, 1) if stoploss is not None else None
+
+    def on_price(self, price: float) -> bool:
+        """Update the best price and ratchet the pending stop loss, returns True when
+        the stop loss has to be amended"""
+
+        if self.sign * (price - self.best_price) <= 0:
+            return False
+        self.best_price = price
+        stoploss = self.get_stoploss()
+        if stoploss is None or self.sign * (stoploss - self.target_stoploss) <= 0:
+            return False
+        self.pending_stoploss = stoploss
+        return True
+
+
+class ExitManager:
+    """Keeps the open entries and their stop loss and take profit orders in memory,
+    evaluates the breakeven and trailing rules on every streamed price and amends the
+    orders in batches. Ticks only ratchet the pending stop loss, so a burst of ticks
+    results in at most one amendment per position per AMENDMENT_INTERVAL"""
+
+    def __init__(self, label: str = "") -> None:
+        self.label = label
+        self.exits: Dict[str, ManagedExit] = {}
+        self.stale_tpsl_ids: Dict[str, List[str]] = {}
+        self.nr_of_amendments = 0
+
+    def track(self, managed_exit: ManagedExit) -> None:
+        """Manage the exit of an acknowledged entry"""
+
+        self.exits[managed_exit.client_order_id] = managed_exit
+
+    def remove(self, client_order_id: str) -> None:
+        """Stop managing the exit of a closed entry"""
+
+        self.exits.pop(client_order_id, None)
+
+    def on_tick(self, venue: Venue) -> None:
+        """Evaluate the rules of the exits on a venue at its streamed top of book, a
+        long exits at the bid and a short at the ask"""
+
+        for managed_exit in self.exits.values():
+            if managed_exit.venue_name != venue.name:
+                continue
+            price = venue.bid if managed_exit.direction == "long" else venue.ask
+            if price is not None:
+                managed_exit.on_price(price)
+
+    def sync_orders(self, venue_name: str, tpsl_orders: List[dict]) -> None:
+        """Match the open stop loss and take profit orders of a venue to the exits
+        and stop managing the exits of which the order is gone"""
+
+        open_ids = {order.get("id") for order in tpsl_orders}
+        for client_order_id, managed_exit in list(self.exits.items()):
+            if managed_exit.venue_name != venue_name:
+                continue
+            if managed_exit.tpsl_id is not None:
+                # orders fetched before a recent amendment do not have the new one yet
+                if (
+                    managed_exit.tpsl_id not in open_ids
+                    and time() - managed_exit.amended_at >= AMENDMENT_INTERVAL
+                ):
+                    logger.info(
+                        f"{self.label}Exit order of {client_order_id} is gone, "
+                        "no longer managing it"
+                    )
+                    self.remove(client_order_id)
+                continue
+
+            # the take profit is never amended, so it identifies the attached order
+            claimed_ids = {
+                other.tpsl_id for other in self.exits.values() if other.tpsl_id
+            }.union(*self.stale_tpsl_ids.values())
+            for order in tpsl_orders:
+                info = order.get("info", {})
+                if (
+                    order.get("id") not in claimed_ids
+                    and info.get("positionSide", managed_exit.direction)
+                    == managed_exit.direction
+                    and abs(
+                        float(info.get("tpTriggerPrice") or 0)
+                        - managed_exit.takeprofit_price
+                    )
+                    < 0.1
+                ):
+                    managed_exit.tpsl_id = order.get("id")
+                    break
+
+    def get_due_exits(self, now: float) -> List[ManagedExit]:
+        """Return the exits with a pending stop loss of which the last amendment is
+        at least AMENDMENT_INTERVAL ago"""
+
+        return [
+            managed_exit
+            for managed_exit in self.exits.values()
+            if managed_exit.pending_stoploss is not None
+            and managed_exit.tpsl_id is not None
+            and now - managed_exit.amended_at >= AMENDMENT_INTERVAL
+        ]
+
+    async def flush(self, venues: List[Venue], now: float | None = None) -> None:
+        """Amend the due exits of every venue. The new stop loss and take profit order
+        is placed before the old one is cancelled, so a position is never without a
+        stop loss, and the old orders of a venue are cancelled in a single batch"""
+
+        now = now if now is not None else time()
+        due_exits = self.get_due_exits(now)
+        for venue in venues:
+            cancel_ids = self.stale_tpsl_ids.pop(venue.name, [])
+            for managed_exit in due_exits:
+                if managed_exit.venue_name != venue.name:
+                    continue
+                stoploss_price = managed_exit.pending_stoploss
+
+                # the exchange rejects a stop loss the price already crossed, keep
+                # the current one instead of retrying it on every flush
+                price = venue.bid if managed_exit.direction == "long" else venue.ask
+                if (
+                    price is not None
+                    and managed_exit.sign * (stoploss_price - price) >= 0
+                ):
+                    logger.warning(
+                        f"{self.label}Stop loss {stoploss_price} of "
+                        f"{managed_exit.client_order_id} is crossed at {price}, "
+                        f"keeping {managed_exit.stoploss_price}"
+                    )
+                    managed_exit.pending_stoploss = None
+                    continue
+                try:
+                    order = await venue.create_tpsl_order(
+                        managed_exit.direction,
+                        managed_exit.amount,
+                        stoploss_price,
+                        managed_exit.takeprofit_price,
+                    )
+                except Exception as e:
+                    logger.error(
+                        f"{self.label}Error amending the stop loss of "
+                        f"{managed_exit.client_order_id} to {stoploss_price}: {e}"
+                    )
+                    continue
+                logger.info(
+                    f"{self.label}Stop loss of {managed_exit.strategy_type} "
+                    f"{managed_exit.direction} moved from "
+                    f"{managed_exit.stoploss_price} to {stoploss_price}"
+                )
+                cancel_ids.append(managed_exit.tpsl_id)
+                managed_exit.tpsl_id = order.get("id")
+                managed_exit.stoploss_price = stoploss_price
+                # a tick during the request may have ratcheted it further
+                if managed_exit.pending_stoploss == stoploss_price:
+                    managed_exit.pending_stoploss = None
+                managed_exit.amended_at = now
+                self.nr_of_amendments += 1
+
+            if not cancel_ids:
+                continue
+            try:
+                await venue.cancel_tpsl_orders(cancel_ids)
+            except Exception as e:
+                # a stale order only has a worse stop loss, retry at the next flush
+                logger.warning(
+                    f"{self.label}Error cancelling {len(cancel_ids)} replaced exit "
+                    f"order(s) on {venue.name}: {e}"
+                )
+                self.stale_tpsl_ids[venue.name] = cancel_ids
@@ -0,0 +1,301 @@
+from analytics import ANALYTICS_DATABASE
+from argparse import ArgumentParser
+from dataclasses import dataclass
+from decouple import config
+from logger import logger
+import numpy as np
+import sqlite3
+from typing import Dict, Tuple
+
+
+FILL_RESOLUTION_RULE = config("FILL_RESOLUTION_RULE", default="pessimistic")
+logger.info(f"{FILL_RESOLUTION_RULE=}")
+FILL_RESOLUTION_HORIZON_HOURS = config(
+    "FILL_RESOLUTION_HORIZON_HOURS", cast=float, default="24"
+)
+logger.info(f"{FILL_RESOLUTION_HORIZON_HOURS=}")
+FILL_RESOLUTION_MINUTE_CANDLES = config("FILL_RESOLUTION_MINUTE_CANDLES", default="")
+logger.info(f"{FILL_RESOLUTION_MINUTE_CANDLES=}")
+FILL_RESOLUTION_TICKS = config("FILL_RESOLUTION_TICKS", default="")
+logger.info(f"{FILL_RESOLUTION_TICKS=}")
+
+# outcomes of a trade
+STOPLOSS = -1
+OPEN = 0
+TAKEPROFIT = 1
+AMBIGUOUS = 2
+
+# how an outcome was resolved
+RESOLUTIONS = ["5m", "1m", "tick", "rule"]
+
+# rules for a stop loss and take profit that are hit within the same finest step
+PESSIMISTIC = "pessimistic"
+OPTIMISTIC = "optimistic"
+
+FIVE_MINUTES_MS = 5 * 60 * 1000
+ONE_MINUTE_MS = 60 * 1000
+
+# cells of a (trades, steps) batch, bounds the memory of a batch to a few hundred MB
+BATCH_CELLS = 4_000_000
+
+
+@dataclass
+class Trades:
+    """Trades class to hold the entries to resolve as arrays, the direction is 1 for
+    a long and -1 for a short and the entry times are unix timestamps in ms"""
+
+    directions: np.ndarray
+    entry_times: np.ndarray
+    stoploss_prices: np.ndarray
+    takeprofit_prices: np.ndarray
+
+    def __len__(self) -> int:
+        return len(self.directions)
+
+
+@dataclass
+class Fills:
+    """Fills class to hold the outcome, exit time and exit price of every trade and
+    the index in RESOLUTIONS of the data that resolved it"""
+
+    outcomes: np.ndarray
+    exit_times: np.ndarray
+    exit_prices: np.ndarray
+    resolutions: np.ndarray
+
+    def get_counts(self, mask: np.ndarray | None = None) -> Dict[str, int]:
+        """Return the number of take profits, stop losses and open trades and how
+        many were resolved by which data"""
+
+        mask = np.ones(len(self.outcomes), bool) if mask is None else mask
+        resolved = mask & (self.outcomes != OPEN)
+        return dict(
+            trades=int(mask.sum()),
+            takeprofit=int((mask & (self.outcomes == TAKEPROFIT)).sum()),
+            stoploss=int((mask & (self.outcomes == STOPLOSS)).sum()),
+            open=int((mask & (self.outcomes == OPEN)).sum()),
+            **{
+                f"by_{resolution}": int((resolved & (self.resolutions == index)).sum())
+                for index, resolution in enumerate(RESOLUTIONS)
+            },
+        )
+
+
+def get_first_hits(
+    highs: np.ndarray,
+    lows: np.ndarray,
+    starts: np.ndarray,
+    ends: np.ndarray,
+    trades: Trades,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Return the first step of every window in which the stop loss and the take
+    profit are hit, the window length when they are not hit"""
+
+    nr_of_steps = int(max((ends - starts).max(initial=0), 1))
+    index = starts[:, None] + np.arange(nr_of_steps)
+    in_window = index < ends[:, None]
+    index = np.minimum(index, len(highs) - 1)
+    high, low = highs[index], lows[index]
+    is_long = (trades.directions > 0)[:, None]
+    stoploss = trades.stoploss_prices[:, None]
+    takeprofit = trades.takeprofit_prices[:, None]
+    stoploss_hits = in_window & np.where(is_long, low <= stoploss, high >= stoploss)
+    takeprofit_hits = in_window & np.where(
+        is_long, high >= takeprofit, low <= takeprofit
+    )
+    return (
+        np.where(stoploss_hits.any(axis=1), stoploss_hits.argmax(axis=1), nr_of_steps),
+        np.where(
+            takeprofit_hits.any(axis=1), takeprofit_hits.argmax(axis=1), nr_of_steps
+        ),
+    )
+
+
+def resolve_windows(
+    data: np.ndarray,
+    duration: int,
+    window_starts: np.ndarray,
+    window_ends: np.ndarray,
+    trades: Trades,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Resolve which of the stop loss and take profit is hit first in a window of
+    every trade, in batches of trades. Data are candles (time, open, high, low,
+    close, ...) of duration ms, or ticks (time, price) with a duration of 0. Returns
+    the outcomes and the time and duration of the step that decided them, for an
+    ambiguous outcome the step in which both were hit"""
+
+    times = data[:, 0]
+    highs, lows = (data[:, 2], data[:, 3]) if duration else (data[:, 1], data[:, 1])
+    if duration:
+        # every candle that is open at some point of the window
+        starts = np.searchsorted(times, window_starts - duration, side="right")
+    else:
+        starts = np.searchsorted(times, window_starts, side="left")
+    ends = np.searchsorted(times, window_ends, side="left")
+
+    outcomes = np.full(len(trades), OPEN)
+    step_times = np.zeros(len(trades))
+    step_durations = np.full(len(trades), duration)
+    if not len(data):
+        return outcomes, step_times, step_durations
+    batch_size = max(1, BATCH_CELLS // max(int((ends - starts).max(initial=1)), 1))
+    for first in range(0, len(trades), batch_size):
+        batch = slice(first, first + batch_size)
+        batch_trades = Trades(
+            trades.directions[batch],
+            trades.entry_times[batch],
+            trades.stoploss_prices[batch],
+            trades.takeprofit_prices[batch],
+        )
+        stoploss_steps, takeprofit_steps = get_first_hits(
+            highs, lows, starts[batch], ends[batch], batch_trades
+        )
+        window_lengths = ends[batch] - starts[batch]
+        first_steps = np.minimum(stoploss_steps, takeprofit_steps)
+        outcomes[batch] = np.select(
+            [
+                first_steps >= window_lengths,
+                stoploss_steps < takeprofit_steps,
+                takeprofit_steps < stoploss_steps,
+            ],
+            [OPEN, STOPLOSS, TAKEPROFIT],
+            AMBIGUOUS,
+        )
+        step_index = np.minimum(starts[batch] + first_steps, len(times) - 1)
+        step_times[batch] = times[step_index]
+    return outcomes, step_times, step_durations
+
+
+def resolve_fills(
+    trades: Trades,
+    candles: np.ndarray,
+    minute_candles: np.ndarray | None = None,
+    ticks: np.ndarray | None = None,
+    rule: str = FILL_RESOLUTION_RULE,
+    horizon_hours: float = FILL_RESOLUTION_HORIZON_HOURS,
+) -> Fills:
+    """Resolve the stop loss and take profit exits of the trades on 5 minute candles.
+    A candle that hits both is refined with the 1 minute candles, a minute that hits
+    both with the ticks, and what is still ambiguous is decided by the pessimistic
+    (stop loss first) or optimistic (take profit first) rule"""
+
+    if rule not in (PESSIMISTIC, OPTIMISTIC):
+        raise ValueError(f"Unknown fill resolution rule {rule}")
+
+    window_starts = trades.entry_times.astype(float)
+    window_ends = window_starts + horizon_hours * 3600 * 1000
+    outcomes, step_times, step_durations = resolve_windows(
+        candles, FIVE_MINUTES_MS, window_starts, window_ends, trades
+    )
+    resolutions = np.zeros(len(trades), int)
+
+    for index, (data, duration) in enumerate(
+        [(minute_candles, ONE_MINUTE_MS), (ticks, 0)], start=1
+    ):
+        ambiguous = outcomes == AMBIGUOUS
+        if data is None or not len(data) or not ambiguous.any():
+            continue
+
+        # only look at the step that hit both, from the entry on
+        ambiguous_trades = Trades(
+            trades.directions[ambiguous],
+            trades.entry_times[ambiguous],
+            trades.stoploss_prices[ambiguous],
+            trades.takeprofit_prices[ambiguous],
+        )
+        refined_starts = np.maximum(step_times[ambiguous], window_starts[ambiguous])
+        refined_ends = step_times[ambiguous] + step_durations[ambiguous]
+        refined_outcomes, refined_times, refined_durations = resolve_windows(
+            data, duration, refined_starts, refined_ends, ambiguous_trades
+        )
+
+        # without data for the whole step the coarser ambiguity is kept
+        refined = refined_outcomes != OPEN
+        indexes = np.flatnonzero(ambiguous)[refined]
+        outcomes[indexes] = refined_outcomes[refined]
+        step_times[indexes] = refined_times[refined]
+        step_durations[indexes] = refined_durations[refined]
+        resolutions[indexes] = index
+
+    ambiguous = outcomes == AMBIGUOUS
+    outcomes[ambiguous] = STOPLOSS if rule == PESSIMISTIC else TAKEPROFIT
+    resolutions[ambiguous] = RESOLUTIONS.index("rule")
+
+    exit_prices = np.select(
+        [outcomes == STOPLOSS, outcomes == TAKEPROFIT],
+        [trades.stoploss_prices, trades.takeprofit_prices],
+        np.nan,
+    )
+    exit_times = np.where(outcomes == OPEN, np.nan, step_times)
+    return Fills(outcomes, exit_times, exit_prices, resolutions)
+
+
+def load_data(path: str) -> np.ndarray:
+    """Load candles (time, open, high, low, close, volume) or ticks (time, price,
+    ...) from a csv file without header, sorted by time"""
+
+    data = np.loadtxt(path, delimiter=",", ndmin=2)
+    return data[np.argsort(data[:, 0], kind="stable")]
+
+
+def load_trades(path: str = ANALYTICS_DATABASE) -> Tuple[Trades, np.ndarray]:
+    """Load the orders of the analytics database as trades, with their strategy"""
+
+    connection = sqlite3.connect(path)
+    try:
+        rows = connection.execute(
+            "SELECT strategy_type, direction, time, stoploss, takeprofit FROM orders "
+            "WHERE stoploss IS NOT NULL AND takeprofit IS NOT NULL ORDER BY time"
+        ).fetchall()
+    finally:
+        connection.close()
+    trades = Trades(
+        directions=np.array([1 if row[1] == "long" else -1 for row in rows]),
+        entry_times=np.array([row[2] * 1000 for row in rows], float),
+        stoploss_prices=np.array([row[3] for row in rows], float),
+        takeprofit_prices=np.array([row[4] for row in rows], float),
+    )
+    return trades, np.array([row[0] for row in rows])
+
+
+def main() -> None:
+    parser = ArgumentParser(
+        description="Resolve the stop loss and take profit exits of the orders in "
+        "the analytics database on 5 minute candles, refined with 1 minute candles "
+        "and ticks where a candle hits both"
+    )
+    parser.add_argument("candles", help="csv of 5 minute candles in ccxt ohlcv order")
+    parser.add_argument("--minute-candles", default=FILL_RESOLUTION_MINUTE_CANDLES)
+    parser.add_argument("--ticks", default=FILL_RESOLUTION_TICKS)
+    parser.add_argument("--database", default=ANALYTICS_DATABASE)
+    parser.add_argument(
+        "--rule", choices=[PESSIMISTIC, OPTIMISTIC], default=FILL_RESOLUTION_RULE
+    )
+    parser.add_argument(
+        "--horizon-hours", type=float, default=FILL_RESOLUTION_HORIZON_HOURS
+    )
+    arguments = parser.parse_args()
+
+    trades, strategy_types = load_trades(arguments.database)
+    if not len(trades):
+        logger.error(
+            f"No orders with a stop loss and take profit in {arguments.database}"
+        )
+        return
+    fills = resolve_fills(
+        trades,
+        load_data(arguments.candles),
+        load_data(arguments.minute_candles) if arguments.minute_candles else None,
+        load_data(arguments.ticks) if arguments.ticks else None,
+        arguments.rule,
+        arguments.horizon_hours,
+    )
+    for strategy_type in sorted(set(strategy_types)):
+        logger.info(
+            f"{strategy_type}: {fills.get_counts(strategy_types == strategy_type)}"
+        )
+    logger.info(f"total: {fills.get_counts()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,200 @@
+from decouple import config, Csv
+from logger import logger
+from math import sqrt
+from typing import Dict, List, Tuple
+
+
+AGGREGATION_WINDOWS = config("AGGREGATION_WINDOWS", cast=Csv(int), default="15,60,240")
+logger.info(f"{AGGREGATION_WINDOWS=}")
+AGGREGATION_BASELINE = config("AGGREGATION_BASELINE", cast=int, default=1440)
+logger.info(f"{AGGREGATION_BASELINE=}")
+
+# a symbol counts as a liquidation if it has more than this amount in a bucket
+MINIMAL_SYMBOL_LIQUIDATION = 100
+
+# name of the series that holds the liquidations of all symbols combined
+ALL = "all"
+
+
+def get_exchange_code(symbol: str) -> str:
+    """Return the coinalyze exchange code of a symbol, e.g. A for BTCUSDT_PERP.A"""
+
+    return symbol.rsplit(".", 1)[-1] if "." in symbol else ""
+
+
+class PrefixSeries:
+    """Dense series of buckets stored as prefix sums, so the total, count and variance
+    of any range of buckets is a subtraction of two prefix values"""
+
+    def __init__(self, interval_seconds: int, retention: int) -> None:
+        self.interval_seconds = interval_seconds
+        self.retention = retention
+        self.start: int | None = None
+        self.amounts: List[float] = [0.0]
+        self.counts: List[int] = [0]
+        self.squares: List[float] = [0.0]
+
+    def __len__(self) -> int:
+        return len(self.amounts) - 1
+
+    def index(self, timestamp: int) -> int:
+        """Return the index of the bucket that holds the timestamp"""
+
+        return (timestamp - self.start) // self.interval_seconds
+
+    def add(self, timestamp: int, amount: float, count: int) -> None:
+        """Add an amount and count to the bucket of the timestamp"""
+
+        if self.start is None:
+            self.start = timestamp - timestamp % self.interval_seconds
+        index = self.index(timestamp)
+        if index < 0:
+            return
+
+        # fill gaps with empty buckets
+        while len(self) <= index:
+            self.amounts.append(self.amounts[-1])
+            self.counts.append(self.counts[-1])
+            self.squares.append(self.squares[-1])
+
+        # late buckets shift every prefix after them, the last bucket is O(1)
+        for position in range(index + 1, len(self.amounts)):
+            self.amounts[position] += amount
+            self.counts[position] += count
+        for position in range(index + 1, len(self.squares)):
+            bucket = self.amounts[position] - self.amounts[position - 1]
+            self.squares[position] = self.squares[position - 1] + bucket**2
+
+        if len(self) > 2 * self.retention:
+            self.trim()
+
+    def trim(self) -> None:
+        """Drop the buckets that fall outside of the retention"""
+
+        drop = len(self) - self.retention
+        amount, count, square = (
+            self.amounts[drop],
+            self.counts[drop],
+            self.squares[drop],
+        )
+        self.amounts = [value - amount for value in self.amounts[drop:]]
+        self.counts = [value - count for value in self.counts[drop:]]
+        self.squares = [value - square for value in self.squares[drop:]]
+        self.start += drop * self.interval_seconds
+
+    def range(self, end: int, nr_of_buckets: int) -> Tuple[int, int]:
+        """Return the prefix indexes of the nr_of_buckets buckets up to and including
+        the bucket of end"""
+
+        if self.start is None:
+            return 0, 0
+        stop = max(0, min(self.index(end) + 1, len(self)))
+        return max(0, stop - nr_of_buckets), stop
+
+    def total(self, end: int, nr_of_buckets: int) -> float:
+        """Return the summed amount over the buckets"""
+
+        first, last = self.range(end, nr_of_buckets)
+        return self.amounts[last] - self.amounts[first]
+
+    def count(self, end: int, nr_of_buckets: int) -> int:
+        """Return the summed count over the buckets"""
+
+        first, last = self.range(end, nr_of_buckets)
+        return self.counts[last] - self.counts[first]
+
+    def mean_and_variance(self, end: int, nr_of_buckets: int) -> Tuple[float, float]:
+        """Return the mean and variance of a single bucket over the buckets"""
+
+        first, last = self.range(end, nr_of_buckets)
+        if last <= first:
+            return 0.0, 0.0
+        size = last - first
+        mean = (self.amounts[last] - self.amounts[first]) / size
+        variance = (self.squares[last] - self.squares[first]) / size - mean**2
+        return mean, max(variance, 0.0)
+
+
+class LiquidationAggregator:
+    """Aggregates liquidation buckets per symbol, exchange and direction to answer
+    rolling window totals, counts and z-scores without extra API calls"""
+
+    def __init__(
+        self,
+        interval_seconds: int,
+        windows: List[int] = AGGREGATION_WINDOWS,
+        baseline: int = AGGREGATION_BASELINE,
+    ) -> None:
+        self.interval_seconds = interval_seconds
+        self.windows = windows
+        self.baseline = baseline
+        self.retention = self.nr_of_buckets(max(windows or [0]) + baseline) + 1
+        self.series: Dict[Tuple[str, str], PrefixSeries] = {}
+
+    def nr_of_buckets(self, minutes: int) -> int:
+        """Return the number of buckets in a window of minutes"""
+
+        return max(1, minutes * 60 // self.interval_seconds)
+
+    def get_series(self, name: str, direction: str) -> PrefixSeries:
+        """Return the series for a name (symbol, exchange or all) and direction"""
+
+        if (name, direction) not in self.series:
+            self.series[(name, direction)] = PrefixSeries(
+                self.interval_seconds, self.retention
+            )
+        return self.series[(name, direction)]
+
+    def add_bucket(self, symbol: str, bucket: dict) -> None:
+        """Add a closed coinalyze liquidation bucket of a symbol"""
+
+        timestamp = bucket.get("t")
+        if timestamp is None:
+            return
+        for direction, key in (("long", "l"), ("short", "s")):
+            amount = bucket.get(key) or 0
+            count = 1 if amount > MINIMAL_SYMBOL_LIQUIDATION else 0
+            for name in (symbol, f"exchange:{get_exchange_code(symbol)}", ALL):
+                self.get_series(name, direction).add(timestamp, amount, count)
+
+    def total(self, direction: str, end: int, minutes: int, name: str = ALL) -> float:
+        """Return the total liquidated amount in the window ending at end"""
+
+        return self.get_series(name, direction).total(end, self.nr_of_buckets(minutes))
+
+    def count(self, direction: str, end: int, minutes: int, name: str = ALL) -> int:
+        """Return the number of symbol liquidations in the window ending at end"""
+
+        return self.get_series(name, direction).count(end, self.nr_of_buckets(minutes))
+
+    def z_score(
+        self, direction: str, end: int, minutes: int, name: str = ALL
+    ) -> float | None:
+        """Return the z-score of the window total versus the trailing baseline before
+        the window, treating the buckets in the baseline as independent draws"""
+
+        series = self.get_series(name, direction)
+        window = self.nr_of_buckets(minutes)
+        mean, variance = series.mean_and_variance(
+            end - window * self.interval_seconds, self.nr_of_buckets(self.baseline)
+        )
+        if variance == 0:
+            return None
+        return (series.total(end, window) - window * mean) / sqrt(window * variance)
+
+    def exchanges(self, direction: str, end: int, minutes: int) -> Dict[str, float]:
+        """Return the total liquidated amount per exchange in the window"""
+
+        return {
+            name.split(":", 1)[1]: self.total(direction, end, minutes, name)
+            for name, series_direction in self.series
+            if name.startswith("exchange:") and series_direction == direction
+        }
+
+    def summary(self, direction: str, end: int) -> Dict[str, float]:
+        """Return the totals of the configured windows ending at end"""
+
+        return {
+            f"{minutes}m": round(self.total(direction, end, minutes), 2)
+            for minutes in self.windows
+        }
@@ -0,0 +1,172 @@
+from asyncio import events, get_running_loop, sleep, Task
+from collections import deque
+from decouple import config
+from inspect import CO_COROUTINE
+from logger import logger
+import os
+import resource
+from statistics import quantiles
+import sys
+import threading
+from time import perf_counter, time
+from typing import Deque, Dict, List, Tuple
+
+
+LOOP_MONITOR_INTERVAL = config("LOOP_MONITOR_INTERVAL", cast=float, default="0.1")
+logger.info(f"{LOOP_MONITOR_INTERVAL=}")
+SLOW_CALLBACK_THRESHOLD = config("SLOW_CALLBACK_THRESHOLD", cast=float, default="0.05")
+logger.info(f"{SLOW_CALLBACK_THRESHOLD=}")
+BLOCKING_THRESHOLD = config("BLOCKING_THRESHOLD", cast=float, default="0.2")
+logger.info(f"{BLOCKING_THRESHOLD=}")
+
+
+def describe_callback(handle: events.Handle) -> str:
+    """Describe the callback of an event loop handle, naming the coroutine for task
+    steps"""
+
+    callback = handle._callback
+    task = getattr(callback, "__self__", None)
+    if isinstance(task, Task):
+        coro = task.get_coro()
+        return f"{task.get_name()} {getattr(coro, '__qualname__', repr(coro))}"
+    return getattr(callback, "__qualname__", repr(callback))
+
+
+def describe_frame(frame) -> str:
+    """Describe a frame as function (file:line)"""
+
+    return (
+        f"{frame.f_code.co_qualname} "
+        f"({os.path.basename(frame.f_code.co_filename)}:{frame.f_lineno})"
+    )
+
+
+def get_blocking_culprit(frame) -> str:
+    """Return the innermost coroutine of a stack together with the call it is stuck
+    in"""
+
+    innermost = frame
+    while frame is not None:
+        if frame.f_code.co_flags & CO_COROUTINE:
+            return f"{describe_frame(frame)} in {describe_frame(innermost)}"
+        frame = frame.f_back
+    return describe_frame(innermost) if innermost is not None else "unknown"
+
+
+def get_rss_mb() -> float:
+    """Return the resident memory of the process in MB, the peak where the current
+    is not available"""
+
+    try:
+        with open("/proc/self/statm") as statm:
+            pages = int(statm.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE") / 1024**2
+    except (OSError, ValueError, IndexError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def get_percentiles(values: List[float], ndigits: int = 3) -> Dict[str, float]:
+    """Return the p50, p99 and max of at least two values, the percentiles are
+    interpolated within the values so the p99 never exceeds the max"""
+
+    percentiles = quantiles(values, n=100, method="inclusive")
+    return dict(
+        p50=round(percentiles[49], ndigits),
+        p99=round(percentiles[98], ndigits),
+        max=round(max(values), ndigits),
+    )
+
+
+class LoopMonitor:
+    """Measures the event loop lag and keeps track of the slowest callbacks seen
+    recently"""
+
+    def __init__(self, interval: float = LOOP_MONITOR_INTERVAL) -> None:
+        self.interval = interval
+        self.lags: Deque[float] = deque(maxlen=max(1, int(300 / interval)))
+        self.slow_callbacks: Deque[Tuple[float, float, str]] = deque(maxlen=100)
+        self.blocking_events: Deque[Tuple[float, float, str]] = deque(maxlen=100)
+        self.instrumented = False
+        self.loop_thread_id: int | None = None
+        self.last_beat = perf_counter()
+
+    async def run(self) -> None:
+        """Measure how late the loop wakes up from a sleep of the monitor interval"""
+
+        loop = get_running_loop()
+        self.loop_thread_id = threading.get_ident()
+        while True:
+            start = loop.time()
+            await sleep(self.interval)
+            self.last_beat = perf_counter()
+            self.lags.append(max(0.0, loop.time() - start - self.interval))
+
+    def start_watchdog(self) -> None:
+        """Watch the loop from a separate thread and record which coroutine holds
+        the loop past the blocking threshold"""
+
+        threading.Thread(target=self.watch, name="loop-watchdog", daemon=True).start()
+
+    def watch(self) -> None:
+        """Check the loop heartbeat and capture the loop thread stack while it is
+        blocked"""
+
+        blocked_since: float | None = None
+        culprit = ""
+        wakeup = threading.Event()
+        while True:
+            wakeup.wait(self.interval)
+            blocked_for = perf_counter() - self.last_beat - self.interval
+            if blocked_for > BLOCKING_THRESHOLD and blocked_since is None:
+                blocked_since = self.last_beat
+                frame = sys._current_frames().get(self.loop_thread_id)
+                culprit = get_blocking_culprit(frame)
+                logger.warning(
+                    f"Event loop blocked for {round(blocked_for * 1000)} ms "
+                    f"by {culprit}"
+                )
+            elif blocked_for <= BLOCKING_THRESHOLD and blocked_since is not None:
+                duration = self.last_beat - blocked_since - self.interval
+                self.blocking_events.append((duration, time(), culprit))
+                logger.warning(
+                    f"Event loop was blocked for {round(duration * 1000)} ms "
+                    f"by {culprit}"
+                )
+                blocked_since = None
+
+    def instrument_callbacks(self) -> None:
+        """Time every callback the event loop runs and remember the slow ones"""
+
+        if self.instrumented:
+            return
+        self.instrumented = True
+        run_handle = events.Handle._run
+        monitor = self
+
+        def _run(handle: events.Handle) -> None:
+            start = perf_counter()
+            try:
+                run_handle(handle)
+            finally:
+                duration = perf_counter() - start
+                if duration >= SLOW_CALLBACK_THRESHOLD:
+                    monitor.slow_callbacks.append(
+                        (duration, time(), describe_callback(handle))
+                    )
+
+        events.Handle._run = _run
+
+    def slowest_callbacks(self, limit: int = 10) -> List[Tuple[float, float, str]]:
+        """Return the slowest callbacks seen recently, slowest first"""
+
+        return sorted(self.slow_callbacks, reverse=True)[:limit]
+
+    def stats(self) -> dict:
+        """Return the loop lag statistics in milliseconds over the recent window"""
+
+        if len(self.lags) < 2:
+            return dict(p50=0.0, p99=0.0, max=0.0, blocked=len(self.blocking_events))
+        return dict(
+            **get_percentiles([lag * 1000 for lag in self.lags], ndigits=1),
+            blocked=len(self.blocking_events),
+        )
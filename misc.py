@@ -1,14 +1,69 @@
+from bisect import bisect_left, bisect_right
 from copy import deepcopy
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from datetime import datetime, timedelta
-from decouple import config
+from decouple import config, Csv
+from hashlib import sha256
 from logger import logger
+from settings import SETTINGS
 
 
-MINIMAL_NR_OF_LIQUIDATIONS = config("MINIMAL_NR_OF_LIQUIDATIONS", default=3, cast=int)
-logger.info(f"{MINIMAL_NR_OF_LIQUIDATIONS=}")
-MINIMAL_LIQUIDATION = config("MINIMAL_LIQUIDATION", default=10_000, cast=int)
-logger.info(f"{MINIMAL_LIQUIDATION=}")
+# values at start, is_valid uses the reloadable SETTINGS.current
+MINIMAL_NR_OF_LIQUIDATIONS = SETTINGS.current.minimal_nr_of_liquidations
+MINIMAL_LIQUIDATION = SETTINGS.current.minimal_liquidation
+MINIMAL_LIQUIDATION_Z_SCORE = config(
+    "MINIMAL_LIQUIDATION_Z_SCORE", default=0.0, cast=float
+)
+logger.info(f"{MINIMAL_LIQUIDATION_Z_SCORE=}")
+MAXIMAL_ABS_FUNDING_RATE = config("MAXIMAL_ABS_FUNDING_RATE", default=0.0, cast=float)
+logger.info(f"{MAXIMAL_ABS_FUNDING_RATE=}")
+TIME_FRAMES = config("TIME_FRAMES", cast=Csv(), default="5m")
+logger.info(f"{TIME_FRAMES=}")
+
+# length of the candle time frames the strategies can run on in seconds
+TIME_FRAME_SECONDS = {
+    "1m": 60,
+    "5m": 300,
+    "15m": 900,
+    "30m": 1800,
+    "1h": 3600,
+    "4h": 14400,
+}
+if not TIME_FRAMES or any(
+    time_frame not in TIME_FRAME_SECONDS for time_frame in TIME_FRAMES
+):
+    raise ValueError(
+        f"TIME_FRAMES must be one or more of {', '.join(TIME_FRAME_SECONDS)}"
+    )
+
+# the shortest time frame is fetched, the longer ones are aggregated from it
+BASE_TIME_FRAME = min(TIME_FRAMES, key=TIME_FRAME_SECONDS.__getitem__)
+
+# symbol the liquidations are traded on
+DEFAULT_SYMBOL = "BTC/USDT:USDT"
+
+# lifecycle states of a liquidation signal
+ARMED = "armed"
+TRIGGERED = "triggered"
+FILLED = "filled"
+EXPIRED = "expired"
+SIGNAL_TRANSITIONS = {
+    ARMED: {TRIGGERED, EXPIRED},
+    TRIGGERED: {ARMED, FILLED, EXPIRED},
+    FILLED: {EXPIRED},
+    EXPIRED: set(),
+}
+
+
+def get_client_order_id(
+    signal_id: str, strategy_type: str, direction: str, account: str
+) -> str:
+    """Return the deterministic client order id of a strategy on a signal, BloFin
+    accepts up to 32 alphanumeric characters"""
+
+    return sha256(
+        f"{signal_id}:{strategy_type}:{direction}:{account}".encode()
+    ).hexdigest()[:32]
 
 
 @dataclass
@@ -24,6 +79,39 @@ class Candle:
     time_frame: str = "5m"  # Default time frame
 
 
+def is_time_frame_close(now: datetime, time_frame: str) -> bool:
+    """Check if now is the close of a candle of the time frame"""
+
+    return (
+        now.second == 0 and int(now.timestamp()) % TIME_FRAME_SECONDS[time_frame] == 0
+    )
+
+
+def aggregate_candles(candles: list[Candle], time_frame: str) -> Candle:
+    """Aggregate consecutive candles, oldest first, to a candle of the time frame"""
+
+    return Candle(
+        timestamp=candles[0].timestamp,
+        open=candles[0].open,
+        high=max(candle.high for candle in candles),
+        low=min(candle.low for candle in candles),
+        close=candles[-1].close,
+        volume=sum(candle.volume for candle in candles),
+        time_frame=time_frame,
+    )
+
+
+@dataclass
+class MarketSnapshot:
+    """MarketSnapshot class to hold the coinalyze market data of a closed bucket"""
+
+    time: int
+    open_interest: float | None = None  # in USD over all symbols
+    open_interest_change: float | None = None  # percentage versus the bucket before
+    funding_rate: float | None = None  # average over all symbols
+    long_short_ratio: float | None = None  # average over all symbols
+
+
 @dataclass
 class Liquidation:
     """Liquidation class to hold the liquidation data"""
@@ -34,6 +122,26 @@ class Liquidation:
     nr_of_liquidations: int
     candle: Candle
     time_frame: str = "5m"  # Default time frame
+    z_score: float | None = None  # versus the trailing baseline
+    open_interest_change: float | None = None
+    funding_rate: float | None = None
+    long_short_ratio: float | None = None
+    state: str = ARMED
+    signal_id: str = ""
+    symbol: str = DEFAULT_SYMBOL
+
+    def __post_init__(self) -> None:
+        # the id stays with copies, e.g. the reversed strategy flipping the direction
+        if not self.signal_id:
+            self.signal_id = f"{self.time_frame}-{self.direction}-{self.time}"
+
+    def transition(self, state: str) -> None:
+        """Move the signal to a new lifecycle state"""
+
+        if state not in SIGNAL_TRANSITIONS[self.state]:
+            raise ValueError(f"Invalid signal transition {self.state} -> {state}")
+        logger.info(f"Signal {self.signal_id} {self.state} -> {state}")
+        self.state = state
 
     def to_dict(self) -> dict:
         """Convert the Liquidation instance to a json dumpable dictionary."""
@@ -43,6 +151,9 @@ class Liquidation:
         liquidation_dict["volume"] = self.candle.volume
         del liquidation_dict["time"]
         del liquidation_dict["candle"]
+        del liquidation_dict["state"]
+        del liquidation_dict["signal_id"]
+        del liquidation_dict["symbol"]
         return liquidation_dict
 
     @property
@@ -50,19 +161,177 @@ class Liquidation:
         """Check if the liquidation is valid for trading"""
         # currently 3 liquidations and a total of > 10k OR >= 1 liquidation and a total
         # of > 100k
+        settings = SETTINGS.current
         if (
-            self.nr_of_liquidations < MINIMAL_NR_OF_LIQUIDATIONS
+            self.nr_of_liquidations < settings.minimal_nr_of_liquidations
             and self.amount < 100_000
-        ) or self.amount < MINIMAL_LIQUIDATION:
+        ) or self.amount < settings.minimal_liquidation:
+            return False
+
+        # optionally require the liquidation to stand out from the trailing baseline
+        if (
+            MINIMAL_LIQUIDATION_Z_SCORE
+            and self.z_score is not None
+            and self.z_score < MINIMAL_LIQUIDATION_Z_SCORE
+        ):
+            return False
+
+        # optionally skip crowded markets with an extreme funding rate
+        if (
+            MAXIMAL_ABS_FUNDING_RATE
+            and self.funding_rate is not None
+            and abs(self.funding_rate) > MAXIMAL_ABS_FUNDING_RATE
+        ):
             return False
         return True
 
+    def set_market_snapshot(self, snapshot: MarketSnapshot | None) -> None:
+        """Take over the market data of the snapshot of the same bucket"""
+
+        if snapshot is None or snapshot.time != self.time:
+            return
+        self.open_interest_change = snapshot.open_interest_change
+        self.funding_rate = snapshot.funding_rate
+        self.long_short_ratio = snapshot.long_short_ratio
+
+    @property
+    def trigger_level(self) -> float:
+        """Return the price the reaction has to cross, above the candle high for a
+        long liquidation and below the candle low for a short liquidation"""
+
+        return self.candle.high if self.direction == "long" else self.candle.low
+
+
+class TriggerLevels:
+    """Sorted trigger levels of one direction of one symbol"""
+
+    def __init__(self) -> None:
+        self.levels: list[float] = []
+        self.liquidations: list[Liquidation] = []
+
+    def __len__(self) -> int:
+        return len(self.levels)
+
+    def add(self, liquidation: Liquidation) -> None:
+        """Insert a liquidation at its trigger level"""
+
+        index = bisect_right(self.levels, liquidation.trigger_level)
+        self.levels.insert(index, liquidation.trigger_level)
+        self.liquidations.insert(index, liquidation)
+
+    def remove(self, liquidation: Liquidation) -> None:
+        """Remove a liquidation, scanning only the entries at its trigger level"""
+
+        index = bisect_left(self.levels, liquidation.trigger_level)
+        while (
+            index < len(self.levels) and self.levels[index] == liquidation.trigger_level
+        ):
+            if self.liquidations[index] is liquidation:
+                del self.levels[index]
+                del self.liquidations[index]
+                return
+            index += 1
+
+    def below(self, price: float) -> list[Liquidation]:
+        """Return the liquidations with a trigger level below the price"""
+
+        return self.liquidations[: bisect_left(self.levels, price)]
+
+    def above(self, price: float) -> list[Liquidation]:
+        """Return the liquidations with a trigger level above the price"""
+
+        return self.liquidations[bisect_right(self.levels, price) :]
+
+    def remove_before(self, timestamp: int) -> None:
+        """Remove all liquidations older than the timestamp in a single pass"""
+
+        kept = [
+            (level, liquidation)
+            for level, liquidation in zip(self.levels, self.liquidations)
+            if liquidation.time >= timestamp
+        ]
+        self.levels = [level for level, _ in kept]
+        self.liquidations = [liquidation for _, liquidation in kept]
+
+
+class TriggerIndex:
+    """Trigger levels of the armed liquidations per symbol and direction, so a price
+    update finds every crossed trigger with a bisect"""
+
+    def __init__(self) -> None:
+        self.triggers: dict[tuple[str, str], TriggerLevels] = {}
+
+    def get_levels(self, symbol: str, direction: str) -> TriggerLevels:
+        """Return the trigger levels of a symbol and direction"""
+
+        if (symbol, direction) not in self.triggers:
+            self.triggers[(symbol, direction)] = TriggerLevels()
+        return self.triggers[(symbol, direction)]
+
+    def add(self, liquidation: Liquidation) -> None:
+        """Add an armed liquidation to the index"""
+
+        self.get_levels(liquidation.symbol, liquidation.direction).add(liquidation)
+
+    def remove(self, liquidation: Liquidation) -> None:
+        """Remove a liquidation from the index"""
+
+        self.get_levels(liquidation.symbol, liquidation.direction).remove(liquidation)
+
+    def crossed(self, symbol: str, bid: float, ask: float) -> list[Liquidation]:
+        """Return the armed liquidations whose trigger level the price crossed, long
+        liquidations against the ask and short liquidations against the bid, newest
+        first"""
+
+        crossed = self.get_levels(symbol, "long").below(ask) + self.get_levels(
+            symbol, "short"
+        ).above(bid)
+        return sorted(
+            (liquidation for liquidation in crossed if liquidation.state == ARMED),
+            key=lambda liquidation: liquidation.time,
+            reverse=True,
+        )
+
+    def remove_before(self, timestamp: int) -> None:
+        """Remove every liquidation older than the timestamp"""
+
+        for levels in self.triggers.values():
+            levels.remove_before(timestamp)
+
+    def clear(self) -> None:
+        """Remove all liquidations"""
+
+        self.triggers.clear()
+
 
 @dataclass
 class LiquidationSet:
     """LiquidationSet class to hold a set of liquidations"""
 
     liquidations: list[Liquidation]
+    trigger_index: TriggerIndex = field(default_factory=TriggerIndex)
+    time_frame: str = BASE_TIME_FRAME
+
+    def __post_init__(self) -> None:
+        for liquidation in self.liquidations:
+            if liquidation.state == ARMED and liquidation.candle is not None:
+                self.trigger_index.add(liquidation)
+
+    def add(self, liquidation: Liquidation) -> None:
+        """Add a new liquidation to the front of the set and to the trigger index"""
+
+        self.liquidations.insert(0, liquidation)
+
+        # without a candle there is no trigger level to react to
+        if liquidation.candle is not None:
+            self.trigger_index.add(liquidation)
+
+    def crossed_liquidations(
+        self, symbol: str, bid: float, ask: float
+    ) -> list[Liquidation]:
+        """Return the armed liquidations with a strong enough reaction"""
+
+        return self.trigger_index.crossed(symbol, bid, ask)
 
     def total_liquidations(self, direction: str) -> int:
         """Return the total number of liquidations in the set for a given direction."""
@@ -90,13 +359,65 @@ class LiquidationSet:
         )
 
     def remove_old_liquidations(self, now: datetime) -> None:
-        """Remove liquidations older than 10 minutes (5m + beginning of candle = 10)."""
+        """Remove liquidations older than two candles of the time frame (candle +
+        beginning of candle, 10 minutes on 5m)."""
 
         try:
+            now_rounded = now.replace(second=0, microsecond=0)
+            cutoff = (
+                now_rounded - timedelta(seconds=2 * TIME_FRAME_SECONDS[self.time_frame])
+            ).timestamp()
+            kept = []
             for liquidation in self.liquidations:
-                now_rounded = now.replace(second=0, microsecond=0)
-                if liquidation.time < (now_rounded - timedelta(minutes=10)).timestamp():
-                    self.liquidations.remove(liquidation)
+                if liquidation.time < cutoff:
+                    liquidation.transition(EXPIRED)
+                else:
+                    kept.append(liquidation)
+            self.liquidations[:] = kept
+            self.trigger_index.remove_before(cutoff)
         except Exception as e:
             logger.error(f"Error removing old liquidations: {e}")
             self.liquidations = []
+            self.trigger_index.clear()
+
+
+@dataclass
+class OrderTemplate:
+    """OrderTemplate class to hold a pre-resolved order for a strategy and direction"""
+
+    strategy_type: str
+    direction: str
+    side: str
+    amount: float
+    stoploss_factor: float
+    takeprofit_factor: float
+
+    @classmethod
+    def build(
+        cls,
+        strategy_type: str,
+        direction: str,
+        amount: float,
+        stoploss_percentage: float,
+        takeprofit_percentage: float,
+    ) -> "OrderTemplate":
+        """Build the order template so only the price has to be filled in when the
+        order is placed"""
+
+        sign = 1 if direction == "long" else -1
+        return cls(
+            strategy_type=strategy_type,
+            direction=direction,
+            side="buy" if direction == "long" else "sell",
+            amount=amount,
+            stoploss_factor=1 - sign * (stoploss_percentage / 100),
+            takeprofit_factor=1 + sign * (takeprofit_percentage / 100),
+        )
+
+    def get_sl_and_tp_price(self, price: float) -> tuple[float, float]:
+        """Return the stop loss and take profit prices for the given entry price"""
+
+        return (
+            round(price * self.stoploss_factor, 1),
+            round(price * self.takeprofit_factor, 1),
+        )
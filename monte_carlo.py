@@ -0,0 +1,205 @@
+from analytics import ANALYTICS_DATABASE
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
+from decouple import config, Csv
+from logger import logger
+import numpy as np
+import os
+from settings import GREY, LIVE, REVERSED, SETTINGS
+import sqlite3
+from typing import Dict, List, Tuple
+
+
+MONTE_CARLO_PATHS = config("MONTE_CARLO_PATHS", cast=int, default="200000")
+logger.info(f"{MONTE_CARLO_PATHS=}")
+MONTE_CARLO_DAYS = config("MONTE_CARLO_DAYS", cast=int, default="30")
+logger.info(f"{MONTE_CARLO_DAYS=}")
+MONTE_CARLO_RUIN_PERCENTAGE = config(
+    "MONTE_CARLO_RUIN_PERCENTAGE", cast=float, default="50"
+)
+logger.info(f"{MONTE_CARLO_RUIN_PERCENTAGE=}")
+MONTE_CARLO_STRATEGIES = config(
+    "MONTE_CARLO_STRATEGIES", cast=Csv(), default=f"{LIVE},{GREY},{REVERSED}"
+)
+logger.info(f"{MONTE_CARLO_STRATEGIES=}")
+
+# paths per task, bounds the memory of a worker to a few hundred MB
+CHUNK_SIZE = 10_000
+
+DRAWDOWN_PERCENTILES = [50, 90, 95, 99]
+
+# from the settings rather than the exchange, so the tool runs without credentials
+SL_PERCENTAGES = {
+    strategy_type: SETTINGS.current.strategies[strategy_type].sl_percentage
+    for strategy_type in (LIVE, GREY, REVERSED)
+}
+
+
+def load_trading_days(
+    path: str = ANALYTICS_DATABASE, strategy_types: List[str] = MONTE_CARLO_STRATEGIES
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Load the exits of the strategies as a (days, trades) matrix of price moves in
+    percent and a matrix of the stop loss distances in percent. Days keep the trades
+    of every strategy together, so bootstrapping days keeps their concurrent exposure.
+    Days with fewer trades are padded with trades without risk"""
+
+    connection = sqlite3.connect(path)
+    try:
+        rows = connection.execute(
+            "SELECT exits.strategy_type, exits.direction, exits.entry_price, "
+            "exits.exit_price, orders.stoploss, exits.time FROM exits "
+            "LEFT JOIN orders ON orders.client_order_id = exits.client_order_id "
+            f"WHERE exits.strategy_type IN ({', '.join('?' * len(strategy_types))}) "
+            "ORDER BY exits.time",
+            strategy_types,
+        ).fetchall()
+    finally:
+        connection.close()
+
+    days: Dict[date, List[Tuple[float, float]]] = {}
+    for strategy_type, direction, entry_price, exit_price, stoploss, time in rows:
+        sign = 1 if direction == "long" else -1
+        move = sign * (exit_price - entry_price) / entry_price * 100
+        if stoploss:
+            sl_percentage = abs(entry_price - stoploss) / entry_price * 100
+        else:
+            sl_percentage = SL_PERCENTAGES.get(strategy_type, SL_PERCENTAGES[LIVE])
+        days.setdefault(date.fromtimestamp(time), []).append((move, sl_percentage))
+
+    nr_of_trades = max((len(trades) for trades in days.values()), default=0)
+    moves = np.zeros((len(days), nr_of_trades))
+    sl_percentages = np.full((len(days), nr_of_trades), np.inf)
+    for index, trades in enumerate(days.values()):
+        moves[index, : len(trades)] = [move for move, _ in trades]
+        sl_percentages[index, : len(trades)] = [sl for _, sl in trades]
+    return moves, sl_percentages
+
+
+def get_returns(
+    moves: np.ndarray,
+    sl_percentages: np.ndarray,
+    position_percentage: float,
+    leverage: int,
+) -> np.ndarray:
+    """Return the change of the balance per trade as a fraction. Positions are sized
+    like set_position_sizes, so a stop loss costs position_percentage of the balance,
+    and a move past the liquidation price costs the whole margin"""
+
+    moves = np.maximum(moves, -100 / leverage)
+    return moves / sl_percentages * position_percentage / 100
+
+
+def simulate(
+    returns: np.ndarray, nr_of_paths: int, nr_of_days: int, seed: int
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Bootstrap equity paths of trading days and return the max drawdown and the
+    lowest equity of every path, as a fraction of the starting balance"""
+
+    generator = np.random.default_rng(seed)
+    days = generator.integers(0, len(returns), size=(nr_of_paths, nr_of_days))
+    path_returns = returns[days].reshape(nr_of_paths, -1)
+
+    # equity after every trade, a balance below zero is ruin as well
+    equity = np.cumprod(np.maximum(1 + path_returns, 0), axis=1)
+    peaks = np.maximum.accumulate(np.maximum(equity, 1), axis=1)
+    max_drawdowns = (1 - equity / peaks).max(axis=1)
+    return max_drawdowns, equity.min(axis=1)
+
+
+def run_simulation(
+    returns: np.ndarray,
+    nr_of_paths: int = MONTE_CARLO_PATHS,
+    nr_of_days: int = MONTE_CARLO_DAYS,
+    ruin: float = MONTE_CARLO_RUIN_PERCENTAGE,
+    executor: ProcessPoolExecutor | None = None,
+    seed: int = 0,
+) -> dict:
+    """Simulate the paths in chunks over the executor and summarize the max drawdown
+    percentiles and the risk of ruin, the probability that the balance drops below
+    the ruin percentage of the starting balance"""
+
+    chunks = [
+        min(CHUNK_SIZE, nr_of_paths - start)
+        for start in range(0, nr_of_paths, CHUNK_SIZE)
+    ]
+    arguments = [
+        (returns, chunk, nr_of_days, seed + index) for index, chunk in enumerate(chunks)
+    ]
+    if executor is not None:
+        results = list(executor.map(simulate, *zip(*arguments)))
+    else:
+        results = [simulate(*argument) for argument in arguments]
+
+    max_drawdowns = np.concatenate([max_drawdowns for max_drawdowns, _ in results])
+    lowest_equity = np.concatenate([lowest for _, lowest in results])
+    percentiles = np.percentile(max_drawdowns, DRAWDOWN_PERCENTILES) * 100
+    return dict(
+        **{
+            f"p{percentile}_drawdown": round(float(value), 2)
+            for percentile, value in zip(DRAWDOWN_PERCENTILES, percentiles)
+        },
+        risk_of_ruin=round(float((lowest_equity <= 1 - ruin / 100).mean()) * 100, 3),
+    )
+
+
+def get_margin_percentage(
+    sl_percentages: np.ndarray, position_percentage: float, leverage: int
+) -> float:
+    """Return the margin of the largest trading day with every position open at the
+    same time, as a percentage of the balance"""
+
+    margins = position_percentage / (sl_percentages * leverage) * 100
+    return round(float(margins.sum(axis=1).max(initial=0)), 2)
+
+
+def main() -> None:
+    parser = ArgumentParser(
+        description="Monte Carlo simulation of the drawdown and risk of ruin of "
+        "position percentage and leverage settings, bootstrapped from the exits in "
+        "the analytics database"
+    )
+    parser.add_argument("--database", default=ANALYTICS_DATABASE)
+    parser.add_argument(
+        "--position-percentages",
+        type=Csv(float),
+        default=[SETTINGS.current.position_percentage],
+    )
+    parser.add_argument(
+        "--leverages", type=Csv(int), default=[SETTINGS.current.leverage]
+    )
+    parser.add_argument("--paths", type=int, default=MONTE_CARLO_PATHS)
+    parser.add_argument("--days", type=int, default=MONTE_CARLO_DAYS)
+    parser.add_argument("--ruin", type=float, default=MONTE_CARLO_RUIN_PERCENTAGE)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    arguments = parser.parse_args()
+
+    moves, sl_percentages = load_trading_days(arguments.database)
+    if not moves.size:
+        logger.error(f"No exits of {MONTE_CARLO_STRATEGIES} in {arguments.database}")
+        return
+    nr_of_trades = np.isfinite(sl_percentages).sum()
+    logger.info(
+        f"Bootstrapping {len(moves)} trading days with {nr_of_trades} trades, "
+        f"{arguments.paths} paths of {arguments.days} days"
+    )
+
+    with ProcessPoolExecutor(max_workers=arguments.workers) as executor:
+        for position_percentage in arguments.position_percentages:
+            for leverage in arguments.leverages:
+                returns = get_returns(
+                    moves, sl_percentages, position_percentage, leverage
+                )
+                result = run_simulation(
+                    returns, arguments.paths, arguments.days, arguments.ruin, executor
+                )
+                margin = get_margin_percentage(
+                    sl_percentages, position_percentage, leverage
+                )
+                logger.info(
+                    f"{position_percentage=} {leverage=} margin={margin}% {result}"
+                )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,23 @@
+from asyncio import get_running_loop
+from concurrent.futures import ThreadPoolExecutor
+from decouple import config
+from functools import partial
+from logger import logger
+from typing import Any, Callable
+
+
+BLOCKING_POOL_SIZE = config("BLOCKING_POOL_SIZE", cast=int, default="8")
+logger.info(f"{BLOCKING_POOL_SIZE=}")
+
+BLOCKING_POOL = ThreadPoolExecutor(
+    max_workers=BLOCKING_POOL_SIZE, thread_name_prefix="blocking"
+)
+
+
+async def run_blocking(func: Callable, *args, **kwargs) -> Any:
+    """Run a blocking call in the bounded thread pool so it does not stall the event
+    loop"""
+
+    return await get_running_loop().run_in_executor(
+        BLOCKING_POOL, partial(func, *args, **kwargs)
+    )
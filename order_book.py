@@ -0,0 +1,165 @@
+from bisect import bisect_left, insort
+from dataclasses import dataclass
+from decouple import config
+from logger import logger
+from time import time
+from typing import Dict, List, Tuple
+
+
+USE_ORDER_BOOK = config("USE_ORDER_BOOK", cast=bool, default=False)
+logger.info(f"{USE_ORDER_BOOK=}")
+ORDER_BOOK_DEPTH = config("ORDER_BOOK_DEPTH", cast=int, default="50")
+logger.info(f"{ORDER_BOOK_DEPTH=}")
+MAX_SLIPPAGE_PERCENTAGE = config("MAX_SLIPPAGE_PERCENTAGE", cast=float, default="0.05")
+logger.info(f"{MAX_SLIPPAGE_PERCENTAGE=}")
+
+
+@dataclass
+class ExpectedFill:
+    """ExpectedFill class to hold the expected outcome of an order against the book"""
+
+    average_price: float
+    worst_price: float
+    top_price: float
+    filled: float
+    amount: float
+
+    @property
+    def slippage_percentage(self) -> float:
+        """Return the slippage of the average price versus the top of book"""
+
+        return abs(self.average_price - self.top_price) / self.top_price * 100
+
+    @property
+    def is_complete(self) -> bool:
+        """Check if the visible book is deep enough for the whole amount"""
+
+        return self.filled >= self.amount
+
+
+class BookSide:
+    """One side of the order book, with sorted prices and lazily rebuilt cumulative
+    sizes so the expected fill of any amount is a bisect"""
+
+    def __init__(self, descending: bool) -> None:
+        self.descending = descending
+        self.sizes: Dict[float, float] = {}
+        self.keys: List[float] = []
+        self.cumulative_sizes: List[float] = []
+        self.cumulative_notionals: List[float] = []
+        self.dirty = True
+
+    def key(self, price: float) -> float:
+        """Return the sort key of a price, best price first"""
+
+        return -price if self.descending else price
+
+    def clear(self) -> None:
+        """Remove all levels"""
+
+        self.sizes.clear()
+        self.keys.clear()
+        self.dirty = True
+
+    def apply(self, price: float, size: float) -> None:
+        """Apply a level delta, a size of zero removes the level"""
+
+        key = self.key(price)
+        if size <= 0:
+            if self.sizes.pop(price, None) is not None:
+                del self.keys[bisect_left(self.keys, key)]
+        else:
+            if price not in self.sizes:
+                insort(self.keys, key)
+            self.sizes[price] = size
+        self.dirty = True
+
+    @property
+    def best(self) -> float | None:
+        """Return the best price of the side"""
+
+        if not self.keys:
+            return None
+        return -self.keys[0] if self.descending else self.keys[0]
+
+    def rebuild(self) -> None:
+        """Rebuild the cumulative sizes and notionals from the best price outwards"""
+
+        self.cumulative_sizes, self.cumulative_notionals = [], []
+        total_size, total_notional = 0.0, 0.0
+        for key in self.keys:
+            price = -key if self.descending else key
+            total_size += self.sizes[price]
+            total_notional += self.sizes[price] * price
+            self.cumulative_sizes.append(total_size)
+            self.cumulative_notionals.append(total_notional)
+        self.dirty = False
+
+    def expected_fill(self, amount: float) -> ExpectedFill | None:
+        """Return the expected fill of an amount walking the side from the best
+        price"""
+
+        if not self.keys or amount <= 0:
+            return None
+        if self.dirty:
+            self.rebuild()
+
+        # index of the level that completes the amount
+        index = bisect_left(self.cumulative_sizes, amount)
+        if index >= len(self.keys):
+            filled = self.cumulative_sizes[-1]
+            return ExpectedFill(
+                average_price=self.cumulative_notionals[-1] / filled,
+                worst_price=abs(self.keys[-1]),
+                top_price=abs(self.keys[0]),
+                filled=filled,
+                amount=amount,
+            )
+        price = abs(self.keys[index])
+        previous_size = self.cumulative_sizes[index - 1] if index else 0.0
+        previous_notional = self.cumulative_notionals[index - 1] if index else 0.0
+        return ExpectedFill(
+            average_price=(previous_notional + (amount - previous_size) * price)
+            / amount,
+            worst_price=price,
+            top_price=abs(self.keys[0]),
+            filled=amount,
+            amount=amount,
+        )
+
+
+class OrderBook:
+    """Local copy of the top levels of the L2 order book of a symbol, kept up to date
+    by diffing the top levels of the websocket book"""
+
+    def __init__(self, depth: int = ORDER_BOOK_DEPTH) -> None:
+        self.depth = depth
+        self.bids = BookSide(descending=True)
+        self.asks = BookSide(descending=False)
+        self.updated_at = 0.0
+
+    def apply_levels(
+        self,
+        bids: List[Tuple[float, float]],
+        asks: List[Tuple[float, float]],
+        timestamp: float | None = None,
+    ) -> None:
+        """Apply the top levels of a book maintained elsewhere (like the ccxt
+        websocket book) at timestamp, only touching the levels that changed"""
+
+        for side, levels in (
+            (self.bids, bids[: self.depth]),
+            (self.asks, asks[: self.depth]),
+        ):
+            new_sizes = {float(level[0]): float(level[1]) for level in levels}
+            for price in [price for price in side.sizes if price not in new_sizes]:
+                side.apply(price, 0)
+            for price, size in new_sizes.items():
+                if side.sizes.get(price) != size:
+                    side.apply(price, size)
+        self.updated_at = timestamp if timestamp is not None else time()
+
+    def expected_fill(self, side: str, amount: float) -> ExpectedFill | None:
+        """Return the expected fill of a market order of the side and amount"""
+
+        return (self.asks if side == "buy" else self.bids).expected_fill(amount)
@@ -0,0 +1,160 @@
+from asyncio import get_running_loop, Task
+from decouple import config
+import json
+from logger import logger
+from offload import run_blocking
+import os
+from time import time
+from typing import Dict, Set
+
+
+SIGNAL_STATE_FILE = config("SIGNAL_STATE_FILE", default="signal_state.json")
+logger.info(f"{SIGNAL_STATE_FILE=}")
+SIGNAL_STATE_RETENTION_HOURS = config(
+    "SIGNAL_STATE_RETENTION_HOURS", cast=int, default="24"
+)
+logger.info(f"{SIGNAL_STATE_RETENTION_HOURS=}")
+
+# statuses of a submitted client order id
+SUBMITTED = "submitted"
+ACKNOWLEDGED = "acknowledged"
+
+
+class OrderRegistry:
+    """Registry of the client order ids that were sent to an exchange, persisted to
+    disk so a restart or retry never submits the same order twice. The registry is
+    written in the thread pool, so an order never waits for the disk"""
+
+    def __init__(self, path: str = SIGNAL_STATE_FILE) -> None:
+        self.path = path
+        self.entries: Dict[str, dict] = {}
+        self.acknowledged_signals: Set[str] = set()
+        self.is_dirty = False
+        self.save_task: Task | None = None
+        self.load()
+
+    def load(self) -> None:
+        """Load the registry from disk, dropping entries past the retention"""
+
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path) as state_file:
+                self.entries = json.load(state_file)
+        except Exception as e:
+            logger.error(f"Error loading {self.path}: {e}")
+            self.entries = {}
+        self.prune()
+
+    def clear(self) -> None:
+        """Forget every entry, e.g. before a replay"""
+
+        self.entries = {}
+        self.acknowledged_signals = set()
+
+    def write(self, entries: Dict[str, dict]) -> None:
+        """Write the entries to disk atomically"""
+
+        temporary_path = f"{self.path}.tmp"
+        with open(temporary_path, "w") as state_file:
+            json.dump(entries, state_file)
+        os.replace(temporary_path, self.path)
+
+    def save(self) -> None:
+        """Write the pruned registry to disk in the thread pool, the changes made
+        while a write is running are written together by the next one. Without a
+        running event loop the registry is written right away"""
+
+        if not self.path:
+            return
+        self.is_dirty = True
+        try:
+            loop = get_running_loop()
+        except RuntimeError:
+            self.is_dirty = False
+            self.prune()
+            self.write(self.entries)
+            return
+        if self.save_task is None or self.save_task.done():
+            self.save_task = loop.create_task(self.flush())
+
+    async def flush(self) -> None:
+        """Write the registry until no changes are left to write"""
+
+        while self.is_dirty:
+            self.is_dirty = False
+            self.prune()
+
+            # a copy, the event loop keeps changing the entries during the write
+            entries = {
+                client_order_id: dict(entry)
+                for client_order_id, entry in self.entries.items()
+            }
+            try:
+                await run_blocking(self.write, entries)
+            except Exception as e:
+                logger.error(f"Error saving {self.path}: {e}")
+
+    def prune(self, now: float | None = None) -> None:
+        """Remove the entries older than the retention"""
+
+        now = now if now is not None else time()
+        oldest = now - SIGNAL_STATE_RETENTION_HOURS * 3600
+        self.entries = {
+            client_order_id: entry
+            for client_order_id, entry in self.entries.items()
+            if entry.get("time", 0) >= oldest
+        }
+        self.index_acknowledged()
+
+    def index_acknowledged(self) -> None:
+        """Index the signals of which an order was acknowledged"""
+
+        self.acknowledged_signals = {
+            entry["signal_id"]
+            for entry in self.entries.values()
+            if entry["status"] == ACKNOWLEDGED
+        }
+
+    def __contains__(self, client_order_id: str) -> bool:
+        return client_order_id in self.entries
+
+    def register(
+        self, client_order_id: str, signal_id: str, strategy_type: str, account: str
+    ) -> None:
+        """Register a client order id before it is sent to the exchange"""
+
+        self.entries[client_order_id] = dict(
+            signal_id=signal_id,
+            strategy_type=strategy_type,
+            account=account,
+            status=SUBMITTED,
+            time=time(),
+        )
+        self.save()
+
+    def acknowledge(self, client_order_id: str) -> None:
+        """Mark a client order id as acknowledged by the exchange"""
+
+        if client_order_id in self.entries:
+            self.entries[client_order_id]["status"] = ACKNOWLEDGED
+            self.acknowledged_signals.add(self.entries[client_order_id]["signal_id"])
+            self.save()
+
+    def remove(self, client_order_id: str) -> None:
+        """Remove a client order id the exchange rejected, so it can be sent again"""
+
+        entry = self.entries.pop(client_order_id, None)
+        if entry is None:
+            return
+        if entry["status"] == ACKNOWLEDGED:
+            self.index_acknowledged()
+        self.save()
+
+    def is_acknowledged(self, signal_id: str) -> bool:
+        """Check if any order of a signal was acknowledged by the exchange"""
+
+        return signal_id in self.acknowledged_signals
+
+
+ORDER_REGISTRY = OrderRegistry()
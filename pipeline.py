@@ -0,0 +1,365 @@
+from asyncio import create_task, gather, run
+from clock import CLOCK_SAMPLES, ExchangeClock
+from coinalyze_scanner import CoinalyzeScanner, COINALYZE_LIQUIDATION_URL
+from datetime import datetime, timedelta
+from decouple import config
+from exchange import Exchange, journal_position
+from logger import logger
+from math import isnan
+from misc import (
+    BASE_TIME_FRAME,
+    Candle,
+    is_time_frame_close,
+    Liquidation,
+    LiquidationSet,
+)
+from multiprocessing import Pipe, Process
+from multiprocessing.connection import Connection, wait
+from settings import SETTINGS
+import struct
+from typing import Dict, List, Tuple
+
+from discord_client import NotificationQueue, USE_DISCORD
+
+
+if USE_DISCORD:
+    from discord_client import post_to_discord, DISCORD_CHANNEL_HEARTBEAT_ID
+
+
+PIPELINE_MODE = config("PIPELINE_MODE", cast=bool, default=False)
+logger.info(f"{PIPELINE_MODE=}")
+
+# message types, the first byte of every message
+LIQUIDATION = 1
+NOTIFICATION = 2
+JOURNAL = 3
+
+DIRECTIONS = ["long", "short"]
+
+# amount, direction, time, nr of liquidations, z-score, open interest change,
+# funding rate, long/short ratio, time frame and the candle
+LIQUIDATION_FORMAT = struct.Struct("<BdBqI4d8sq5d")
+# channel id, at everyone and the number of messages
+NOTIFICATION_FORMAT = struct.Struct("<BQ?H")
+# entry, take profit, stop loss, amount, liquidation amount, nr of liquidations,
+# candles before entry
+JOURNAL_FORMAT = struct.Struct("<B4dqII")
+STRING_LENGTH_FORMAT = struct.Struct("<I")
+
+
+def encode_strings(strings: List[str]) -> bytes:
+    """Encode strings as length prefixed utf-8"""
+
+    encoded = b""
+    for string in strings:
+        data = string.encode()
+        encoded += STRING_LENGTH_FORMAT.pack(len(data)) + data
+    return encoded
+
+
+def decode_strings(data: bytes, offset: int, nr_of_strings: int) -> List[str]:
+    """Decode length prefixed utf-8 strings starting at offset"""
+
+    strings = []
+    for _ in range(nr_of_strings):
+        (length,) = STRING_LENGTH_FORMAT.unpack_from(data, offset)
+        offset += STRING_LENGTH_FORMAT.size
+        strings.append(data[offset : offset + length].decode())
+        offset += length
+    return strings
+
+
+def to_double(value: float | None) -> float:
+    """Encode an optional float, None becomes NaN"""
+
+    return value if value is not None else float("nan")
+
+
+def from_double(value: float) -> float | None:
+    """Decode an optional float, NaN becomes None"""
+
+    return None if isnan(value) else value
+
+
+def encode_liquidation(liquidation: Liquidation) -> bytes:
+    """Encode a liquidation to a fixed size message"""
+
+    candle = liquidation.candle
+    return LIQUIDATION_FORMAT.pack(
+        LIQUIDATION,
+        liquidation.amount,
+        DIRECTIONS.index(liquidation.direction),
+        liquidation.time,
+        liquidation.nr_of_liquidations,
+        to_double(liquidation.z_score),
+        to_double(liquidation.open_interest_change),
+        to_double(liquidation.funding_rate),
+        to_double(liquidation.long_short_ratio),
+        liquidation.time_frame.encode(),
+        candle.timestamp,
+        candle.open,
+        candle.high,
+        candle.low,
+        candle.close,
+        candle.volume,
+    )
+
+
+def decode_liquidation(data: bytes) -> Liquidation:
+    """Decode a liquidation message"""
+
+    (
+        _,
+        amount,
+        direction,
+        time,
+        nr_of_liquidations,
+        z_score,
+        open_interest_change,
+        funding_rate,
+        long_short_ratio,
+        time_frame,
+        *candle,
+    ) = LIQUIDATION_FORMAT.unpack(data)
+    time_frame = time_frame.rstrip(b"\0").decode()
+    return Liquidation(
+        amount=amount,
+        direction=DIRECTIONS[direction],
+        time=time,
+        nr_of_liquidations=nr_of_liquidations,
+        candle=Candle(*candle, time_frame=time_frame),
+        time_frame=time_frame,
+        z_score=from_double(z_score),
+        open_interest_change=from_double(open_interest_change),
+        funding_rate=from_double(funding_rate),
+        long_short_ratio=from_double(long_short_ratio),
+    )
+
+
+def encode_notification(
+    channel_id: int, messages: List[str], at_everyone: bool
+) -> bytes:
+    """Encode a discord message queue entry"""
+
+    return NOTIFICATION_FORMAT.pack(
+        NOTIFICATION, channel_id, at_everyone, len(messages)
+    ) + encode_strings(messages)
+
+
+def decode_notification(data: bytes) -> Tuple[int, List[str], bool]:
+    """Decode a notification message to a discord message queue entry"""
+
+    _, channel_id, at_everyone, nr_of_messages = NOTIFICATION_FORMAT.unpack_from(data)
+    messages = decode_strings(data, NOTIFICATION_FORMAT.size, nr_of_messages)
+    return channel_id, messages, at_everyone
+
+
+def encode_journal(data: dict) -> bytes:
+    """Encode the journaling data of a position"""
+
+    return JOURNAL_FORMAT.pack(
+        JOURNAL,
+        data["entry_price"],
+        data["take_profit_price"],
+        data["stop_loss_price"],
+        data["amount"],
+        data["liquidation_amount"],
+        data["nr_of_liquidations"],
+        data["candles_before_entry"],
+    ) + encode_strings([data["start"], data["side"], data["strategy_type"]])
+
+
+def decode_journal(data: bytes) -> dict:
+    """Decode a journal message to the journaling data of a position"""
+
+    (
+        _,
+        entry_price,
+        take_profit_price,
+        stop_loss_price,
+        amount,
+        liquidation_amount,
+        nr_of_liquidations,
+        candles_before_entry,
+    ) = JOURNAL_FORMAT.unpack_from(data)
+    start, side, strategy_type = decode_strings(data, JOURNAL_FORMAT.size, 3)
+    return dict(
+        start=start,
+        entry_price=entry_price,
+        candles_before_entry=candles_before_entry,
+        side=side,
+        amount=amount,
+        take_profit_price=take_profit_price,
+        stop_loss_price=stop_loss_price,
+        liquidation_amount=liquidation_amount,
+        strategy_type=strategy_type,
+        nr_of_liquidations=nr_of_liquidations,
+    )
+
+
+def send_notifications(
+    connection: Connection, message_queue: NotificationQueue
+) -> None:
+    """Send the due messages of the discord message queue"""
+
+    for channel_id, messages, at_everyone in message_queue.drain():
+        connection.send_bytes(encode_notification(channel_id, messages, at_everyone))
+
+
+async def scan(
+    executor_connection: Connection, notifier_connection: Connection
+) -> None:
+    """Scan coinalyze at every close of the base time frame on the exchange clock and
+    send the new liquidations of every time frame to the executor"""
+
+    liquidation_set = LiquidationSet(liquidations=[])
+    scanner = CoinalyzeScanner(datetime.now(), liquidation_set)
+    await scanner.set_symbols()
+
+    # the exchange is only used to read candles and to queue discord messages
+    exchange = Exchange(liquidation_set, scanner)
+    scanner.exchange = exchange
+    clock = ExchangeClock(exchange.venue)
+    await clock.sync(nr_of_samples=CLOCK_SAMPLES)
+    # keep the background tasks, the event loop only keeps a weak reference to them
+    background_tasks = [create_task(clock.run())]
+
+    first_run = True
+    try:
+        while True:
+            now = clock.now()
+
+            if is_time_frame_close(now, BASE_TIME_FRAME) or first_run:
+                first_run = False
+                scanner.now = now
+                # fetch the candle, liquidations and market data at the same time
+                candle, buckets, _ = await gather(
+                    exchange.get_last_candle(clock.timestamp()),
+                    scanner.handle_coinalyze_url(COINALYZE_LIQUIDATION_URL),
+                    scanner.handle_market_feeds(),
+                )
+                for liquidation in await scanner.handle_time_frames(candle, buckets):
+                    if liquidation.candle is not None:
+                        executor_connection.send_bytes(encode_liquidation(liquidation))
+
+            for time_frame, time_frame_set in scanner.liquidation_sets.items():
+                if is_time_frame_close(now + timedelta(minutes=1), time_frame):
+                    time_frame_set.remove_old_liquidations(now + timedelta(minutes=1))
+
+            # the liquidations are validated here, follow the settings of the executor
+            if SETTINGS.should_reload():
+                try:
+                    SETTINGS.reload()
+                except Exception:
+                    # reload logs the invalid settings and keeps the current ones
+                    pass
+
+            send_notifications(notifier_connection, exchange.discord_message_queue)
+
+            await clock.sleep_until_next()
+    finally:
+        for task in background_tasks:
+            task.cancel()
+
+
+def run_scanner(
+    executor_connection: Connection, notifier_connection: Connection
+) -> None:
+    """Entry point of the scanner process"""
+
+    run(scan(executor_connection, notifier_connection))
+
+
+def run_notifier(connections: List[Connection]) -> None:
+    """Entry point of the notifier process, posts to discord and the journal until
+    every sending process is gone"""
+
+    while connections:
+        message_queue: List[Tuple[int, List[str], bool]] = []
+        for connection in wait(connections):
+            try:
+                data = connection.recv_bytes()
+            except EOFError:
+                connections.remove(connection)
+                continue
+
+            if data[0] == NOTIFICATION:
+                message_queue.append(decode_notification(data))
+            elif data[0] == JOURNAL:
+                try:
+                    journal_position(decode_journal(data))
+                except Exception as e:
+                    if USE_DISCORD:
+                        message_queue.append(
+                            (
+                                DISCORD_CHANNEL_HEARTBEAT_ID,
+                                ["Error journaling position:", str(e)],
+                                False,
+                            )
+                        )
+
+        if USE_DISCORD and message_queue:
+            post_to_discord(message_queue=message_queue)
+
+
+class Pipeline:
+    """Runs the scanner and the notifier in their own processes, so the process of
+    the executor only does trading work. Messages go over local socket pairs in a
+    compact binary format"""
+
+    def __init__(self) -> None:
+        self.liquidation_receiver, liquidation_sender = Pipe(duplex=False)
+        notification_receiver, self.notification_sender = Pipe(duplex=False)
+        scanner_notification_receiver, scanner_notification_sender = Pipe(duplex=False)
+        self.processes = [
+            Process(
+                target=run_scanner,
+                args=(liquidation_sender, scanner_notification_sender),
+                name="scanner",
+                daemon=True,
+            ),
+            Process(
+                target=run_notifier,
+                args=([notification_receiver, scanner_notification_receiver],),
+                name="notifier",
+                daemon=True,
+            ),
+        ]
+
+    def start(self) -> None:
+        """Start the scanner and notifier processes"""
+
+        for process in self.processes:
+            process.start()
+            logger.info(f"Started the {process.name} process ({process.pid})")
+
+    def check_processes(self) -> List[str]:
+        """Return the names of the processes that died, every process is reported
+        once"""
+
+        died = [process for process in self.processes if not process.is_alive()]
+        for process in died:
+            logger.error(f"The {process.name} process exited with {process.exitcode}")
+            self.processes.remove(process)
+        return [process.name for process in died]
+
+    def receive_liquidations(self, liquidation_sets: Dict[str, LiquidationSet]) -> None:
+        """Add the liquidations the scanner sent to the liquidation set of their time
+        frame, without blocking"""
+
+        while self.liquidation_receiver.poll():
+            liquidation = decode_liquidation(self.liquidation_receiver.recv_bytes())
+            logger.info(f"Received {liquidation=}")
+            liquidation_sets[liquidation.time_frame].add(liquidation)
+
+    def send_notifications(self, message_queue: NotificationQueue) -> None:
+        """Send the discord messages of the executor to the notifier"""
+
+        send_notifications(self.notification_sender, message_queue)
+
+    def send_journals(self, journal_queue: List[dict]) -> None:
+        """Send the positions to journal to the notifier"""
+
+        for data in journal_queue:
+            self.notification_sender.send_bytes(encode_journal(data))
+        journal_queue.clear()
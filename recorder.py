@@ -0,0 +1,180 @@
+import ccxt
+from collections import deque
+from decouple import config
+import gzip
+import json
+from logger import logger
+from typing import Awaitable, Callable, Deque, Dict, List
+from venues import Venue
+
+
+RECORD_SESSION = config("RECORD_SESSION", default="")
+logger.info(f"{RECORD_SESSION=}")
+REPLAY_SESSION = config("REPLAY_SESSION", default="")
+logger.info(f"{REPLAY_SESSION=}")
+
+# sources of the recorded inputs
+CLOCK = "clock"
+COINALYZE = "coinalyze"
+VENUE = "venue"
+
+# the venue calls that are recorded, the streams and pings are not
+VENUE_METHODS = [
+    "fetch_ticker",
+    "fetch_ohlcv",
+    "fetch_balance",
+    "fetch_positions",
+    "fetch_open_orders",
+    "fetch_my_trades",
+    "fetch_order_by_client_id",
+    "set_leverage",
+    "create_order",
+]
+
+
+def get_venue_key(venue: Venue, account: str, method: str) -> str:
+    """Return the key of a venue call of an account"""
+
+    return f"{account}:{venue.name}:{method}"
+
+
+def get_coinalyze_key(url: str, params: dict) -> str:
+    """Return the key of a coinalyze request, batches of the same url are fetched at
+    the same time so the symbols are part of the key"""
+
+    return f"{url}:{params.get('symbols', '')}"
+
+
+class Recorder:
+    """Records every external input at the boundary of the bot, the exchange clock,
+    the coinalyze responses and the venue responses, to an append only gzipped json
+    lines log"""
+
+    def __init__(self, path: str = RECORD_SESSION) -> None:
+        self.path = path
+        self.lines: List[str] = []
+
+    def write(
+        self, source: str, key: str, value=None, error: Exception | None = None
+    ) -> None:
+        """Queue a record of a value or an error"""
+
+        record = dict(s=source, k=key)
+        if error is not None:
+            record["e"] = [type(error).__name__, str(error)]
+        else:
+            record["v"] = value
+        self.lines.append(json.dumps(record, separators=(",", ":"), default=str))
+
+    def flush(self) -> None:
+        """Append the queued records to the log, every flush is a gzip member"""
+
+        if not self.lines:
+            return
+        lines, self.lines = self.lines, []
+        try:
+            with gzip.open(self.path, "at") as log:
+                log.write("\n".join(lines) + "\n")
+        except Exception as e:
+            logger.error(f"Error writing {len(lines)} records to {self.path}: {e}")
+
+    def recorded(
+        self,
+        source: str,
+        function: Callable[..., Awaitable],
+        get_key: Callable[..., str],
+    ) -> Callable[..., Awaitable]:
+        """Wrap an async call so its result or error is recorded"""
+
+        async def record(*args, **kwargs):
+            key = get_key(*args, **kwargs)
+            try:
+                value = await function(*args, **kwargs)
+            except Exception as e:
+                self.write(source, key, error=e)
+                raise
+            self.write(source, key, value)
+            return value
+
+        return record
+
+    def record_venue(self, venue: Venue, account: str) -> None:
+        """Record the responses of the venue calls of an account"""
+
+        for method in VENUE_METHODS:
+            key = get_venue_key(venue, account, method)
+            setattr(
+                venue,
+                method,
+                self.recorded(
+                    VENUE, getattr(venue, method), lambda *_, key=key, **__: key
+                ),
+            )
+
+    def record_scanner(self, scanner) -> None:
+        """Record the coinalyze responses of the scanner"""
+
+        scanner.fetch_coinalyze = self.recorded(
+            COINALYZE, scanner.fetch_coinalyze, get_coinalyze_key
+        )
+
+
+class ReplaySession:
+    """A recorded session that answers the venue and coinalyze calls with the
+    recorded responses in the recorded order, per call, without any I/O"""
+
+    def __init__(self, path: str = REPLAY_SESSION) -> None:
+        self.timestamps: List[float] = []
+        self.records: Dict[str, Deque[dict]] = {}
+        self.misses = 0
+        with gzip.open(path, "rt") as log:
+            for line in log:
+                record = json.loads(line)
+                if record["s"] == CLOCK:
+                    self.timestamps.append(record["v"])
+                else:
+                    key = f"{record['s']}:{record['k']}"
+                    self.records.setdefault(key, deque()).append(record)
+
+    @property
+    def remaining(self) -> int:
+        """Return the number of recorded responses that were not replayed"""
+
+        return sum(len(records) for records in self.records.values())
+
+    def replayed(
+        self, source: str, get_key: Callable[..., str]
+    ) -> Callable[..., Awaitable]:
+        """Return an async call that answers with the next recorded response"""
+
+        async def replay(*args, **kwargs):
+            key = f"{source}:{get_key(*args, **kwargs)}"
+            records = self.records.get(key)
+            if not records:
+                self.misses += 1
+                raise LookupError(f"No recorded response left for {key}")
+            record = records.popleft()
+            if "e" in record:
+                name, message = record["e"]
+                error = getattr(ccxt, name, None)
+                if not isinstance(error, type) or not issubclass(error, Exception):
+                    error = Exception
+                raise error(message)
+            return record["v"]
+
+        return replay
+
+    def replay_venue(self, venue: Venue, account: str) -> None:
+        """Answer the venue calls of an account from the session"""
+
+        for method in VENUE_METHODS:
+            key = get_venue_key(venue, account, method)
+            setattr(venue, method, self.replayed(VENUE, lambda *_, key=key, **__: key))
+
+    def replay_scanner(self, scanner) -> None:
+        """Answer the coinalyze requests of the scanner from the session"""
+
+        scanner.fetch_coinalyze = self.replayed(COINALYZE, get_coinalyze_key)
+
+
+RECORDER = Recorder() if RECORD_SESSION else None
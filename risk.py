@@ -0,0 +1,163 @@
+from collections import deque
+from dataclasses import dataclass
+from decouple import config
+from logger import logger
+from time import time
+from typing import Deque, Dict, List, Set, Tuple
+
+
+USE_RISK_ENGINE = config("USE_RISK_ENGINE", cast=bool, default=False)
+logger.info(f"{USE_RISK_ENGINE=}")
+MAX_POSITIONS_PER_STRATEGY = config("MAX_POSITIONS_PER_STRATEGY", cast=int, default="1")
+logger.info(f"{MAX_POSITIONS_PER_STRATEGY=}")
+MAX_ORDERS_PER_SIGNAL = config("MAX_ORDERS_PER_SIGNAL", cast=int, default="1")
+logger.info(f"{MAX_ORDERS_PER_SIGNAL=}")
+MAX_ORDERS_PER_WINDOW = config("MAX_ORDERS_PER_WINDOW", cast=int, default="4")
+logger.info(f"{MAX_ORDERS_PER_WINDOW=}")
+RISK_WINDOW_MINUTES = config("RISK_WINDOW_MINUTES", cast=int, default="10")
+logger.info(f"{RISK_WINDOW_MINUTES=}")
+MAX_MARGIN_PERCENTAGE = config("MAX_MARGIN_PERCENTAGE", cast=float, default="100")
+logger.info(f"{MAX_MARGIN_PERCENTAGE=}")
+MAX_EXPOSURE_CONTRACTS = config("MAX_EXPOSURE_CONTRACTS", cast=float, default="0")
+logger.info(f"{MAX_EXPOSURE_CONTRACTS=}")
+
+
+@dataclass
+class OpenEntry:
+    """OpenEntry class to hold a position entry the bot made"""
+
+    strategy_type: str
+    direction: str
+    amount: float
+    price: float
+    margin: float
+    time: float
+    client_order_id: str = ""
+    signal_id: str = ""
+
+
+class RiskEngine:
+    """Pre-trade risk checks over locally cached exposure state, so no request to the
+    exchange is needed before an order"""
+
+    def __init__(self, leverage: int, contract_size: float = 0.001) -> None:
+        self.leverage = leverage
+        self.contract_size = contract_size
+        self.balance = 0.0
+        self.entries: List[OpenEntry] = []
+        self.positions_per_strategy: Dict[str, int] = {}
+        self.exposure = 0.0
+        self.margin_used = 0.0
+        self.order_times: Deque[float] = deque()
+
+    def get_margin(self, amount: float, price: float) -> float:
+        """Return the margin of a position of amount contracts at price"""
+
+        return amount * self.contract_size * price / self.leverage
+
+    def orders_in_window(self, now: float) -> int:
+        """Return the number of orders in the trailing window"""
+
+        window_start = now - RISK_WINDOW_MINUTES * 60
+        while self.order_times and self.order_times[0] < window_start:
+            self.order_times.popleft()
+        return len(self.order_times)
+
+    def check(
+        self,
+        strategy_type: str,
+        amount: float,
+        price: float,
+        now: float | None = None,
+        signal_id: str = "",
+    ) -> Tuple[bool, str]:
+        """Check if an order is allowed, returns the reason when it is not"""
+
+        if not USE_RISK_ENGINE:
+            return True, ""
+        now = now if now is not None else time()
+
+        # the live, grey and reversed strategies all trade the same signal
+        signal_orders = sum(entry.signal_id == signal_id for entry in self.entries)
+        if signal_id and signal_orders >= MAX_ORDERS_PER_SIGNAL:
+            return False, (
+                f"signal {signal_id} has {signal_orders} open position(s), "
+                f"max is {MAX_ORDERS_PER_SIGNAL}"
+            )
+
+        open_positions = self.positions_per_strategy.get(strategy_type, 0)
+        if open_positions >= MAX_POSITIONS_PER_STRATEGY:
+            return False, (
+                f"{strategy_type} has {open_positions} open position(s), "
+                f"max is {MAX_POSITIONS_PER_STRATEGY}"
+            )
+
+        orders = self.orders_in_window(now)
+        if orders >= MAX_ORDERS_PER_WINDOW:
+            return False, (
+                f"{orders} orders in the last {RISK_WINDOW_MINUTES} minutes, "
+                f"max is {MAX_ORDERS_PER_WINDOW}"
+            )
+
+        if MAX_EXPOSURE_CONTRACTS and self.exposure + amount > MAX_EXPOSURE_CONTRACTS:
+            return False, (
+                f"exposure would be {round(self.exposure + amount, 1)} contract(s), "
+                f"max is {MAX_EXPOSURE_CONTRACTS}"
+            )
+
+        if self.balance > 0:
+            margin_percentage = (
+                (self.margin_used + self.get_margin(amount, price)) / self.balance * 100
+            )
+            if margin_percentage > MAX_MARGIN_PERCENTAGE:
+                return False, (
+                    f"margin usage would be {round(margin_percentage, 1)}%, "
+                    f"max is {MAX_MARGIN_PERCENTAGE}%"
+                )
+        return True, ""
+
+    def record_order(
+        self,
+        strategy_type: str,
+        direction: str,
+        amount: float,
+        price: float,
+        now: float | None = None,
+        client_order_id: str = "",
+        signal_id: str = "",
+    ) -> None:
+        """Add an acknowledged order to the exposure state"""
+
+        now = now if now is not None else time()
+        entry = OpenEntry(
+            strategy_type=strategy_type,
+            direction=direction,
+            amount=amount,
+            price=price,
+            margin=self.get_margin(amount, price),
+            time=now,
+            client_order_id=client_order_id,
+            signal_id=signal_id,
+        )
+        self.entries.append(entry)
+        self.positions_per_strategy[strategy_type] = (
+            self.positions_per_strategy.get(strategy_type, 0) + 1
+        )
+        self.exposure += entry.amount
+        self.margin_used += entry.margin
+        self.order_times.append(now)
+
+    def sync_positions(self, open_directions: Set[str]) -> List[OpenEntry]:
+        """Close the entries of every direction that has no open position on the
+        exchange anymore, returns the closed entries. Positions of the same direction
+        are merged on the exchange, so entries only close once the side is flat"""
+
+        closed = [
+            entry for entry in self.entries if entry.direction not in open_directions
+        ]
+        for entry in closed:
+            self.entries.remove(entry)
+            self.positions_per_strategy[entry.strategy_type] -= 1
+            self.exposure -= entry.amount
+            self.margin_used -= entry.margin
+        return closed
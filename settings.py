@@ -0,0 +1,229 @@
+from dataclasses import dataclass, field
+from datetime import datetime
+from decouple import config, Config, Csv, RepositoryEmpty, RepositoryEnv
+from logger import logger
+import os
+from typing import Dict, List, Tuple
+
+
+SETTINGS_FILE = config(
+    "SETTINGS_FILE", default=os.path.join(os.path.dirname(__file__), ".env")
+)
+logger.info(f"{SETTINGS_FILE=}")
+
+# Strategy types
+LIVE = "live"
+REVERSED = "reversed"
+GREY = "grey"
+JOURNALING = "journaling"
+
+# the default stop loss %, take profit %, trading days and trading hours per strategy
+STRATEGY_DEFAULTS = {
+    LIVE: ("0.5", "5.0", "0,1,3,4,5,6", "2,3,4"),
+    REVERSED: ("0.40", "4.0", "0,1,3,4,5,6", "14,15,16"),
+    GREY: ("0.8", "4.0", "0,1,3,4,5,6", "0,1,17,18,19,20,21,22,23"),
+    JOURNALING: (
+        "0.8",
+        "4",
+        "0,1,2,3,4,5,6",
+        "0,1,2,3,4,5,6,7,8,9,10,11,12,13,14,15,16,17,18,19,20,21,22,23",
+    ),
+}
+
+# upper bound of the leverage setting
+MAXIMAL_LEVERAGE = 150
+
+
+@dataclass(frozen=True)
+class StrategySettings:
+    """StrategySettings class to hold the settings of a strategy, with the trading
+    days and hours as a mask of the 168 hours of the week"""
+
+    enabled: bool
+    sl_percentage: float
+    tp_percentage: float
+    trading_days: Tuple[int, ...]
+    trading_hours: Tuple[int, ...]
+    schedule_mask: int = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self) -> None:
+        object.__setattr__(
+            self,
+            "schedule_mask",
+            sum(
+                1 << (day * 24 + hour)
+                for day in set(self.trading_days)
+                for hour in set(self.trading_hours)
+            ),
+        )
+
+    def is_trading(self, now: datetime) -> bool:
+        """Check if now is in the trading days and hours"""
+
+        return bool(self.schedule_mask >> (now.weekday() * 24 + now.hour) & 1)
+
+    def get_errors(self, strategy_type: str, leverage: int) -> List[str]:
+        """Return the reasons the settings are invalid"""
+
+        errors = []
+        if self.sl_percentage <= 0 or self.tp_percentage <= 0:
+            errors.append(f"{strategy_type} stop loss and take profit must be positive")
+        elif self.sl_percentage * leverage >= 100:
+            errors.append(
+                f"{strategy_type} stop loss of {self.sl_percentage}% is beyond the "
+                f"liquidation price at {leverage}x"
+            )
+        if not all(0 <= day <= 6 for day in self.trading_days):
+            errors.append(f"{strategy_type} trading days must be 0-6")
+        if not all(0 <= hour <= 23 for hour in self.trading_hours):
+            errors.append(f"{strategy_type} trading hours must be 0-23")
+        return errors
+
+
+@dataclass(frozen=True)
+class Settings:
+    """Settings class to hold a version of the strategy settings, a new version
+    replaces the previous one as a whole"""
+
+    version: int
+    leverage: int
+    position_percentage: float
+    minimal_liquidation: int
+    minimal_nr_of_liquidations: int
+    strategies: Dict[str, StrategySettings]
+
+    def validate(self) -> None:
+        """Raise a ValueError with every reason the settings are invalid"""
+
+        errors = []
+        if not 1 <= self.leverage <= MAXIMAL_LEVERAGE:
+            errors.append(f"leverage must be 1-{MAXIMAL_LEVERAGE}")
+        if not 0 < self.position_percentage <= 100:
+            errors.append("position percentage must be above 0 and at most 100")
+        if self.minimal_liquidation < 0 or self.minimal_nr_of_liquidations < 0:
+            errors.append("minimal liquidation settings must not be negative")
+        for strategy_type, strategy in self.strategies.items():
+            errors += strategy.get_errors(strategy_type, self.leverage)
+        if errors:
+            raise ValueError("; ".join(errors))
+
+    def to_env(self) -> Dict[str, object]:
+        """Return the settings by their environment variable"""
+
+        env = dict(
+            LEVERAGE=self.leverage,
+            POSITION_PERCENTAGE=self.position_percentage,
+            MINIMAL_LIQUIDATION=self.minimal_liquidation,
+            MINIMAL_NR_OF_LIQUIDATIONS=self.minimal_nr_of_liquidations,
+        )
+        for strategy_type, strategy in self.strategies.items():
+            prefix = strategy_type.upper()
+            env[f"USE_{prefix}_STRATEGY"] = strategy.enabled
+            env[f"{prefix}_SL_PERCENTAGE"] = strategy.sl_percentage
+            env[f"{prefix}_TP_PERCENTAGE"] = strategy.tp_percentage
+            env[f"{prefix}_TRADING_DAYS"] = list(strategy.trading_days)
+            env[f"{prefix}_TRADING_HOURS"] = list(strategy.trading_hours)
+        return env
+
+    def diff(self, other: "Settings") -> Dict[str, Tuple[object, object]]:
+        """Return the (old, new) values of the settings that changed in other"""
+
+        old, new = self.to_env(), other.to_env()
+        return {name: (old[name], new[name]) for name in old if old[name] != new[name]}
+
+
+def read_settings(settings_config: Config, version: int = 1) -> Settings:
+    """Read the settings, the environment overrides the settings file"""
+
+    strategies = {}
+    for strategy_type, (sl, tp, days, hours) in STRATEGY_DEFAULTS.items():
+        prefix = strategy_type.upper()
+        strategies[strategy_type] = StrategySettings(
+            enabled=settings_config(f"USE_{prefix}_STRATEGY", cast=bool, default=True),
+            sl_percentage=settings_config(
+                f"{prefix}_SL_PERCENTAGE", cast=float, default=sl
+            ),
+            tp_percentage=settings_config(
+                f"{prefix}_TP_PERCENTAGE", cast=float, default=tp
+            ),
+            trading_days=tuple(
+                settings_config(f"{prefix}_TRADING_DAYS", cast=Csv(int), default=days)
+            ),
+            trading_hours=tuple(
+                settings_config(f"{prefix}_TRADING_HOURS", cast=Csv(int), default=hours)
+            ),
+        )
+    return Settings(
+        version=version,
+        leverage=settings_config("LEVERAGE", cast=int, default="20"),
+        position_percentage=settings_config(
+            "POSITION_PERCENTAGE", cast=float, default="1"
+        ),
+        minimal_liquidation=settings_config(
+            "MINIMAL_LIQUIDATION", cast=int, default=10_000
+        ),
+        minimal_nr_of_liquidations=settings_config(
+            "MINIMAL_NR_OF_LIQUIDATIONS", cast=int, default=3
+        ),
+        strategies=strategies,
+    )
+
+
+class SettingsManager:
+    """Holds the current settings and reloads them when the settings file changed or
+    a reload was requested, an invalid file keeps the current settings"""
+
+    def __init__(self, path: str = SETTINGS_FILE) -> None:
+        self.path = path
+        self.modified = self.get_modified()
+        self.reload_requested = False
+        self.current = read_settings(self.get_config())
+        self.current.validate()
+        for name, value in self.current.to_env().items():
+            logger.info(f"{name}={value!r}")
+
+    def get_modified(self) -> float | None:
+        """Return the modification time of the settings file"""
+
+        try:
+            return os.stat(self.path).st_mtime
+        except OSError:
+            return None
+
+    def get_config(self) -> Config:
+        """Return a config that reads the settings file from disk again"""
+
+        if os.path.isfile(self.path):
+            return Config(RepositoryEnv(self.path))
+        return Config(RepositoryEmpty())
+
+    def request_reload(self) -> None:
+        """Reload the settings at the next check, e.g. on SIGHUP"""
+
+        self.reload_requested = True
+
+    def should_reload(self) -> bool:
+        """Check if the settings file changed or a reload was requested"""
+
+        return self.reload_requested or self.get_modified() != self.modified
+
+    def reload(self) -> Dict[str, Tuple[object, object]]:
+        """Read and validate the settings again and swap them in, returns the
+        settings that changed"""
+
+        self.reload_requested = False
+        self.modified = self.get_modified()
+        try:
+            settings = read_settings(self.get_config(), self.current.version + 1)
+            settings.validate()
+        except Exception as e:
+            logger.error(f"Invalid settings in {self.path}, keeping the current: {e}")
+            raise
+        changes = self.current.diff(settings)
+        if changes:
+            self.current = settings
+            logger.info(f"Settings version {settings.version}: {changes}")
+        return changes
+
+
+SETTINGS = SettingsManager()
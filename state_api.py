@@ -0,0 +1,233 @@
+from asyncio import start_server, Server, StreamReader, StreamWriter
+from collections import deque
+from dataclasses import dataclass
+from datetime import datetime
+from decouple import config
+from exchange import Exchange
+import hashlib
+import json
+from logger import logger
+from loop_monitor import get_percentiles, LoopMonitor
+from settings import GREY, JOURNALING, LIVE, REVERSED, SETTINGS
+from typing import Callable, Deque, Dict, Tuple
+
+
+USE_STATE_API = config("USE_STATE_API", cast=bool, default=False)
+logger.info(f"{USE_STATE_API=}")
+if USE_STATE_API:
+    STATE_API_PORT = config("STATE_API_PORT", cast=int, default="8766")
+    logger.info(f"{STATE_API_PORT=}")
+
+# cycles of which the timings are reported
+CYCLE_WINDOW = 300
+
+STRATEGY_TYPES = [LIVE, REVERSED, GREY, JOURNALING]
+
+
+HTTP_STATUS = {
+    200: "OK",
+    304: "Not Modified",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+}
+
+
+def get_http_response(status: int, body: bytes, etag: str | None = None) -> bytes:
+    """Return a json http response"""
+
+    headers = [
+        f"HTTP/1.1 {status} {HTTP_STATUS[status]}",
+        "Content-Type: application/json",
+        f"Content-Length: {len(body)}",
+        "Cache-Control: no-cache",
+        "Connection: close",
+    ]
+    if etag is not None:
+        headers.append(f"ETag: {etag}")
+    return ("\r\n".join(headers) + "\r\n\r\n").encode() + body
+
+
+@dataclass
+class Snapshot:
+    """Snapshot class to hold a rendered response with the state it was built from"""
+
+    key: object
+    body: bytes
+    etag: str
+
+
+class StateServer:
+    """Localhost only read-only HTTP API of the in-memory state. Every endpoint has a
+    cheap key of the state it shows and its json response is only rendered again when
+    the key changed, so polling only compares a key and sends cached bytes. Clients
+    that send the ETag in If-None-Match get a 304 while nothing changed"""
+
+    def __init__(self, exchange: Exchange, loop_monitor: LoopMonitor) -> None:
+        self.exchange = exchange
+        self.loop_monitor = loop_monitor
+        self.server: Server | None = None
+        self.cycle_times: Deque[float] = deque(maxlen=CYCLE_WINDOW)
+        self.last_cycle_at: float | None = None
+        self.nr_of_cycles = 0
+        self.snapshots: Dict[str, Snapshot] = {}
+        self.endpoints: Dict[str, Tuple[Callable[[], object], Callable[[], dict]]] = {
+            "/liquidations": (self.get_liquidations_key, self.get_liquidations),
+            "/positions": (self.get_positions_key, self.get_positions),
+            "/position_sizes": (self.get_position_sizes_key, self.get_position_sizes),
+            "/timings": (lambda: self.nr_of_cycles, self.get_timings),
+        }
+
+    async def start(self) -> None:
+        """Start listening on localhost"""
+
+        self.server = await start_server(
+            self.handle_client, "127.0.0.1", STATE_API_PORT
+        )
+        logger.info(f"State API listening on http://127.0.0.1:{STATE_API_PORT}")
+
+    def record_cycle(self, timestamp: float, duration: float) -> None:
+        """Record the exchange time and the duration of a cycle"""
+
+        self.last_cycle_at = timestamp
+        self.cycle_times.append(duration)
+        self.nr_of_cycles += 1
+
+    def get_liquidations_key(self) -> object:
+        """Return the signals and states of the liquidation set of every time frame"""
+
+        return tuple(
+            (liquidation.signal_id, liquidation.state)
+            for liquidation_set in self.exchange.scanner.liquidation_sets.values()
+            for liquidation in liquidation_set.liquidations
+        )
+
+    def get_liquidations(self) -> dict:
+        """Return the liquidations with their signal id and state"""
+
+        return dict(
+            liquidations=[
+                dict(
+                    liquidation.to_dict(),
+                    signal_id=liquidation.signal_id,
+                    state=liquidation.state,
+                    time=datetime.fromtimestamp(liquidation.time).isoformat(),
+                )
+                for liquidation_set in self.exchange.scanner.liquidation_sets.values()
+                for liquidation in liquidation_set.liquidations
+            ]
+        )
+
+    def get_positions_key(self) -> object:
+        """Return the positions and orders of every account, the lists are replaced
+        and not changed when the exchange reports changes"""
+
+        return tuple(
+            (account.positions, account.market_tpsl_orders, account.limit_orders)
+            for account in self.exchange.accounts
+        )
+
+    def get_positions(self) -> dict:
+        """Return the positions and orders per account"""
+
+        return {
+            account.account: dict(
+                positions=account.positions,
+                market_tpsl_orders=account.market_tpsl_orders,
+                limit_orders=account.limit_orders,
+            )
+            for account in self.exchange.accounts
+        }
+
+    def get_position_sizes_key(self) -> object:
+        """Return the settings version and the position sizes of every account"""
+
+        return SETTINGS.current.version, tuple(
+            getattr(account, f"_{strategy_type}_position_size", None)
+            for account in self.exchange.accounts
+            for strategy_type in STRATEGY_TYPES
+        )
+
+    def get_position_sizes(self) -> dict:
+        """Return the position sizes per account and strategy"""
+
+        return dict(
+            settings_version=SETTINGS.current.version,
+            position_sizes={
+                account.account: {
+                    strategy_type: getattr(
+                        account, f"_{strategy_type}_position_size", None
+                    )
+                    for strategy_type in STRATEGY_TYPES
+                }
+                for account in self.exchange.accounts
+            },
+        )
+
+    def get_timings(self) -> dict:
+        """Return the timings of the recent cycles and the event loop lag"""
+
+        cycle_times_ms = [cycle_time * 1000 for cycle_time in self.cycle_times]
+        timings = dict(
+            last_cycle_at=(
+                datetime.fromtimestamp(self.last_cycle_at).isoformat()
+                if self.last_cycle_at is not None
+                else None
+            ),
+            last_cycle_ms=round(cycle_times_ms[-1], 3) if cycle_times_ms else None,
+            loop_lag_ms=self.loop_monitor.stats(),
+        )
+        if len(cycle_times_ms) >= 2:
+            timings["cycle_ms"] = get_percentiles(cycle_times_ms)
+        return timings
+
+    def get_snapshot(self, path: str) -> Snapshot:
+        """Return the snapshot of an endpoint, rendered again when its state
+        changed"""
+
+        get_key, get_state = self.endpoints[path]
+        key = get_key()
+        snapshot = self.snapshots.get(path)
+        if snapshot is None or snapshot.key != key:
+            body = json.dumps(get_state(), default=str).encode()
+            etag = f'"{hashlib.sha1(body).hexdigest()[:16]}"'
+            snapshot = Snapshot(key=key, body=body, etag=etag)
+            self.snapshots[path] = snapshot
+        return snapshot
+
+    def get_response(self, method: str, path: str, headers: Dict[str, str]) -> bytes:
+        """Return the http response to a request"""
+
+        path = path.split("?")[0].rstrip("/")
+        if method != "GET":
+            return get_http_response(405, b'{"error": "only GET is allowed"}')
+        if path == "":
+            return get_http_response(
+                200, json.dumps(dict(endpoints=list(self.endpoints))).encode()
+            )
+        if path not in self.endpoints:
+            return get_http_response(404, b'{"error": "not found"}')
+        snapshot = self.get_snapshot(path)
+        if headers.get("if-none-match") == snapshot.etag:
+            return get_http_response(304, b"", snapshot.etag)
+        return get_http_response(200, snapshot.body, snapshot.etag)
+
+    async def handle_client(self, reader: StreamReader, writer: StreamWriter) -> None:
+        """Answer a single http request and close the connection"""
+
+        try:
+            request_line = (await reader.readline()).decode("latin-1").split()
+            headers = {}
+            while (line := await reader.readline()) not in (b"\r\n", b"\n", b""):
+                name, _, value = line.decode("latin-1").partition(":")
+                headers[name.strip().lower()] = value.strip()
+            if len(request_line) < 2:
+                response = get_http_response(400, b'{"error": "bad request"}')
+            else:
+                response = self.get_response(request_line[0], request_line[1], headers)
+            writer.write(response)
+            await writer.drain()
+        except Exception as e:
+            logger.warning(f"State API error: {e}")
+        finally:
+            writer.close()
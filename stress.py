@@ -0,0 +1,334 @@
+import os
+
+# the harness only talks to simulated venues and a fake coinalyze, so it runs
+# without credentials and without posting to discord or the journal
+for name in ["COINALYZE_SECRET_API_KEY", "BLOFIN_API_KEY", "BLOFIN_SECRET_KEY"]:
+    os.environ.setdefault(name, "stress")
+os.environ.setdefault("USE_DISCORD", "false")
+os.environ.setdefault("USE_AUTO_JOURNALING", "false")
+
+from argparse import ArgumentParser
+from asyncio import gather, run, sleep
+from ccxt import NetworkError
+from coinalyze_scanner import (
+    CoinalyzeScanner,
+    COINALYZE_LIQUIDATION_URL,
+    INTERVAL,
+    INTERVAL_SECONDS,
+)
+from datetime import datetime
+from discord_client import get_discord_table
+from exchange import Exchange
+from logger import logger
+from loop_monitor import get_percentiles
+from misc import LiquidationSet
+from order_registry import ORDER_REGISTRY
+import random
+import resource
+from time import perf_counter
+import tracemalloc
+from typing import List
+from venues import SimulatedVenue, TICKER
+
+
+class FaultyVenue(SimulatedVenue):
+    """Simulated venue with latency spikes and network errors"""
+
+    def __init__(
+        self,
+        generator: random.Random,
+        latency: float,
+        spike_probability: float,
+        spike_latency: float,
+        error_probability: float,
+        **kwargs,
+    ) -> None:
+        super().__init__(latency=0.0, **kwargs)
+        self.generator = generator
+        self.base_latency = latency
+        self.spike_probability = spike_probability
+        self.spike_latency = spike_latency
+        self.error_probability = error_probability
+        self.errors = 0
+
+    async def fault(self) -> None:
+        """Wait for the latency of a request and fail it at the error rate"""
+
+        latency = self.base_latency
+        if self.generator.random() < self.spike_probability:
+            latency += self.spike_latency
+        await sleep(latency)
+        if self.generator.random() < self.error_probability:
+            self.errors += 1
+            raise NetworkError("Injected network error")
+
+    async def fetch_ticker(self) -> dict:
+        await self.fault()
+        return await super().fetch_ticker()
+
+    async def fetch_ohlcv(self, timeframe: str, limit: int) -> List[list]:
+        await self.fault()
+        return await super().fetch_ohlcv(timeframe, limit)
+
+    async def fetch_balance(self) -> dict:
+        await self.fault()
+        return await super().fetch_balance()
+
+    async def fetch_positions(self) -> List[dict]:
+        await self.fault()
+        return await super().fetch_positions()
+
+    async def create_order(self, *args, **kwargs) -> dict:
+        await self.fault()
+        return await super().create_order(*args, **kwargs)
+
+    async def fetch_order_by_client_id(self, client_order_id: str) -> dict | None:
+        await self.fault()
+        return await super().fetch_order_by_client_id(client_order_id)
+
+
+class FakeCoinalyze:
+    """Answers the liquidation history requests of the scanner with synthetic
+    buckets, a burst liquidates a large part of the symbols in the same bucket"""
+
+    def __init__(
+        self,
+        generator: random.Random,
+        burst_probability: float,
+        burst_share: float,
+        latency: float,
+        error_probability: float,
+    ) -> None:
+        self.generator = generator
+        self.burst_probability = burst_probability
+        self.burst_share = burst_share
+        self.latency = latency
+        self.error_probability = error_probability
+        self.burst_direction: str | None = None
+        self.errors = 0
+
+    def next_bucket(self) -> None:
+        """Decide if the next bucket is a burst and in which direction"""
+
+        self.burst_direction = None
+        if self.generator.random() < self.burst_probability:
+            self.burst_direction = self.generator.choice(["long", "short"])
+
+    def get_amount(self, direction: str) -> float:
+        """Return the liquidated amount of a symbol in the bucket"""
+
+        if direction == self.burst_direction:
+            if self.generator.random() < self.burst_share:
+                return self.generator.lognormvariate(11, 1.5)
+        return self.generator.lognormvariate(5, 2)
+
+    async def fetch(self, url: str, params: dict) -> List[dict]:
+        """Return the histories of the symbols of a request"""
+
+        await sleep(self.latency)
+        if self.generator.random() < self.error_probability:
+            self.errors += 1
+            raise ConnectionError("Injected coinalyze error")
+
+        interval_seconds = INTERVAL_SECONDS[params["interval"]]
+        bucket_time = params["to"] - params["to"] % interval_seconds - interval_seconds
+        return [
+            dict(
+                symbol=symbol,
+                history=[
+                    dict(
+                        t=bucket_time,
+                        l=self.get_amount("long"),
+                        s=self.get_amount("short"),
+                    )
+                ],
+            )
+            for symbol in params["symbols"].split(",")
+        ]
+
+
+class PricePath:
+    """Random walk of the price with a move against the liquidated side in a burst
+    and 5 minute candles"""
+
+    def __init__(
+        self,
+        generator: random.Random,
+        price: float,
+        volatility: float,
+        burst_move: float,
+    ) -> None:
+        self.generator = generator
+        self.price = price
+        self.volatility = volatility
+        self.burst_move = burst_move
+
+    def next_candle(self, timestamp: float, burst_direction: str | None) -> list:
+        """Move the price over a candle and return it"""
+
+        open_price = self.price
+        move = self.generator.gauss(0, self.volatility)
+        if burst_direction is not None:
+            move += -self.burst_move if burst_direction == "long" else self.burst_move
+        self.price = open_price * (1 + move / 100)
+        wick = abs(self.generator.gauss(0, self.volatility)) / 100 * open_price
+        return [
+            int(timestamp * 1000),
+            open_price,
+            max(open_price, self.price) + wick,
+            min(open_price, self.price) - wick,
+            self.price,
+            self.generator.uniform(100, 1000),
+        ]
+
+
+async def stress(arguments) -> None:
+    """Run the scanner, liquidation set and exchange loop over synthetic cycles and
+    report the throughput, cycle times and memory growth"""
+
+    generator = random.Random(arguments.seed)
+    ORDER_REGISTRY.path = ""
+    ORDER_REGISTRY.clear()
+
+    interval_seconds = INTERVAL_SECONDS[INTERVAL]
+    timestamp = datetime.now().timestamp() // interval_seconds * interval_seconds
+    liquidation_set = LiquidationSet(liquidations=[])
+    scanner = CoinalyzeScanner(datetime.fromtimestamp(timestamp), liquidation_set)
+    scanner._symbols = ",".join(
+        f"BTCUSD{index}_PERP.A" for index in range(arguments.symbols)
+    )
+    coinalyze = FakeCoinalyze(
+        generator,
+        arguments.burst_probability,
+        arguments.burst_share,
+        arguments.coinalyze_latency,
+        arguments.error_probability,
+    )
+    scanner.fetch_coinalyze = coinalyze.fetch
+
+    exchange = Exchange(liquidation_set, scanner)
+    exchange.journal_queue = []
+    scanner.exchange = exchange
+    venue = FaultyVenue(
+        generator,
+        arguments.latency,
+        arguments.spike_probability,
+        arguments.spike_latency,
+        arguments.error_probability,
+        name=exchange.venue.name,
+        symbol=TICKER,
+    )
+    exchange.venues[:] = [venue]
+    price_path = PricePath(
+        generator, venue.bid, arguments.volatility, arguments.burst_move
+    )
+    venue.candles = [price_path.next_candle(timestamp - interval_seconds, None)]
+    await exchange.set_position_sizes()
+
+    # tracing every allocation slows the cycles down, so it is optional
+    if arguments.trace_memory:
+        tracemalloc.start()
+        start_memory = tracemalloc.take_snapshot()
+    start_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    cycle_times: List[float] = []
+    failed_cycles = 0
+    nr_of_liquidations = 0
+    nr_of_messages = 0
+    started = perf_counter()
+    for _ in range(arguments.cycles):
+        # the candle that closed and the price at the start of the next one
+        coinalyze.next_bucket()
+        venue.candles.append(
+            price_path.next_candle(timestamp, coinalyze.burst_direction)
+        )
+        venue.candles = venue.candles[-2:]
+        timestamp += interval_seconds
+        venue.set_top_of_book(price_path.price, price_path.price + 0.1, timestamp)
+        now = datetime.fromtimestamp(timestamp)
+
+        cycle_started = perf_counter()
+        try:
+            scanner.now = now
+            # the risk engine and the venue quotes run on the synthetic clock
+            await exchange.run_loop(timestamp)
+            candle, buckets = await gather(
+                exchange.get_last_candle(timestamp),
+                scanner.handle_coinalyze_url(COINALYZE_LIQUIDATION_URL),
+            )
+            nr_of_liquidations += len(await scanner.handle_time_frames(candle, buckets))
+            for time_frame_set in scanner.liquidation_sets.values():
+                time_frame_set.remove_old_liquidations(now)
+            await exchange.get_open_positions()
+        except Exception as e:
+            failed_cycles += 1
+            logger.warning(f"Cycle at {now} failed: {e}")
+
+        # queue and drain the discord messages the way main does
+        for index in range(arguments.messages):
+            exchange.discord_message_queue.append(
+                (0, [get_discord_table(dict(cycle=timestamp, message=index))], False)
+            )
+        nr_of_messages += len(exchange.discord_message_queue.drain(timestamp))
+        exchange.journal_queue.clear()
+        cycle_times.append(perf_counter() - cycle_started)
+
+    duration = perf_counter() - started
+    rss_growth = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - start_rss
+
+    cycle_times_ms = [cycle_time * 1000 for cycle_time in cycle_times]
+    percentiles = get_percentiles(cycle_times_ms)
+    logger.info(
+        f"{arguments.cycles} cycles in {round(duration, 3)} s "
+        f"({round(arguments.cycles / duration, 1)} cycles/s), "
+        f"{nr_of_liquidations} liquidations, {len(venue.orders)} orders, "
+        f"{nr_of_messages} discord messages, {failed_cycles} failed cycles, "
+        f"{venue.errors} venue and {coinalyze.errors} coinalyze errors"
+    )
+    logger.info(
+        f"Cycle time (ms) p50={percentiles['p50']} p99={percentiles['p99']} "
+        f"max={percentiles['max']}"
+    )
+    logger.info(f"Peak RSS growth {rss_growth} KiB")
+    logger.info(f"Notification queue {exchange.discord_message_queue.stats()}")
+
+    if arguments.trace_memory:
+        growth = tracemalloc.take_snapshot().compare_to(start_memory, "lineno")
+        _, peak_memory = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        logger.info(
+            f"Traced memory growth "
+            f"{round(sum(stat.size_diff for stat in growth) / 1024, 1)} KiB, "
+            f"peak {round(peak_memory / 1024, 1)} KiB"
+        )
+        for stat in growth[:5]:
+            logger.info(f"Traced memory growth {stat}")
+
+
+def main() -> None:
+    parser = ArgumentParser(
+        description="Stress the scanner, liquidation set and exchange loop with "
+        "synthetic liquidation bursts, price paths, discord messages and injected "
+        "latency and errors"
+    )
+    parser.add_argument("--cycles", type=int, default=1000)
+    parser.add_argument("--symbols", type=int, default=60)
+    parser.add_argument("--burst-probability", type=float, default=0.2)
+    parser.add_argument("--burst-share", type=float, default=0.8)
+    parser.add_argument("--burst-move", type=float, default=0.5)
+    parser.add_argument("--volatility", type=float, default=0.2)
+    parser.add_argument("--messages", type=int, default=100)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--spike-probability", type=float, default=0.0)
+    parser.add_argument("--spike-latency", type=float, default=1.0)
+    parser.add_argument("--coinalyze-latency", type=float, default=0.0)
+    parser.add_argument("--error-probability", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--trace-memory", action="store_true")
+    arguments = parser.parse_args()
+    if arguments.cycles < 2:
+        parser.error("at least 2 cycles are needed for the cycle time percentiles")
+    run(stress(arguments))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,6 @@
+import os
+
+# the tests only talk to simulated venues and recorded sessions, so the keys are
+# placeholders when they are not set
+for name in ["COINALYZE_SECRET_API_KEY", "BLOFIN_API_KEY", "BLOFIN_SECRET_KEY"]:
+    os.environ.setdefault(name, "test")
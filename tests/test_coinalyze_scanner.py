@@ -0,0 +1,153 @@
+import coinalyze_scanner
+from coinalyze_scanner import CoinalyzeScanner, COINALYZE_LIQUIDATION_URL
+from datetime import datetime
+from misc import Candle, LiquidationSet
+from typing import Dict, List
+from unittest import IsolatedAsyncioTestCase, main, mock
+
+SYMBOLS = ["BTCUSDT_PERP.A", "BTCUSD_PERP.0"]
+START = 1_800_000_000 - 1_800_000_000 % 300
+
+
+class FakeCoinalyze:
+    """Answers the liquidation history requests with the buckets that have been
+    published so far"""
+
+    def __init__(self) -> None:
+        self.published: Dict[str, List[dict]] = {symbol: [] for symbol in SYMBOLS}
+
+    def publish(self, symbol: str, bucket_time: int, long: float) -> None:
+        self.published[symbol].append(dict(t=bucket_time, l=long, s=0.0))
+
+    async def fetch(self, url: str, params: dict) -> list:
+        return [
+            dict(
+                symbol=symbol,
+                history=[
+                    bucket
+                    for bucket in self.published[symbol]
+                    if params["from"] <= bucket["t"] <= params["to"]
+                ],
+            )
+            for symbol in params["symbols"].split(",")
+        ]
+
+
+def get_candle(bucket_time: int) -> Candle:
+    return Candle(bucket_time * 1000, 100_000.0, 100_010.0, 99_990.0, 100_000.0, 1.0)
+
+
+class LateBucketTest(IsolatedAsyncioTestCase):
+    """A bucket coinalyze publishes after the fetch at the close is acted on in the
+    next cycle"""
+
+    async def asyncSetUp(self) -> None:
+        self.coinalyze = FakeCoinalyze()
+        self.scanner = CoinalyzeScanner(
+            datetime.fromtimestamp(START), LiquidationSet(liquidations=[])
+        )
+        self.scanner.fetch_coinalyze = self.coinalyze.fetch
+        self.scanner._symbols = ",".join(SYMBOLS)
+
+    async def run_cycle(self, timestamp: int) -> list:
+        """Fetch the buckets and handle the candle that closed at timestamp"""
+
+        self.scanner.now = datetime.fromtimestamp(timestamp)
+        buckets = await self.scanner.handle_coinalyze_url(COINALYZE_LIQUIDATION_URL)
+        return await self.scanner.handle_time_frames(
+            get_candle(timestamp - 300), buckets
+        )
+
+    async def test_late_bucket(self) -> None:
+        # only the first symbol is published at the close, too little for a signal
+        self.coinalyze.publish(SYMBOLS[0], START - 300, 60_000.0)
+        self.assertEqual(await self.run_cycle(START), [])
+
+        # the second symbol of the same bucket arrives after the fetch
+        self.coinalyze.publish(SYMBOLS[1], START - 300, 60_000.0)
+        self.coinalyze.publish(SYMBOLS[0], START, 0.0)
+        self.coinalyze.publish(SYMBOLS[1], START, 0.0)
+        liquidations = await self.run_cycle(START + 300)
+
+        self.assertEqual(len(liquidations), 1)
+        self.assertEqual(liquidations[0].time, START - 300)
+        self.assertEqual(liquidations[0].amount, 120_000.0)
+        self.assertEqual(liquidations[0].candle.timestamp, (START - 300) * 1000)
+        self.assertEqual(self.scanner.liquidation_set.liquidations, liquidations)
+
+        # the baseline holds the late bucket as well
+        self.assertEqual(
+            self.scanner.aggregator.total("long", START - 300, 5), 120_000.0
+        )
+        self.assertEqual(self.scanner.aggregator.total("long", START, 10), 120_000.0)
+
+    async def test_known_signal_is_not_added_again(self) -> None:
+        self.coinalyze.publish(SYMBOLS[0], START - 300, 150_000.0)
+        self.assertEqual(len(await self.run_cycle(START)), 1)
+
+        self.coinalyze.publish(SYMBOLS[1], START - 300, 60_000.0)
+        self.assertEqual(await self.run_cycle(START + 300), [])
+        self.assertEqual(len(self.scanner.liquidation_set.liquidations), 1)
+
+
+@mock.patch.object(coinalyze_scanner, "TIME_FRAMES", ["5m", "15m"])
+class TimeFrameTest(IsolatedAsyncioTestCase):
+    """The candles and buckets of the longer time frames are aggregated from the base
+    ones, a candle only when all its base candles are known"""
+
+    async def asyncSetUp(self) -> None:
+        self.close = START - START % 900
+        self.coinalyze = FakeCoinalyze()
+        self.scanner = CoinalyzeScanner(
+            datetime.fromtimestamp(START), LiquidationSet(liquidations=[])
+        )
+        self.scanner.fetch_coinalyze = self.coinalyze.fetch
+        self.scanner._symbols = ",".join(SYMBOLS)
+        self.scanner.handle_liquidation_set = mock.AsyncMock(return_value=[])
+
+    async def run_cycles(self, candle_times: List[int]) -> None:
+        """Publish a bucket and handle the base candle of every candle time, each at
+        its close"""
+
+        for index, candle_time in enumerate(candle_times):
+            self.coinalyze.publish(SYMBOLS[0], candle_time, 1_000.0)
+            self.scanner.now = datetime.fromtimestamp(candle_time + 300)
+            buckets = await self.scanner.handle_coinalyze_url(COINALYZE_LIQUIDATION_URL)
+            candle = Candle(
+                candle_time * 1000,
+                100.0 + index,
+                110.0 + index,
+                90.0 - index,
+                101.0 + index,
+                1.0,
+            )
+            await self.scanner.handle_time_frames(candle, buckets)
+
+    def get_calls(self, time_frame: str) -> list:
+        return [
+            call.args
+            for call in self.scanner.handle_liquidation_set.call_args_list
+            if call.args[2:] == (time_frame,)
+        ]
+
+    async def test_aggregate_candles(self) -> None:
+        await self.run_cycles([self.close - 900, self.close - 600, self.close - 300])
+
+        # only the last cycle closes a 15m candle
+        ((candle, buckets, _),) = self.get_calls("15m")
+        self.assertEqual(
+            candle,
+            Candle((self.close - 900) * 1000, 100.0, 112.0, 88.0, 103.0, 3.0, "15m"),
+        )
+        self.assertEqual(
+            buckets, [dict(symbol=SYMBOLS[0], t=self.close - 900, l=3_000.0, s=0.0)]
+        )
+
+    async def test_missing_candle(self) -> None:
+        await self.run_cycles([self.close - 900, self.close - 300])
+
+        self.assertEqual(self.get_calls("15m"), [])
+
+
+if __name__ == "__main__":
+    main()
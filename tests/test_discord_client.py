@@ -0,0 +1,37 @@
+from discord_client import (
+    CODE_FENCE,
+    DISCORD_MESSAGE_LIMIT,
+    get_discord_table,
+    split_message,
+)
+from unittest import main, TestCase
+
+
+class SplitMessageTest(TestCase):
+    """A message that is too long for discord is split into valid parts"""
+
+    def test_short_message(self) -> None:
+        self.assertEqual(split_message("liquidation"), ["liquidation"])
+
+    def test_split_table(self) -> None:
+        table = get_discord_table({f"key_{index}": index for index in range(300)})
+        parts = split_message(f"Positions:\n{table}")
+
+        self.assertGreater(len(parts), 1)
+        for part in parts:
+            self.assertLessEqual(len(part), DISCORD_MESSAGE_LIMIT)
+            self.assertEqual(part.count(CODE_FENCE) % 2, 0)
+        self.assertTrue(parts[1].startswith(f"{CODE_FENCE}\n"))
+
+        # no row of the table is lost or broken
+        rows = [
+            line
+            for part in parts
+            for line in part.splitlines()
+            if line.startswith("key_")
+        ]
+        self.assertEqual(rows, [line for line in table.splitlines()[1:-1]])
+
+
+if __name__ == "__main__":
+    main()
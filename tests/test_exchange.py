@@ -0,0 +1,137 @@
+from ccxt import ExchangeError
+from coinalyze_scanner import CoinalyzeScanner
+from datetime import datetime
+from loop_monitor import LoopMonitor
+from misc import ARMED, Candle, FILLED, Liquidation, LiquidationSet, TRIGGERED
+from order_registry import ORDER_REGISTRY
+import risk
+from tests.test_replay import bot, fetch_coinalyze, START, SYMBOLS
+from time import perf_counter
+from unittest import IsolatedAsyncioTestCase, main, mock
+from venues import SimulatedVenue
+
+
+class RejectingVenue(SimulatedVenue):
+    """Simulated venue that rejects the first orders"""
+
+    def __init__(self, nr_of_rejections: int, **kwargs) -> None:
+        super().__init__(**kwargs)
+        self.nr_of_rejections = nr_of_rejections
+
+    async def create_order(self, *args, **kwargs) -> dict:
+        if self.nr_of_rejections:
+            self.nr_of_rejections -= 1
+            raise ExchangeError("order rejected")
+        return await super().create_order(*args, **kwargs)
+
+
+class SignalStateTest(IsolatedAsyncioTestCase):
+    """A triggered signal without an acknowledged order is armed again"""
+
+    async def asyncSetUp(self) -> None:
+        ORDER_REGISTRY.path = ""
+        ORDER_REGISTRY.clear()
+        self.scanner = CoinalyzeScanner(
+            datetime.fromtimestamp(START), LiquidationSet(liquidations=[])
+        )
+        self.scanner.fetch_coinalyze = fetch_coinalyze
+        self.scanner._symbols = ",".join(SYMBOLS)
+        self.exchange = bot.create_exchange(self.scanner)
+
+    async def run_cycles(self, venue: SimulatedVenue, start: int, stop: int) -> None:
+        """Run the cycles of 5 minutes from start up to stop in which the price trades
+        above every candle"""
+
+        self.exchange.venues[:] = [venue]
+        await self.exchange.set_position_sizes()
+        for index in range(start, stop):
+            timestamp = START + index * 300
+            venue.candles = [
+                [(timestamp - 300) * 1000, 100_000.0, 100_010.0, 99_990.0, 100_000.0, 1]
+            ]
+            venue.set_top_of_book(101_000.0, 101_000.1, timestamp)
+            await bot.run_cycle(
+                datetime.fromtimestamp(timestamp),
+                index == 0,
+                self.exchange,
+                self.scanner,
+                LoopMonitor(),
+            )
+
+    def get_states(self) -> list:
+        return [
+            liquidation.state
+            for liquidation_set in self.scanner.liquidation_sets.values()
+            for liquidation in liquidation_set.liquidations
+        ]
+
+    async def test_failed_order_is_armed_again(self) -> None:
+        venue = RejectingVenue(1, name=self.exchange.venue.name)
+        await self.run_cycles(venue, 0, 2)
+        self.assertEqual(venue.orders, [])
+        self.assertNotIn(TRIGGERED, self.get_states())
+        self.assertIn(ARMED, self.get_states())
+
+        # the signal trades on the next cycle
+        await self.run_cycles(venue, 2, 3)
+        self.assertEqual(len(venue.orders), 1)
+        self.assertIn(FILLED, self.get_states())
+
+    async def test_rejected_order_is_armed_again(self) -> None:
+        venue = SimulatedVenue(name=self.exchange.venue.name)
+        with mock.patch.multiple(risk, USE_RISK_ENGINE=True, MAX_ORDERS_PER_WINDOW=0):
+            await self.run_cycles(venue, 0, 3)
+        self.assertEqual(venue.orders, [])
+        self.assertNotIn(TRIGGERED, self.get_states())
+        self.assertIn(ARMED, self.get_states())
+
+
+class LatencyTest(IsolatedAsyncioTestCase):
+    """Every order of a signal measures its own time to acknowledgement next to the
+    time since the signal"""
+
+    async def asyncSetUp(self) -> None:
+        ORDER_REGISTRY.path = ""
+        ORDER_REGISTRY.clear()
+        self.scanner = CoinalyzeScanner(
+            datetime.fromtimestamp(START), LiquidationSet(liquidations=[])
+        )
+        self.exchange = bot.create_exchange(self.scanner)
+
+    async def test_order_to_ack(self) -> None:
+        venue = SimulatedVenue(name=self.exchange.venue.name, latency=0.05)
+        venue.set_top_of_book(100_000.0, 100_000.1, START)
+        self.exchange.venues[:] = [venue]
+        self.exchange.cycle_time = START
+        await self.exchange.set_position_sizes()
+        liquidation = Liquidation(
+            amount=200_000,
+            direction="long",
+            time=START - 300,
+            nr_of_liquidations=2,
+            candle=Candle(
+                (START - 300) * 1000, 100_000.0, 100_010.0, 99_990.0, 100_000.0, 1.0
+            ),
+        )
+
+        with mock.patch.object(self.exchange, "do_order_logging") as do_order_logging:
+            self.exchange.signal_time = perf_counter()
+            for strategy_type in ["live", "grey"]:
+                await self.exchange.place_market_order(
+                    0.1, liquidation, 100_000.1, 1.0, 2.0, strategy_type
+                )
+
+        first, second = [call.args for call in do_order_logging.call_args_list]
+        first_signal_to_ack, _, first_order_to_ack = first[6:]
+        second_signal_to_ack, _, second_order_to_ack = second[6:]
+        self.assertGreaterEqual(second_order_to_ack, 50)
+        self.assertAlmostEqual(first_signal_to_ack, first_order_to_ack, delta=10)
+
+        # the second order waited for the first one, its own time does not
+        self.assertGreaterEqual(
+            second_signal_to_ack, first_order_to_ack + second_order_to_ack
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+from exit_manager import ExitManager, ManagedExit
+from unittest import IsolatedAsyncioTestCase, main
+from venues import SimulatedVenue
+
+NOW = 1_800_000_000.0
+
+
+class ExitManagerTest(IsolatedAsyncioTestCase):
+    """The pending stop loss of a due exit is amended unless the price crossed it"""
+
+    async def asyncSetUp(self) -> None:
+        self.venue = SimulatedVenue(bid=100_000.0, ask=100_000.1)
+        self.exit_manager = ExitManager()
+        self.managed_exit = ManagedExit(
+            client_order_id="order",
+            strategy_type="live",
+            direction="long",
+            venue_name=self.venue.name,
+            amount=0.1,
+            entry_price=99_000.0,
+            stoploss_price=98_000.0,
+            takeprofit_price=102_000.0,
+            tpsl_id="tpsl-0",
+            pending_stoploss=99_500.0,
+        )
+        self.exit_manager.track(self.managed_exit)
+
+    async def test_amend_stoploss(self) -> None:
+        await self.exit_manager.flush([self.venue], NOW)
+
+        self.assertEqual(len(self.venue.tpsl_orders), 1)
+        self.assertEqual(self.managed_exit.tpsl_id, "tpsl-1")
+        self.assertEqual(self.managed_exit.stoploss_price, 99_500.0)
+        self.assertIsNone(self.managed_exit.pending_stoploss)
+
+    async def test_crossed_stoploss_is_dropped(self) -> None:
+        self.venue.set_top_of_book(99_400.0, 99_400.1, NOW)
+        await self.exit_manager.flush([self.venue], NOW)
+
+        self.assertEqual(self.venue.tpsl_orders, [])
+        self.assertEqual(self.managed_exit.tpsl_id, "tpsl-0")
+        self.assertEqual(self.managed_exit.stoploss_price, 98_000.0)
+        self.assertIsNone(self.managed_exit.pending_stoploss)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+from fill_resolution import (
+    AMBIGUOUS,
+    OPEN,
+    OPTIMISTIC,
+    PESSIMISTIC,
+    resolve_fills,
+    RESOLUTIONS,
+    STOPLOSS,
+    TAKEPROFIT,
+    Trades,
+)
+import numpy as np
+from unittest import main, TestCase
+
+MINUTE = 60 * 1000
+START = (1_800_000_000 - 1_800_000_000 % 300) * 1000
+
+# the second 5m candle hits both the stop loss and the take profit
+CANDLES = np.array(
+    [
+        [START, 100.0, 101.0, 99.0, 100.0, 1.0],
+        [START + 5 * MINUTE, 100.0, 106.0, 94.0, 100.0, 1.0],
+    ]
+)
+
+
+def get_trades(nr_of_trades: int = 1) -> Trades:
+    """Return long trades entered at the start with the stop loss at 95 and the take
+    profit at 105"""
+
+    return Trades(
+        directions=np.ones(nr_of_trades),
+        entry_times=np.full(nr_of_trades, START, float),
+        stoploss_prices=np.full(nr_of_trades, 95.0),
+        takeprofit_prices=np.full(nr_of_trades, 105.0),
+    )
+
+
+class ResolveFillsTest(TestCase):
+    """A 5m candle that hits both exits is refined with the 1m candles and the ticks
+    and decided by the rule when the data cannot tell"""
+
+    def test_resolved_by_candles(self) -> None:
+        candles = np.array(
+            [
+                [START, 100.0, 101.0, 99.0, 100.0, 1.0],
+                [START + 5 * MINUTE, 100.0, 106.0, 99.0, 100.0, 1.0],
+            ]
+        )
+        fills = resolve_fills(get_trades(), candles, rule=PESSIMISTIC)
+
+        self.assertEqual(fills.outcomes.tolist(), [TAKEPROFIT])
+        self.assertEqual(fills.exit_times.tolist(), [START + 5 * MINUTE])
+        self.assertEqual(fills.exit_prices.tolist(), [105.0])
+        self.assertEqual(fills.resolutions.tolist(), [RESOLUTIONS.index("5m")])
+
+    def test_open(self) -> None:
+        fills = resolve_fills(get_trades(), CANDLES[:1])
+
+        self.assertEqual(fills.outcomes.tolist(), [OPEN])
+        self.assertTrue(np.isnan(fills.exit_times[0]))
+        self.assertTrue(np.isnan(fills.exit_prices[0]))
+
+    def test_rule(self) -> None:
+        fills = resolve_fills(get_trades(), CANDLES, rule=PESSIMISTIC)
+        self.assertEqual(fills.outcomes.tolist(), [STOPLOSS])
+        self.assertEqual(fills.exit_prices.tolist(), [95.0])
+        self.assertEqual(fills.exit_times.tolist(), [START + 5 * MINUTE])
+        self.assertEqual(fills.resolutions.tolist(), [RESOLUTIONS.index("rule")])
+
+        fills = resolve_fills(get_trades(), CANDLES, rule=OPTIMISTIC)
+        self.assertEqual(fills.outcomes.tolist(), [TAKEPROFIT])
+        self.assertEqual(fills.exit_prices.tolist(), [105.0])
+
+        with self.assertRaises(ValueError):
+            resolve_fills(get_trades(), CANDLES, rule="random")
+
+    def test_minute_candles(self) -> None:
+        # the second minute of the candle only reaches the take profit
+        minute_candles = np.array(
+            [
+                [START + 5 * MINUTE, 100.0, 101.0, 99.0, 100.0, 1.0],
+                [START + 6 * MINUTE, 100.0, 106.0, 99.0, 100.0, 1.0],
+                [START + 7 * MINUTE, 100.0, 101.0, 94.0, 100.0, 1.0],
+            ]
+        )
+        fills = resolve_fills(get_trades(), CANDLES, minute_candles, rule=PESSIMISTIC)
+
+        self.assertEqual(fills.outcomes.tolist(), [TAKEPROFIT])
+        self.assertEqual(fills.exit_times.tolist(), [START + 6 * MINUTE])
+        self.assertEqual(fills.exit_prices.tolist(), [105.0])
+        self.assertEqual(fills.resolutions.tolist(), [RESOLUTIONS.index("1m")])
+
+    def test_ticks(self) -> None:
+        # the second minute hits both, its ticks reach the stop loss first
+        minute_candles = np.array(
+            [[START + 6 * MINUTE, 100.0, 106.0, 94.0, 100.0, 1.0]]
+        )
+        ticks = np.array(
+            [
+                [START + 6 * MINUTE + 1_000, 100.0],
+                [START + 6 * MINUTE + 2_000, 94.5],
+                [START + 6 * MINUTE + 3_000, 105.5],
+            ]
+        )
+        fills = resolve_fills(
+            get_trades(), CANDLES, minute_candles, ticks, rule=OPTIMISTIC
+        )
+
+        self.assertEqual(fills.outcomes.tolist(), [STOPLOSS])
+        self.assertEqual(fills.exit_times.tolist(), [START + 6 * MINUTE + 2_000])
+        self.assertEqual(fills.resolutions.tolist(), [RESOLUTIONS.index("tick")])
+
+        # without ticks in the minute the rule decides
+        fills = resolve_fills(
+            get_trades(), CANDLES, minute_candles, ticks[:1], rule=OPTIMISTIC
+        )
+        self.assertEqual(fills.outcomes.tolist(), [TAKEPROFIT])
+        self.assertEqual(fills.exit_times.tolist(), [START + 6 * MINUTE])
+        self.assertEqual(fills.resolutions.tolist(), [RESOLUTIONS.index("rule")])
+
+    def test_short(self) -> None:
+        trades = Trades(
+            directions=np.array([-1]),
+            entry_times=np.array([START], float),
+            stoploss_prices=np.array([105.0]),
+            takeprofit_prices=np.array([95.0]),
+        )
+        minute_candles = np.array(
+            [[START + 5 * MINUTE, 100.0, 101.0, 94.0, 100.0, 1.0]]
+        )
+        fills = resolve_fills(trades, CANDLES, minute_candles, rule=PESSIMISTIC)
+
+        self.assertEqual(fills.outcomes.tolist(), [TAKEPROFIT])
+        self.assertEqual(fills.exit_prices.tolist(), [95.0])
+
+    def test_get_counts(self) -> None:
+        trades = get_trades(2)
+        trades.entry_times[1] = START + 10 * MINUTE
+        fills = resolve_fills(trades, CANDLES, rule=PESSIMISTIC)
+
+        self.assertNotIn(AMBIGUOUS, fills.outcomes)
+        self.assertEqual(
+            fills.get_counts(),
+            dict(
+                trades=2,
+                takeprofit=0,
+                stoploss=1,
+                open=1,
+                by_5m=0,
+                by_1m=0,
+                by_tick=0,
+                by_rule=1,
+            ),
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+from liquidation_aggregator import LiquidationAggregator, PrefixSeries
+from math import sqrt
+from random import Random
+from statistics import mean, pvariance
+from unittest import main, TestCase
+
+START = 1_800_000_000 - 1_800_000_000 % 300
+SYMBOLS = ["BTCUSDT_PERP.A", "BTCUSD_PERP.0"]
+
+
+class PrefixSeriesTest(TestCase):
+    """The prefix sums answer the range queries of the buckets added so far"""
+
+    def setUp(self) -> None:
+        self.series = PrefixSeries(interval_seconds=60, retention=3)
+
+    def assert_buckets(self, end: int, buckets: list) -> None:
+        """Check the range queries over the buckets up to end against the buckets"""
+
+        nr_of_buckets = len(buckets)
+        self.assertAlmostEqual(self.series.total(end, nr_of_buckets), sum(buckets))
+        self.assertEqual(
+            self.series.count(end, nr_of_buckets), sum(bucket > 0 for bucket in buckets)
+        )
+        series_mean, series_variance = self.series.mean_and_variance(end, nr_of_buckets)
+        self.assertAlmostEqual(series_mean, mean(buckets))
+        self.assertAlmostEqual(series_variance, pvariance(buckets))
+
+    def test_gaps(self) -> None:
+        self.series.add(START + 10, 10.0, 1)
+        self.series.add(START + 180, 5.0, 1)
+
+        # the buckets in between are empty
+        self.assertEqual(len(self.series), 4)
+        self.assert_buckets(START + 180, [10.0, 0.0, 0.0, 5.0])
+        self.assertEqual(self.series.total(START + 120, 2), 0.0)
+
+        # a window longer than the series stops at its start, after it at its end
+        self.assertEqual(self.series.total(START + 180, 10), 15.0)
+        self.assertEqual(self.series.total(START + 600, 1), 5.0)
+
+    def test_late_insert(self) -> None:
+        self.series.add(START, 10.0, 1)
+        self.series.add(START + 180, 5.0, 1)
+        self.series.add(START + 60, 7.0, 1)
+
+        self.assert_buckets(START + 180, [10.0, 7.0, 0.0, 5.0])
+        self.assert_buckets(START + 120, [7.0, 0.0])
+
+        # a bucket before the start of the series is dropped
+        self.series.add(START - 60, 3.0, 1)
+        self.assert_buckets(START + 180, [10.0, 7.0, 0.0, 5.0])
+
+    def test_trim(self) -> None:
+        for index in range(7):
+            self.series.add(START + index * 60, index + 1.0, 1)
+
+        # the series keeps the retention once it holds twice as many buckets
+        self.assertEqual(len(self.series), 3)
+        self.assertEqual(self.series.start, START + 4 * 60)
+        self.assert_buckets(START + 6 * 60, [5.0, 6.0, 7.0])
+        self.assertEqual(self.series.total(START + 6 * 60, 10), 18.0)
+
+        # the trimmed buckets are gone
+        self.series.add(START, 100.0, 1)
+        self.assertEqual(self.series.total(START + 6 * 60, 10), 18.0)
+
+    def test_empty(self) -> None:
+        self.assertEqual(self.series.total(START, 5), 0.0)
+        self.assertEqual(self.series.mean_and_variance(START, 5), (0.0, 0.0))
+
+
+class LiquidationAggregatorTest(TestCase):
+    """The window totals and z-scores match a direct computation over the buckets"""
+
+    def setUp(self) -> None:
+        # a window of 3 and a baseline of 12 buckets of 5 minutes
+        self.aggregator = LiquidationAggregator(300, windows=[15], baseline=60)
+        random = Random(0)
+        self.amounts = {
+            symbol: [random.uniform(0, 10_000) for _ in range(20)] for symbol in SYMBOLS
+        }
+        for symbol, amounts in self.amounts.items():
+            for index, amount in enumerate(amounts):
+                self.aggregator.add_bucket(
+                    symbol, dict(t=START + index * 300, l=amount, s=50.0)
+                )
+        self.end = START + 19 * 300
+        self.totals = [
+            sum(amounts[index] for amounts in self.amounts.values())
+            for index in range(20)
+        ]
+
+    def test_totals(self) -> None:
+        self.assertAlmostEqual(
+            self.aggregator.total("long", self.end, 15), sum(self.totals[-3:])
+        )
+        self.assertAlmostEqual(
+            self.aggregator.total("long", self.end, 15, name=SYMBOLS[0]),
+            sum(self.amounts[SYMBOLS[0]][-3:]),
+        )
+        exchanges = self.aggregator.exchanges("long", self.end, 15)
+        self.assertEqual(set(exchanges), {"A", "0"})
+        self.assertAlmostEqual(exchanges["0"], sum(self.amounts[SYMBOLS[1]][-3:]))
+        self.assertEqual(
+            self.aggregator.summary("long", self.end),
+            {"15m": round(sum(self.totals[-3:]), 2)},
+        )
+
+        # the short buckets are too small to count as a liquidation
+        self.assertEqual(self.aggregator.total("short", self.end, 15), 300.0)
+        self.assertEqual(self.aggregator.count("short", self.end, 15), 0)
+
+    def test_z_score(self) -> None:
+        baseline = self.totals[-15:-3]
+        expected = (sum(self.totals[-3:]) - 3 * mean(baseline)) / sqrt(
+            3 * pvariance(baseline)
+        )
+        self.assertAlmostEqual(self.aggregator.z_score("long", self.end, 15), expected)
+
+        # a baseline without variance has no z-score
+        self.assertIsNone(self.aggregator.z_score("short", self.end, 15))
+
+    def test_late_bucket(self) -> None:
+        self.aggregator.add_bucket(SYMBOLS[0], dict(t=START + 17 * 300, l=1_000.0))
+        self.totals[17] += 1_000.0
+
+        self.assertAlmostEqual(
+            self.aggregator.total("long", self.end, 15), sum(self.totals[-3:])
+        )
+        self.assertEqual(self.aggregator.count("long", self.end, 15), 7)
+
+        # the late bucket moves into the baseline of the next window
+        self.aggregator.add_bucket(SYMBOLS[0], dict(t=self.end + 300, l=0.0))
+        self.totals.append(0.0)
+        expected = (sum(self.totals[-3:]) - 3 * mean(self.totals[-15:-3])) / sqrt(
+            3 * pvariance(self.totals[-15:-3])
+        )
+        self.assertAlmostEqual(
+            self.aggregator.z_score("long", self.end + 300, 15), expected
+        )
+
+
+if __name__ == "__main__":
+    main()
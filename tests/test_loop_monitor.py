@@ -0,0 +1,21 @@
+from loop_monitor import get_percentiles
+from unittest import main, TestCase
+
+
+class PercentilesTest(TestCase):
+    """The percentiles stay within the measured values"""
+
+    def test_percentiles(self) -> None:
+        self.assertEqual(
+            get_percentiles([1.0, 2.0, 3.0, 4.0, 100.0]),
+            dict(p50=3.0, p99=96.16, max=100.0),
+        )
+
+    def test_p99_within_max(self) -> None:
+        values = [3.0 + index / 1000 for index in range(20)]
+        percentiles = get_percentiles(values)
+        self.assertLessEqual(percentiles["p99"], percentiles["max"])
+
+
+if __name__ == "__main__":
+    main()
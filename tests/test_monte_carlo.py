@@ -0,0 +1,132 @@
+from analytics import SCHEMA
+import monte_carlo
+from monte_carlo import (
+    get_margin_percentage,
+    get_returns,
+    load_trading_days,
+    run_simulation,
+    simulate,
+    SL_PERCENTAGES,
+)
+import numpy as np
+import os
+import sqlite3
+import tempfile
+from unittest import main, mock, TestCase
+
+NOW = 1_800_000_000.0
+
+
+class LoadTradingDaysTest(TestCase):
+    """The exits are grouped per day and padded with trades without risk"""
+
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "analytics.db")
+        connection = sqlite3.connect(self.path)
+        connection.executescript(SCHEMA)
+        connection.execute(
+            "INSERT INTO orders (client_order_id, stoploss) VALUES ('a', 98.0)"
+        )
+        connection.executemany(
+            "INSERT INTO exits (client_order_id, strategy_type, direction, "
+            "entry_price, exit_price, time) VALUES (?, ?, ?, ?, ?, ?)",
+            [
+                ("a", "live", "long", 100.0, 99.0, NOW),
+                ("b", "grey", "short", 100.0, 99.0, NOW + 60),
+                ("c", "live", "long", 100.0, 103.0, NOW + 2 * 86400),
+                ("d", "journaling", "long", 100.0, 90.0, NOW + 2 * 86400),
+            ],
+        )
+        connection.commit()
+        connection.close()
+
+    def tearDown(self) -> None:
+        self.directory.cleanup()
+
+    def test_load_trading_days(self) -> None:
+        moves, sl_percentages = load_trading_days(self.path, ["live", "grey"])
+
+        np.testing.assert_allclose(moves, [[-1.0, 1.0], [3.0, 0.0]])
+        np.testing.assert_allclose(
+            sl_percentages,
+            [[2.0, SL_PERCENTAGES["grey"]], [SL_PERCENTAGES["live"], np.inf]],
+        )
+
+
+class SimulationTest(TestCase):
+    """The returns, drawdowns and risk of ruin of the bootstrapped paths"""
+
+    def test_get_returns(self) -> None:
+        # a stop loss costs the position percentage, a move past the liquidation
+        # price of 10% at 10x leverage costs the margin only
+        returns = get_returns(
+            np.array([[-2.0, 1.0, -20.0, 0.0]]),
+            np.array([[2.0, 2.0, 2.0, np.inf]]),
+            position_percentage=1.0,
+            leverage=10,
+        )
+        np.testing.assert_allclose(returns, [[-0.01, 0.005, -0.05, 0.0]])
+
+    def test_simulate(self) -> None:
+        # a day that wins 10% and then loses 10% draws down from the peak of 1.1
+        max_drawdowns, lowest_equity = simulate(
+            np.array([[0.1, -0.1]]), nr_of_paths=3, nr_of_days=2, seed=0
+        )
+        np.testing.assert_allclose(max_drawdowns, [1 - 0.9801 / 1.1] * 3)
+        np.testing.assert_allclose(lowest_equity, [0.9801] * 3)
+
+    def test_simulate_losses(self) -> None:
+        max_drawdowns, lowest_equity = simulate(
+            np.array([[-0.1]]), nr_of_paths=2, nr_of_days=2, seed=0
+        )
+        np.testing.assert_allclose(max_drawdowns, [0.19, 0.19])
+        np.testing.assert_allclose(lowest_equity, [0.81, 0.81])
+
+        # a balance below zero stops at zero
+        max_drawdowns, lowest_equity = simulate(
+            np.array([[-1.5]]), nr_of_paths=2, nr_of_days=2, seed=0
+        )
+        np.testing.assert_allclose(max_drawdowns, [1.0, 1.0])
+        np.testing.assert_allclose(lowest_equity, [0.0, 0.0])
+
+    def test_bootstrap(self) -> None:
+        # the days are drawn with replacement, a fixed seed draws the same paths
+        returns = np.array([[0.01], [-0.02], [0.03]])
+        first = simulate(returns, nr_of_paths=50, nr_of_days=20, seed=1)
+        second = simulate(returns, nr_of_paths=50, nr_of_days=20, seed=1)
+        np.testing.assert_array_equal(first[0], second[0])
+        self.assertLess(first[0].min(), first[0].max())
+
+        # no path draws down more than twenty losing days in a row
+        self.assertLessEqual(first[0].max(), 1 - 0.98**20 + 1e-12)
+        self.assertGreaterEqual(first[1].min(), 0.98**20 - 1e-12)
+
+    @mock.patch.object(monte_carlo, "CHUNK_SIZE", 2)
+    def test_run_simulation(self) -> None:
+        returns = np.array([[-0.1]])
+
+        summary = run_simulation(returns, nr_of_paths=5, nr_of_days=2, ruin=20.0)
+        self.assertEqual(
+            summary,
+            dict(
+                p50_drawdown=19.0,
+                p90_drawdown=19.0,
+                p95_drawdown=19.0,
+                p99_drawdown=19.0,
+                risk_of_ruin=0.0,
+            ),
+        )
+
+        # every path drops below 90% of the starting balance
+        summary = run_simulation(returns, nr_of_paths=5, nr_of_days=2, ruin=10.0)
+        self.assertEqual(summary["risk_of_ruin"], 100.0)
+
+    def test_get_margin_percentage(self) -> None:
+        # a position of 1% with a stop loss at 0.5% and 10x leverage takes 20% margin
+        sl_percentages = np.array([[2.0, 2.0], [0.5, np.inf]])
+        self.assertEqual(get_margin_percentage(sl_percentages, 1.0, 10), 20.0)
+
+
+if __name__ == "__main__":
+    main()
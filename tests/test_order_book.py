@@ -0,0 +1,117 @@
+from order_book import BookSide, OrderBook
+from unittest import main, TestCase
+
+NOW = 1_800_000_000.0
+
+
+class BookSideTest(TestCase):
+    """The levels stay sorted best price first and the expected fill walks them"""
+
+    def setUp(self) -> None:
+        self.asks = BookSide(descending=False)
+        for price, size in [(101.0, 2.0), (100.0, 1.0), (102.0, 3.0)]:
+            self.asks.apply(price, size)
+
+    def test_apply(self) -> None:
+        self.assertEqual(self.asks.best, 100.0)
+
+        # a size of zero removes the level, removing an unknown level is ignored
+        self.asks.apply(100.0, 0)
+        self.asks.apply(99.0, 0)
+        self.assertEqual(self.asks.best, 101.0)
+        self.assertEqual(self.asks.keys, [101.0, 102.0])
+
+        # a known level only changes its size
+        self.asks.apply(101.0, 5.0)
+        self.assertEqual(self.asks.keys, [101.0, 102.0])
+        self.assertEqual(self.asks.sizes[101.0], 5.0)
+
+        self.asks.clear()
+        self.assertIsNone(self.asks.best)
+        self.assertIsNone(self.asks.expected_fill(1.0))
+
+    def test_descending(self) -> None:
+        bids = BookSide(descending=True)
+        bids.apply(98.0, 1.0)
+        bids.apply(99.0, 1.0)
+        self.assertEqual(bids.best, 99.0)
+
+        expected_fill = bids.expected_fill(1.5)
+        self.assertAlmostEqual(expected_fill.average_price, (99.0 + 0.5 * 98.0) / 1.5)
+        self.assertEqual(expected_fill.worst_price, 98.0)
+        self.assertEqual(expected_fill.top_price, 99.0)
+
+    def test_expected_fill(self) -> None:
+        expected_fill = self.asks.expected_fill(2.0)
+
+        self.assertAlmostEqual(expected_fill.average_price, 100.5)
+        self.assertEqual(expected_fill.worst_price, 101.0)
+        self.assertEqual(expected_fill.top_price, 100.0)
+        self.assertAlmostEqual(expected_fill.slippage_percentage, 0.5)
+        self.assertTrue(expected_fill.is_complete)
+
+        # an amount that completes a level does not reach the next one
+        expected_fill = self.asks.expected_fill(3.0)
+        self.assertAlmostEqual(expected_fill.average_price, (100.0 + 2 * 101.0) / 3)
+        self.assertEqual(expected_fill.worst_price, 101.0)
+
+        self.assertIsNone(self.asks.expected_fill(0))
+
+    def test_expected_fill_after_apply(self) -> None:
+        self.asks.expected_fill(1.0)
+        self.asks.apply(100.0, 2.0)
+
+        # the cumulative sizes are rebuilt after a change
+        expected_fill = self.asks.expected_fill(2.0)
+        self.assertAlmostEqual(expected_fill.average_price, 100.0)
+        self.assertEqual(expected_fill.worst_price, 100.0)
+
+    def test_thin_book(self) -> None:
+        expected_fill = self.asks.expected_fill(10.0)
+
+        self.assertFalse(expected_fill.is_complete)
+        self.assertEqual(expected_fill.filled, 6.0)
+        self.assertAlmostEqual(
+            expected_fill.average_price, (100.0 + 2 * 101.0 + 3 * 102.0) / 6
+        )
+        self.assertEqual(expected_fill.worst_price, 102.0)
+
+
+class OrderBookTest(TestCase):
+    """The top levels of the websocket book are diffed into the local book"""
+
+    def setUp(self) -> None:
+        self.order_book = OrderBook(depth=2)
+
+    def test_apply_levels(self) -> None:
+        self.order_book.apply_levels(
+            [[99.0, 1.0], [98.0, 2.0], [97.0, 3.0]],
+            [[100.0, 1.0], [101.0, 2.0]],
+            NOW,
+        )
+
+        # only the top levels of the depth are kept
+        self.assertEqual(self.order_book.bids.sizes, {99.0: 1.0, 98.0: 2.0})
+        self.assertEqual(self.order_book.updated_at, NOW)
+
+        # levels that left the top are removed, the others are updated
+        self.order_book.apply_levels(
+            [[99.5, 1.0], [99.0, 4.0]], [[100.0, 1.0], [101.0, 2.0]], NOW + 1
+        )
+        self.assertEqual(self.order_book.bids.sizes, {99.5: 1.0, 99.0: 4.0})
+        self.assertEqual(self.order_book.bids.keys, [-99.5, -99.0])
+        self.assertEqual(self.order_book.asks.keys, [100.0, 101.0])
+        self.assertEqual(self.order_book.updated_at, NOW + 1)
+
+    def test_expected_fill(self) -> None:
+        self.order_book.apply_levels(
+            [[99.0, 1.0], [98.0, 2.0]], [[100.0, 1.0], [101.0, 2.0]], NOW
+        )
+
+        # a buy fills against the asks and a sell against the bids
+        self.assertEqual(self.order_book.expected_fill("buy", 1.0).top_price, 100.0)
+        self.assertEqual(self.order_book.expected_fill("sell", 1.0).top_price, 99.0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+import json
+from order_registry import OrderRegistry
+import os
+import tempfile
+from time import time
+from unittest import IsolatedAsyncioTestCase, main
+
+
+class OrderRegistryTest(IsolatedAsyncioTestCase):
+    """The registry keeps an index of the acknowledged signals and writes the pruned
+    entries in the thread pool"""
+
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "signal_state.json")
+        self.registry = OrderRegistry(self.path)
+
+    def tearDown(self) -> None:
+        self.directory.cleanup()
+
+    def read(self) -> dict:
+        with open(self.path) as state_file:
+            return json.load(state_file)
+
+    async def test_acknowledged_signals(self) -> None:
+        self.registry.register("a", "signal", "live", "main")
+        self.registry.register("b", "signal", "grey", "main")
+        self.assertFalse(self.registry.is_acknowledged("signal"))
+
+        self.registry.acknowledge("a")
+        self.assertTrue(self.registry.is_acknowledged("signal"))
+        self.assertFalse(self.registry.is_acknowledged("other"))
+
+        # a rejected order of the same signal keeps the acknowledged one
+        self.registry.remove("b")
+        self.assertTrue(self.registry.is_acknowledged("signal"))
+        self.registry.remove("a")
+        self.assertFalse(self.registry.is_acknowledged("signal"))
+
+    async def test_save_in_background(self) -> None:
+        self.registry.register("a", "signal", "live", "main")
+        self.registry.acknowledge("a")
+
+        # the writes of both changes are merged
+        self.assertFalse(os.path.exists(self.path))
+        await self.registry.save_task
+        self.assertEqual(self.read()["a"]["status"], "acknowledged")
+
+        # a restart loads the registry with its index
+        registry = OrderRegistry(self.path)
+        self.assertIn("a", registry)
+        self.assertTrue(registry.is_acknowledged("signal"))
+
+    async def test_prune_on_save(self) -> None:
+        self.registry.register("old", "old signal", "live", "main")
+        self.registry.acknowledge("old")
+        self.registry.entries["old"]["time"] = time() - 25 * 3600
+        self.registry.register("new", "new signal", "live", "main")
+        await self.registry.save_task
+
+        self.assertEqual(list(self.read()), ["new"])
+        self.assertNotIn("old", self.registry)
+        self.assertFalse(self.registry.is_acknowledged("old signal"))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+from coinalyze_scanner import CoinalyzeScanner, FUTURE_MARKETS_URL, INTERVAL_SECONDS
+from datetime import datetime
+import importlib.util
+import itertools
+from loop_monitor import LoopMonitor
+from misc import LiquidationSet
+from order_registry import ORDER_REGISTRY
+import os
+from recorder import CLOCK, COINALYZE, get_coinalyze_key, Recorder
+import risk
+import tempfile
+from unittest import IsolatedAsyncioTestCase, main, mock
+import venues
+from venues import SimulatedVenue
+
+# the bot module is __main__.py, loaded under another name
+spec = importlib.util.spec_from_file_location(
+    "bot", os.path.join(os.path.dirname(os.path.dirname(__file__)), "__main__.py")
+)
+bot = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(bot)
+
+SYMBOLS = [f"BTCUSD{index}_PERP.A" for index in range(5)]
+START = 1_800_000_000 - 1_800_000_000 % 300
+NR_OF_CYCLES = 12
+
+
+async def fetch_coinalyze(url: str, params: dict) -> list:
+    """Answer every liquidation history request with long liquidations in every
+    symbol in the last closed bucket"""
+
+    interval_seconds = INTERVAL_SECONDS[params["interval"]]
+    bucket_time = params["to"] - params["to"] % interval_seconds - interval_seconds
+    return [
+        dict(symbol=symbol, history=[dict(t=bucket_time, l=50_000.0, s=0.0)])
+        for symbol in params["symbols"].split(",")
+    ]
+
+
+async def record_session(path: str) -> list:
+    """Record cycles of 5 minutes in which every bucket has long liquidations and
+    the price trades above every candle, returns the orders"""
+
+    ORDER_REGISTRY.path = ""
+    ORDER_REGISTRY.clear()
+    recorder = Recorder(path)
+    recorder.write(
+        COINALYZE,
+        get_coinalyze_key(FUTURE_MARKETS_URL, {}),
+        [dict(symbol=symbol) for symbol in SYMBOLS],
+    )
+    scanner = CoinalyzeScanner(
+        datetime.fromtimestamp(START), LiquidationSet(liquidations=[])
+    )
+    scanner.fetch_coinalyze = fetch_coinalyze
+    scanner._symbols = ",".join(SYMBOLS)
+    recorder.record_scanner(scanner)
+
+    exchange = bot.create_exchange(scanner)
+    venue = SimulatedVenue(name=exchange.venue.name, bid=101_000.0, ask=101_000.1)
+    exchange.venues[:] = [venue]
+    recorder.record_venue(venue, exchange.account)
+
+    # the calls replay makes before the first cycle
+    for direction in ["long", "short"]:
+        await exchange.set_leverage(leverage=bot.LEVERAGE, direction=direction)
+    await exchange.set_position_sizes()
+
+    for index in range(NR_OF_CYCLES):
+        timestamp = START + index * 300
+        venue.candles = [
+            [(timestamp - 300) * 1000, 100_000.0, 100_010.0, 99_990.0, 100_000.0, 1.0]
+        ]
+        recorder.write(CLOCK, "now", timestamp)
+        await bot.run_cycle(
+            datetime.fromtimestamp(timestamp),
+            index == 0,
+            exchange,
+            scanner,
+            LoopMonitor(),
+        )
+    recorder.flush()
+    return sorted(ORDER_REGISTRY.entries)
+
+
+class ReplayTest(IsolatedAsyncioTestCase):
+    """A replayed session places the same orders as the recording, whatever the
+    wall clock does during the replay"""
+
+    async def test_replay_is_deterministic(self) -> None:
+        with tempfile.TemporaryDirectory() as directory, mock.patch.multiple(
+            risk,
+            USE_RISK_ENGINE=True,
+            MAX_POSITIONS_PER_STRATEGY=NR_OF_CYCLES,
+            MAX_ORDERS_PER_WINDOW=1,
+        ):
+            path = os.path.join(directory, "session.jsonl.gz")
+            recorded_orders = await record_session(path)
+
+            replayed_orders = []
+            for wall_clock in [
+                itertools.count(START, 0.001),
+                itertools.count(START, 3600),
+            ]:
+                with mock.patch.object(
+                    risk, "time", wall_clock.__next__
+                ), mock.patch.object(venues, "time", wall_clock.__next__):
+                    await bot.replay(path)
+                replayed_orders.append(sorted(ORDER_REGISTRY.entries))
+
+        # an order every third cycle, the order window of the risk engine is the 10
+        # minutes up to and including the order
+        self.assertEqual(len(recorded_orders), NR_OF_CYCLES // 3)
+        self.assertEqual(replayed_orders, [recorded_orders, recorded_orders])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+import risk
+from risk import RiskEngine
+from unittest import main, mock, TestCase
+
+NOW = 1_800_000_000.0
+PRICE = 100_000.0
+
+
+@mock.patch.multiple(
+    risk,
+    USE_RISK_ENGINE=True,
+    MAX_POSITIONS_PER_STRATEGY=2,
+    MAX_ORDERS_PER_SIGNAL=1,
+    MAX_ORDERS_PER_WINDOW=3,
+    RISK_WINDOW_MINUTES=10,
+    MAX_MARGIN_PERCENTAGE=50.0,
+    MAX_EXPOSURE_CONTRACTS=0.0,
+)
+class RiskEngineTest(TestCase):
+    """The pre-trade checks over the locally cached exposure"""
+
+    def setUp(self) -> None:
+        # a contract of 0.001 BTC at 10x leverage takes 10 USDT of margin
+        self.risk = RiskEngine(leverage=10)
+        self.risk.balance = 1_000.0
+
+    def test_disabled(self) -> None:
+        self.risk.record_order("live", "long", 1, PRICE, NOW, signal_id="signal")
+        with mock.patch.object(risk, "USE_RISK_ENGINE", False):
+            self.assertEqual(
+                self.risk.check("live", 1_000, PRICE, NOW, signal_id="signal"),
+                (True, ""),
+            )
+
+    def test_record_order(self) -> None:
+        self.risk.record_order(
+            "live", "long", 2, PRICE, NOW, client_order_id="a", signal_id="signal"
+        )
+
+        self.assertEqual(self.risk.positions_per_strategy, {"live": 1})
+        self.assertEqual(self.risk.exposure, 2)
+        self.assertAlmostEqual(self.risk.margin_used, 20.0)
+        self.assertEqual(self.risk.entries[0].client_order_id, "a")
+        self.assertEqual(list(self.risk.order_times), [NOW])
+
+    def test_max_positions_per_strategy(self) -> None:
+        self.risk.record_order("live", "long", 1, PRICE, NOW, signal_id="first")
+        self.risk.record_order("live", "long", 1, PRICE, NOW, signal_id="second")
+
+        allowed, reason = self.risk.check("live", 1, PRICE, NOW, signal_id="third")
+        self.assertFalse(allowed)
+        self.assertIn("live has 2 open position(s)", reason)
+        self.assertTrue(self.risk.check("grey", 1, PRICE, NOW, signal_id="third")[0])
+
+    def test_max_orders_per_signal(self) -> None:
+        self.risk.record_order("live", "long", 1, PRICE, NOW, signal_id="signal")
+
+        # the grey and reversed strategies do not stack on the same signal
+        for strategy_type in ["grey", "reversed"]:
+            allowed, reason = self.risk.check(
+                strategy_type, 1, PRICE, NOW, signal_id="signal"
+            )
+            self.assertFalse(allowed)
+            self.assertIn("signal signal has 1 open position(s)", reason)
+        self.assertTrue(self.risk.check("grey", 1, PRICE, NOW, signal_id="other")[0])
+
+    def test_max_orders_per_window(self) -> None:
+        for index in range(3):
+            self.risk.record_order(
+                f"strategy{index}", "long", 1, PRICE, NOW + index, signal_id=str(index)
+            )
+
+        self.assertFalse(self.risk.check("live", 1, PRICE, NOW + 599)[0])
+
+        # the first order left the window of 10 minutes
+        self.assertTrue(self.risk.check("live", 1, PRICE, NOW + 601)[0])
+        self.assertEqual(len(self.risk.order_times), 2)
+
+    def test_max_margin_percentage(self) -> None:
+        self.assertTrue(self.risk.check("live", 50, PRICE, NOW)[0])
+
+        allowed, reason = self.risk.check("live", 51, PRICE, NOW)
+        self.assertFalse(allowed)
+        self.assertIn("margin usage would be 51.0%", reason)
+
+    def test_max_exposure_contracts(self) -> None:
+        self.risk.record_order("live", "long", 3, PRICE, NOW)
+        with mock.patch.object(risk, "MAX_EXPOSURE_CONTRACTS", 4.0):
+            self.assertTrue(self.risk.check("grey", 1, PRICE, NOW)[0])
+            allowed, reason = self.risk.check("grey", 2, PRICE, NOW)
+        self.assertFalse(allowed)
+        self.assertIn("exposure would be 5.0 contract(s)", reason)
+
+    def test_sync_positions(self) -> None:
+        self.risk.record_order("live", "long", 1, PRICE, NOW, signal_id="first")
+        self.risk.record_order("grey", "long", 2, PRICE, NOW, signal_id="second")
+        self.risk.record_order("reversed", "short", 4, PRICE, NOW, signal_id="second")
+
+        # nothing closes while both sides are open
+        self.assertEqual(self.risk.sync_positions({"long", "short"}), [])
+
+        # the long entries only close once the long side is flat
+        closed = self.risk.sync_positions({"short"})
+        self.assertEqual([entry.strategy_type for entry in closed], ["live", "grey"])
+        self.assertEqual(
+            self.risk.positions_per_strategy, {"live": 0, "grey": 0, "reversed": 1}
+        )
+        self.assertEqual(self.risk.exposure, 4)
+        self.assertAlmostEqual(self.risk.margin_used, 40.0)
+
+        # the closed positions no longer count for their strategy and signal
+        self.assertTrue(
+            self.risk.check("live", 1, PRICE, NOW + 601, signal_id="first")[0]
+        )
+
+
+if __name__ == "__main__":
+    main()
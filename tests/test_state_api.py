@@ -0,0 +1,87 @@
+from coinalyze_scanner import CoinalyzeScanner
+from datetime import datetime
+import json
+from loop_monitor import LoopMonitor
+from misc import Candle, Liquidation, LiquidationSet
+from state_api import StateServer
+from tests.test_replay import bot, START
+from typing import Dict, Tuple
+from unittest import IsolatedAsyncioTestCase, main
+
+
+def parse_response(response: bytes) -> Tuple[int, Dict[str, str], bytes]:
+    """Return the status, headers and body of an http response"""
+
+    head, _, body = response.partition(b"\r\n\r\n")
+    status_line, *header_lines = head.decode().split("\r\n")
+    headers = dict(line.split(": ", 1) for line in header_lines)
+    return int(status_line.split()[1]), headers, body
+
+
+class StateServerTest(IsolatedAsyncioTestCase):
+    """The responses are cached per endpoint and a matching ETag gets a 304"""
+
+    async def asyncSetUp(self) -> None:
+        self.scanner = CoinalyzeScanner(
+            datetime.fromtimestamp(START), LiquidationSet(liquidations=[])
+        )
+        self.exchange = bot.create_exchange(self.scanner)
+        self.state_server = StateServer(self.exchange, LoopMonitor())
+
+    def get(self, path: str, etag: str | None = None) -> Tuple[int, dict, bytes]:
+        headers = {"if-none-match": etag} if etag is not None else {}
+        return parse_response(self.state_server.get_response("GET", path, headers))
+
+    def test_get(self) -> None:
+        status, headers, body = self.get("/timings")
+
+        self.assertEqual(status, 200)
+        self.assertEqual(headers["Content-Type"], "application/json")
+        self.assertEqual(int(headers["Content-Length"]), len(body))
+        self.assertIsNone(json.loads(body)["last_cycle_at"])
+
+        # an unchanged state sends the cached body with the same etag
+        self.assertEqual(self.get("/timings/?pretty"), (status, headers, body))
+
+    def test_not_modified(self) -> None:
+        _, headers, _ = self.get("/timings")
+
+        status, not_modified_headers, body = self.get("/timings", headers["ETag"])
+        self.assertEqual(status, 304)
+        self.assertEqual(not_modified_headers["ETag"], headers["ETag"])
+        self.assertEqual(body, b"")
+
+        # an outdated etag gets the new state
+        self.state_server.record_cycle(START, 0.002)
+        status, new_headers, body = self.get("/timings", headers["ETag"])
+        self.assertEqual(status, 200)
+        self.assertNotEqual(new_headers["ETag"], headers["ETag"])
+        self.assertEqual(json.loads(body)["last_cycle_ms"], 2.0)
+
+    def test_liquidations(self) -> None:
+        _, headers, _ = self.get("/liquidations")
+
+        candle = Candle((START - 300) * 1000, 100.0, 110.0, 90.0, 105.0, 1.0)
+        liquidation = Liquidation(200_000, "long", START - 300, 2, candle)
+        self.scanner.liquidation_set.liquidations.append(liquidation)
+        status, _, body = self.get("/liquidations", headers["ETag"])
+
+        self.assertEqual(status, 200)
+        (state,) = json.loads(body)["liquidations"]
+        self.assertEqual(state["signal_id"], liquidation.signal_id)
+        self.assertEqual(state["state"], liquidation.state)
+
+    def test_errors(self) -> None:
+        self.assertEqual(self.get("/unknown")[0], 404)
+        status, _, _ = parse_response(
+            self.state_server.get_response("POST", "/timings", {})
+        )
+        self.assertEqual(status, 405)
+
+        status, _, body = self.get("/")
+        self.assertEqual(status, 200)
+        self.assertIn("/timings", json.loads(body)["endpoints"])
+
+
+if __name__ == "__main__":
+    main()
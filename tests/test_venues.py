@@ -0,0 +1,73 @@
+from asyncio import create_task, sleep
+from ccxt import NetworkError
+from unittest import IsolatedAsyncioTestCase, main, TestCase
+from venues import SimulatedVenue, Venue, VENUE_STALE_SECONDS, VenueRouter
+
+NOW = 1_800_000_000.0
+
+
+class FailingClient:
+    """ccxt client of which every websocket ticker request fails"""
+
+    def __init__(self) -> None:
+        self.nr_of_requests = 0
+
+    async def watch_ticker(self, symbol: str) -> dict:
+        self.nr_of_requests += 1
+        raise NetworkError("connection reset")
+
+
+class VenueRouterTest(TestCase):
+    """The router picks the venue with the best fresh quote"""
+
+    def setUp(self) -> None:
+        self.primary = SimulatedVenue(name="primary", bid=100.0, ask=100.2)
+        self.cheap = SimulatedVenue(name="cheap", bid=99.8, ask=100.1)
+        self.rich = SimulatedVenue(name="rich", bid=100.1, ask=100.3)
+        for venue in [self.primary, self.cheap, self.rich]:
+            venue.set_top_of_book(venue.bid, venue.ask, NOW)
+        self.router = VenueRouter([self.primary, self.cheap, self.rich])
+
+    def test_best_price(self) -> None:
+        self.assertIs(self.router.best_venue("buy", NOW), self.cheap)
+        self.assertIs(self.router.best_venue("sell", NOW), self.rich)
+
+    def test_stale_venue_is_excluded(self) -> None:
+        self.cheap.set_top_of_book(99.0, 99.1, NOW - VENUE_STALE_SECONDS - 1)
+        self.assertIsNone(self.cheap.top_of_book("buy", NOW))
+        self.assertIs(self.router.best_venue("buy", NOW), self.primary)
+
+    def test_primary_without_fresh_quotes(self) -> None:
+        later = NOW + VENUE_STALE_SECONDS + 1
+        self.assertIs(self.router.best_venue("buy", later), self.primary)
+        self.assertIs(self.router.best_venue("sell", later), self.primary)
+
+
+class VenueErrorTest(IsolatedAsyncioTestCase):
+    """A venue whose ticker stream fails goes stale and is routed around"""
+
+    async def test_failing_venue_falls_back(self) -> None:
+        client = FailingClient()
+        failing = Venue(name="failing", client=client)
+        failing.set_top_of_book(90.0, 90.1, NOW - VENUE_STALE_SECONDS - 1)
+        simulated = SimulatedVenue(name="simulated", bid=100.0, ask=100.1)
+        simulated.set_top_of_book(100.0, 100.1, NOW)
+        router = VenueRouter([failing, simulated])
+
+        task = create_task(failing.stream_top_of_book())
+        await sleep(0)
+        task.cancel()
+
+        # the failed request neither raised nor refreshed the old quote
+        self.assertEqual(client.nr_of_requests, 1)
+        self.assertEqual(failing.ask, 90.1)
+        self.assertIs(router.best_venue("buy", NOW), simulated)
+        self.assertIs(router.best_venue("sell", NOW), simulated)
+
+        # without any fresh quote the order stays on the primary venue
+        simulated.set_top_of_book(100.0, 100.1, NOW - VENUE_STALE_SECONDS - 1)
+        self.assertIs(router.best_venue("buy", NOW), failing)
+
+
+if __name__ == "__main__":
+    main()
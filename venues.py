@@ -0,0 +1,492 @@
+from asyncio import sleep
+import ccxt.pro as ccxt
+from decouple import config, Csv
+from logger import logger
+from order_book import ExpectedFill, OrderBook
+from time import time
+from typing import Callable, Dict, List, Tuple
+
+
+TICKER: str = "BTC/USDT:USDT"
+
+# position sizes are calculated in BloFin contracts of 0.001 BTC
+BLOFIN_CONTRACT_SIZE = 0.001
+
+# the first venue is the primary venue used for candles, tickers and balance, every
+# other venue needs <VENUE>_API_KEY, <VENUE>_SECRET_KEY and <VENUE>_PASSPHRASE
+VENUES = config("VENUES", cast=Csv(), default="blofin")
+logger.info(f"{VENUES=}")
+VENUE_STALE_SECONDS = config("VENUE_STALE_SECONDS", cast=float, default="5")
+logger.info(f"{VENUE_STALE_SECONDS=}")
+
+MAIN_ACCOUNT = "main"
+
+CLIENT_POOL: Dict[Tuple[str, str], ccxt.Exchange] = {}
+
+
+def get_client(venue: str = "blofin", account: str = MAIN_ACCOUNT) -> ccxt.Exchange:
+    """Return the pooled ccxt client of a venue and account, creating it on first
+    use"""
+
+    if (venue, account) not in CLIENT_POOL:
+        suffix = "" if account == MAIN_ACCOUNT else f"_{account.upper()}"
+        CLIENT_POOL[(venue, account)] = getattr(ccxt, venue)(
+            config={
+                "apiKey": config(f"{venue.upper()}_API_KEY{suffix}"),
+                "secret": config(f"{venue.upper()}_SECRET_KEY{suffix}"),
+                "password": config(f"{venue.upper()}_PASSPHRASE{suffix}", default=""),
+            }
+        )
+    return CLIENT_POOL[(venue, account)]
+
+
+class Venue:
+    """Venue class to wrap the ccxt calls the exchange uses for a single symbol on a
+    single exchange"""
+
+    def __init__(
+        self,
+        name: str,
+        client: ccxt.Exchange,
+        symbol: str = TICKER,
+        hedge_mode: bool = True,
+    ) -> None:
+        self.name = name
+        self.client = client
+        self.symbol = symbol
+        self.hedge_mode = hedge_mode
+        self.contract_size = BLOFIN_CONTRACT_SIZE
+        self.bid: float | None = None
+        self.ask: float | None = None
+        self.updated_at = 0.0
+        self.order_book = OrderBook()
+        self.tick_listeners: List[Callable[["Venue"], None]] = []
+
+    @classmethod
+    def from_config(cls, name: str, account: str = MAIN_ACCOUNT) -> "Venue":
+        """Create the venue from the environment variables of the venue"""
+
+        return cls(
+            name=name,
+            client=get_client(name, account),
+            symbol=config(f"{name.upper()}_SYMBOL", default=TICKER),
+            hedge_mode=config(f"{name.upper()}_HEDGE_MODE", cast=bool, default=True),
+        )
+
+    @property
+    def has(self) -> dict:
+        """Return the capabilities of the ccxt client"""
+
+        return self.client.has
+
+    async def load_markets(self) -> None:
+        """Load the markets and the contract size of the symbol"""
+
+        markets = await self.client.load_markets()
+        contract_size = markets.get(self.symbol, {}).get("contractSize")
+        if contract_size:
+            self.contract_size = float(contract_size)
+
+    async def ping(self) -> None:
+        """Send a lightweight request to keep the connections warm"""
+
+        await self.client.fetch_ticker(symbol=self.symbol)
+        if self.has.get("watchTicker"):
+            await self.client.watch_ticker(symbol=self.symbol)
+
+    async def fetch_ticker(self) -> dict:
+        """Fetch the ticker of the symbol"""
+
+        return await self.client.fetch_ticker(symbol=self.symbol)
+
+    async def fetch_ohlcv(self, timeframe: str, limit: int) -> List[list]:
+        """Fetch the last candles of the symbol"""
+
+        return await self.client.fetch_ohlcv(
+            symbol=self.symbol, timeframe=timeframe, since=None, limit=limit
+        )
+
+    async def fetch_balance(self) -> dict:
+        """Fetch the balance of the account"""
+
+        return await self.client.fetch_balance()
+
+    async def fetch_positions(self) -> List[dict]:
+        """Fetch the open positions of the symbol"""
+
+        return await self.client.fetch_positions(symbols=[self.symbol])
+
+    async def fetch_open_orders(self, params: dict | None = None) -> List[dict]:
+        """Fetch the open orders"""
+
+        return await self.client.fetch_open_orders(params=params or {})
+
+    async def fetch_my_trades(self, since: float) -> List[dict]:
+        """Fetch the trades of the account since a unix timestamp"""
+
+        return await self.client.fetch_my_trades(
+            symbol=self.symbol, since=int(since * 1000)
+        )
+
+    async def fetch_order_by_client_id(self, client_order_id: str) -> dict | None:
+        """Return the open or recently closed order with the client order id, or None
+        when the exchange never received it"""
+
+        orders = await self.client.fetch_open_orders(symbol=self.symbol)
+        if self.has.get("fetchClosedOrders"):
+            orders += await self.client.fetch_closed_orders(
+                symbol=self.symbol, limit=20
+            )
+        for order in orders:
+            if order.get("clientOrderId") == client_order_id:
+                return order
+        return None
+
+    async def set_leverage(self, leverage: int, direction: str) -> dict:
+        """Set the isolated leverage for a direction"""
+
+        params = {"marginMode": "isolated"}
+        if self.hedge_mode:
+            params["positionSide"] = direction
+        return await self.client.set_leverage(
+            symbol=self.symbol, leverage=leverage, params=params
+        )
+
+    def order_params(
+        self, direction: str, stoploss_price: float, takeprofit_price: float
+    ) -> dict:
+        """Return the order params with the attached stop loss and take profit"""
+
+        params = dict(
+            marginMode="isolated",
+            stopLoss=dict(reduceOnly=True, triggerPrice=stoploss_price),
+            takeProfit=dict(reduceOnly=True, triggerPrice=takeprofit_price),
+        )
+        if self.hedge_mode:
+            params["positionSide"] = direction
+        return params
+
+    def to_venue_amount(self, amount: float) -> float:
+        """Convert an amount in BloFin contracts to contracts of this venue"""
+
+        if self.contract_size == BLOFIN_CONTRACT_SIZE:
+            return amount
+        return round(amount * BLOFIN_CONTRACT_SIZE / self.contract_size, 6)
+
+    async def create_order(
+        self,
+        type: str,
+        side: str,
+        amount: float,
+        price: float | None = None,
+        params: dict | None = None,
+        websocket: bool = False,
+    ) -> dict:
+        """Create an order, over the websocket trading channel if asked for and
+        supported"""
+
+        create_order = self.client.create_order
+        if websocket and self.has.get("createOrderWs"):
+            create_order = self.client.create_order_ws
+        return await create_order(
+            symbol=self.symbol,
+            type=type,
+            side=side,
+            amount=amount,
+            price=price,
+            params=params or {},
+        )
+
+    async def create_tpsl_order(
+        self,
+        direction: str,
+        amount: float,
+        stoploss_price: float,
+        takeprofit_price: float,
+    ) -> dict:
+        """Create a reduce only stop loss and take profit order for a position, both
+        trigger a market order"""
+
+        # ccxt only sends one of stopLossPrice and takeProfitPrice to the tpsl
+        # endpoint, so both legs are passed as the blofin fields, -1 is a market order
+        params = dict(
+            tpsl=True,
+            marginMode="isolated",
+            reduceOnly="true",
+            slTriggerPrice=str(stoploss_price),
+            slOrderPrice="-1",
+            tpTriggerPrice=str(takeprofit_price),
+            tpOrderPrice="-1",
+        )
+        if self.hedge_mode:
+            params["positionSide"] = direction
+        return await self.client.create_order(
+            symbol=self.symbol,
+            type="market",
+            side="sell" if direction == "long" else "buy",
+            amount=amount,
+            price=None,
+            params=params,
+        )
+
+    async def cancel_tpsl_orders(self, ids: List[str]) -> List[dict]:
+        """Cancel stop loss and take profit orders in a single batch request"""
+
+        return await self.client.cancel_orders(
+            ids=ids, symbol=self.symbol, params={"tpsl": True}
+        )
+
+    def set_top_of_book(
+        self, bid: float | None, ask: float | None, timestamp: float | None = None
+    ) -> None:
+        """Update the streamed top of book at timestamp and notify the tick
+        listeners"""
+
+        self.bid, self.ask = bid, ask
+        self.updated_at = timestamp if timestamp is not None else time()
+        for listener in self.tick_listeners:
+            listener(self)
+
+    async def stream_top_of_book(self) -> None:
+        """Keep the top of book up to date from the websocket ticker"""
+
+        while True:
+            try:
+                ticker = await self.client.watch_ticker(symbol=self.symbol)
+
+                # the exchange time of the quote, the clock the cycles run on
+                timestamp = ticker.get("timestamp")
+                self.set_top_of_book(
+                    ticker.get("bid"),
+                    ticker.get("ask"),
+                    timestamp / 1000 if timestamp else None,
+                )
+            except Exception as e:
+                logger.warning(f"Error streaming {self.name} top of book: {e}")
+                await sleep(1)
+
+    async def stream_order_book(self) -> None:
+        """Keep the local order book up to date from the websocket order book"""
+
+        while True:
+            try:
+                book = await self.client.watch_order_book(
+                    symbol=self.symbol, limit=self.order_book.depth
+                )
+                timestamp = book.get("timestamp")
+                self.order_book.apply_levels(
+                    book.get("bids", []),
+                    book.get("asks", []),
+                    timestamp / 1000 if timestamp else None,
+                )
+            except Exception as e:
+                logger.warning(f"Error streaming {self.name} order book: {e}")
+                await sleep(1)
+
+    def get_expected_fill(
+        self, side: str, amount: float, now: float | None = None
+    ) -> ExpectedFill | None:
+        """Return the expected fill of a market order from the local order book, or
+        None when the book is stale at timestamp now"""
+
+        now = now if now is not None else time()
+        if now - self.order_book.updated_at > VENUE_STALE_SECONDS:
+            return None
+        return self.order_book.expected_fill(side, amount)
+
+    def top_of_book(self, side: str, now: float | None = None) -> float | None:
+        """Return the streamed price an order of the side would trade against, or
+        None when the quote is stale at timestamp now"""
+
+        now = now if now is not None else time()
+        if now - self.updated_at > VENUE_STALE_SECONDS:
+            return None
+        return self.ask if side == "buy" else self.bid
+
+
+class SimulatedVenue(Venue):
+    """Local venue that fills every order at its top of book, to run the execution
+    layer without an exchange"""
+
+    def __init__(
+        self,
+        name: str = "simulated",
+        symbol: str = TICKER,
+        bid: float = 100_000.0,
+        ask: float = 100_000.1,
+        balance: float = 1_000.0,
+        latency: float = 0.0,
+    ) -> None:
+        super().__init__(name=name, client=None, symbol=symbol)
+        self.balance = balance
+        self.latency = latency
+        self.leverage: Dict[str, int] = {}
+        self.candles: List[list] = []
+        self.orders: List[dict] = []
+        self.tpsl_orders: List[dict] = []
+        self.nr_of_tpsl_orders = 0
+        self.positions: List[dict] = []
+        self.set_top_of_book(bid, ask)
+
+    @property
+    def has(self) -> dict:
+        return {}
+
+    async def load_markets(self) -> None:
+        await sleep(self.latency)
+
+    async def ping(self) -> None:
+        await sleep(self.latency)
+
+    async def fetch_ticker(self) -> dict:
+        await sleep(self.latency)
+        return dict(
+            symbol=self.symbol,
+            bid=self.bid,
+            ask=self.ask,
+            timestamp=int(time() * 1000),
+        )
+
+    async def fetch_ohlcv(self, timeframe: str, limit: int) -> List[list]:
+        await sleep(self.latency)
+        return self.candles[-limit:]
+
+    async def fetch_balance(self) -> dict:
+        await sleep(self.latency)
+        return {"USDT": {"total": self.balance}}
+
+    async def fetch_positions(self) -> List[dict]:
+        await sleep(self.latency)
+        return self.positions
+
+    async def fetch_open_orders(self, params: dict | None = None) -> List[dict]:
+        await sleep(self.latency)
+        return list(self.tpsl_orders) if (params or {}).get("tpsl") else []
+
+    async def fetch_my_trades(self, since: float) -> List[dict]:
+        await sleep(self.latency)
+        return [
+            dict(
+                side=order["side"],
+                amount=order["amount"],
+                price=order["average"],
+                timestamp=order["timestamp"],
+            )
+            for order in self.orders
+            if order["timestamp"] >= since * 1000
+        ]
+
+    async def fetch_order_by_client_id(self, client_order_id: str) -> dict | None:
+        await sleep(self.latency)
+        for order in self.orders:
+            if order["clientOrderId"] == client_order_id:
+                return order
+        return None
+
+    async def set_leverage(self, leverage: int, direction: str) -> dict:
+        await sleep(self.latency)
+        self.leverage[direction] = leverage
+        return dict(leverage=leverage, positionSide=direction)
+
+    async def create_order(
+        self,
+        type: str,
+        side: str,
+        amount: float,
+        price: float | None = None,
+        params: dict | None = None,
+        websocket: bool = False,
+    ) -> dict:
+        await sleep(self.latency)
+        order = dict(
+            id=str(len(self.orders) + 1),
+            symbol=self.symbol,
+            type=type,
+            side=side,
+            amount=amount,
+            price=price,
+            average=self.ask if side == "buy" else self.bid,
+            status="closed",
+            clientOrderId=(params or {}).get("clientOrderId"),
+            params=params or {},
+            timestamp=int(time() * 1000),
+        )
+        self.orders.append(order)
+        if "stopLoss" in order["params"]:
+            await self.create_tpsl_order(
+                order["params"].get("positionSide", "net"),
+                amount,
+                order["params"]["stopLoss"]["triggerPrice"],
+                order["params"]["takeProfit"]["triggerPrice"],
+            )
+        return order
+
+    async def create_tpsl_order(
+        self,
+        direction: str,
+        amount: float,
+        stoploss_price: float,
+        takeprofit_price: float,
+    ) -> dict:
+        await sleep(self.latency)
+        self.nr_of_tpsl_orders += 1
+        order = dict(
+            id=f"tpsl-{self.nr_of_tpsl_orders}",
+            symbol=self.symbol,
+            amount=amount,
+            info=dict(
+                positionSide=direction,
+                size=str(amount),
+                slTriggerPrice=str(stoploss_price),
+                tpTriggerPrice=str(takeprofit_price),
+            ),
+        )
+        self.tpsl_orders.append(order)
+        return order
+
+    async def cancel_tpsl_orders(self, ids: List[str]) -> List[dict]:
+        await sleep(self.latency)
+        cancelled = [order for order in self.tpsl_orders if order["id"] in ids]
+        self.tpsl_orders = [
+            order for order in self.tpsl_orders if order["id"] not in ids
+        ]
+        return cancelled
+
+    async def stream_top_of_book(self) -> None:
+        while True:
+            await sleep(VENUE_STALE_SECONDS / 2)
+            self.updated_at = time()
+
+    async def stream_order_book(self) -> None:
+        while True:
+            await sleep(VENUE_STALE_SECONDS / 2)
+            self.order_book.updated_at = time()
+
+
+class VenueRouter:
+    """Routes an order to the venue with the best streamed top of book"""
+
+    def __init__(self, venues: List[Venue]) -> None:
+        self.venues = venues
+
+    @property
+    def primary(self) -> Venue:
+        """Return the primary venue"""
+
+        return self.venues[0]
+
+    def best_venue(self, side: str, now: float | None = None) -> Venue:
+        """Return the venue with the lowest ask for a buy or the highest bid for a
+        sell at timestamp now, falling back to the primary venue without fresh
+        quotes"""
+
+        quotes = [
+            (price, venue)
+            for venue in self.venues
+            if (price := venue.top_of_book(side, now)) is not None
+        ]
+        if len(self.venues) == 1 or not quotes:
+            return self.primary
+        if side == "buy":
+            return min(quotes, key=lambda quote: quote[0])[1]
+        return max(quotes, key=lambda quote: quote[0])[1]